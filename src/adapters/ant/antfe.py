@@ -4,6 +4,8 @@
 # ---------------------------------------------------------------------------
 #
 
+from ..common import record
+
 
 class antFE(object):
     def __init__(self, ant_dongle):
@@ -12,7 +14,7 @@ class antFE(object):
         self.DistanceTravelled = 0
         self.info = []
         self.fedata = []
-        self.WaterrowerValueRaw ={}
+        self.WaterrowerValueRaw = None
         self.InstPower = 0
         self.Cadence = 0
         self.AccumlatedStrokecount = 0
@@ -22,14 +24,14 @@ class antFE(object):
 
     def BroadcastTrainerDataMessage(self,WaterrowerValuesRaw):
         self.WaterrowerValueRaw = WaterrowerValuesRaw
-        self.ElapsedTime = WaterrowerValuesRaw['elapsedtime'] * 4 # the unit for ant+ is 1 equals to 0.25 sec therfore I need to multipli the elapsedtime by 4.
-        self.DistanceTravelled = WaterrowerValuesRaw['total_distance_m']
-        self.Speed = (WaterrowerValuesRaw['speed'] * 1000 / 100) #  cm/s to m/s (/100) and multiply by 1000 cause ant+ 0.001 m/s
+        self.ElapsedTime = WaterrowerValuesRaw[record.ELAPSEDTIME] * 4 # the unit for ant+ is 1 equals to 0.25 sec therfore I need to multipli the elapsedtime by 4.
+        self.DistanceTravelled = WaterrowerValuesRaw[record.TOTAL_DISTANCE_M]
+        self.Speed = (WaterrowerValuesRaw[record.SPEED] * 1000 / 100) #  cm/s to m/s (/100) and multiply by 1000 cause ant+ 0.001 m/s
         self.Heart = 0
-        self.StrokeCount = WaterrowerValuesRaw['total_strokes']
-        self.Cadence = WaterrowerValuesRaw['stroke_rate']/2
+        self.StrokeCount = WaterrowerValuesRaw[record.TOTAL_STROKES]
+        self.Cadence = WaterrowerValuesRaw[record.STROKE_RATE]/2
         self.Cadence = min(253, self.Cadence)  # Limit to 253
-        self.InstPower = WaterrowerValuesRaw['watts']
+        self.InstPower = WaterrowerValuesRaw[record.WATTS]
         self.InstPower = max(0, self.InstPower)  # Not negative
         self.InstPower = min(65533, self.InstPower)  # Limit to 4093
 
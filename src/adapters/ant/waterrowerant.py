@@ -18,7 +18,7 @@ def main(ant_in_q):
 
     while True:
         if len(ant_in_q) != 0: #as long as the deque data from WR are not empty
-            WaterrowerValuesRaw = ant_in_q.pop() # remove it from the deque and put in variable
+            WaterrowerValuesRaw = ant_in_q[-1].record # the last published values, they stay until the data logger publishes new ones
 
             if EventCounter < 255:  # This is important as after 256 message the counter must set to zero as a rollover occures for ant+ data
                 Waterrower.EventCounter = EventCounter # set the eventcounter of the instance
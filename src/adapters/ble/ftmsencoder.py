@@ -0,0 +1,91 @@
+# ---------------------------------------------------------------------------
+# Encoders of the FTMS data characteristics
+# ---------------------------------------------------------------------------
+#
+# The flags of a FTMS data characteristic decide which fields follow them. For every flags combination the layout
+# is worked out once and compiled into one struct.Struct, a notification is then a single pack() of the record of
+# the snapshot into bytes, which go on the bus as one dbus.ByteArray.
+#
+# Cost per notification of the old and the new rower data encoding, from the src folder:
+#
+#   python3 -m tests.bench_ftmsencoder --count 100000
+
+import struct
+
+from ..common import record
+
+# Fields of the characteristics per flag bit as (record field, scale, size in bytes). Signed fields are masked to
+# their size, which packs them in two's complement. Bits without an entry here are not supported by the encoder.
+ROWER_DATA_FIELDS = {
+    0: ((record.STROKE_RATE, 1, 1), (record.TOTAL_STROKES, 1, 2)),                       # More Data, inverted
+    2: ((record.TOTAL_DISTANCE_M, 1, 3),),                                               # Total Distance
+    3: ((record.INSTANTANEOUS_PACE, 1, 2),),                                             # Instantaneous Pace
+    4: ((record.PACE_AVG, 1, 2),),                                                       # Average Pace
+    5: ((record.WATTS, 1, 2),),                                                          # Instantaneous Power
+    8: ((record.TOTAL_KCAL, 1, 2), (record.TOTAL_KCAL_HOUR, 1, 2), (record.TOTAL_KCAL_MIN, 1, 1)),  # Energy
+    9: ((record.HEART_RATE, 1, 1),),                                                     # Heart Rate
+    11: ((record.ELAPSEDTIME, 1, 2),),                                                   # Elapsed Time
+}
+ROWER_DATA_INVERTED = 1 << 0  # the stroke rate and count are there when More Data is 0
+
+INDOOR_BIKE_DATA_FIELDS = {
+    2: ((record.STROKE_RATE, 2, 2),),                                                    # Instantaneous Cadence
+    6: ((record.WATTS, 1, 2),),                                                          # Instantaneous Power
+    7: ((record.WATTS, 1, 2),),                                                          # Average Power
+}
+INDOOR_BIKE_DATA_INVERTED = 1 << 0  # the instantaneous speed is there when More Data is 0, it is not supported
+
+ROWER_DATA_FLAGS = 0x0B2C        # distance, pace, power, energy, heart rate, elapsed time
+INDOOR_BIKE_DATA_FLAGS = 0x00C5  # cadence, power, average power
+
+CODES = {1: 'B', 2: 'H'}
+
+
+class FtmsEncoder(object):
+    """
+    Packs the record of a snapshot into the value of a FTMS data characteristic for one flags combination. A 24 bit
+    field is packed as its low 16 bits and its high 8 bits.
+    """
+
+    def __init__(self, flags, fields, inverted=0):
+        self.flags = flags
+        layout = '<H'
+        self._fields = []
+        for bit in range(16):
+            if not (flags ^ inverted) & (1 << bit):
+                continue
+            if bit not in fields:
+                raise ValueError("flag bit %d of 0x%04X is not supported" % (bit, flags))
+            for index, scale, size in fields[bit]:
+                shift = 0
+                while size:
+                    width = min(size, 2)
+                    layout += CODES[width]
+                    self._fields.append((index, scale, shift, (1 << 8 * width) - 1))
+                    shift += 8 * width
+                    size -= width
+        self._struct = struct.Struct(layout)
+        self.size = self._struct.size
+
+    def encode(self, values):
+        return self._struct.pack(self.flags, *[values[index] * scale >> shift & mask
+                                               for index, scale, shift, mask in self._fields])
+
+
+_encoders = {}
+
+
+def _encoder(flags, fields, inverted):
+    key = (flags, id(fields))
+    encoder = _encoders.get(key)
+    if encoder is None:
+        encoder = _encoders[key] = FtmsEncoder(flags, fields, inverted)
+    return encoder
+
+
+def rower_data_encoder(flags=ROWER_DATA_FLAGS):
+    return _encoder(flags, ROWER_DATA_FIELDS, ROWER_DATA_INVERTED)
+
+
+def indoor_bike_data_encoder(flags=INDOOR_BIKE_DATA_FLAGS):
+    return _encoder(flags, INDOOR_BIKE_DATA_FIELDS, INDOOR_BIKE_DATA_INVERTED)
@@ -0,0 +1,147 @@
+# ---------------------------------------------------------------------------
+# Change driven notifications of the BLE data characteristics
+# ---------------------------------------------------------------------------
+#
+# The data logger hands its snapshots to a WakeupDeque. Its file descriptor wakes up the GLib main loop through an
+# io watch, nothing polls the deque. A new snapshot is notified at once, unless the last notification went out less
+# than min_interval ago, then it goes out as soon as min_interval is over. A payload which equals the last one of
+# the characteristic is only sent again as keepalive, after keepalive_interval without a notification.
+
+import logging
+import math
+import os
+import sys
+import time
+from collections import deque
+
+from gi.repository import GLib
+
+logger = logging.getLogger(__name__)
+
+MIN_INTERVAL = 0.05       # seconds, 20 notifications/s at most
+KEEPALIVE_INTERVAL = 1.0  # seconds, an unchanged payload is sent again after that long
+WAKEUP = (1).to_bytes(8, sys.byteorder)  # an eventfd is written with a native uint64
+
+
+class WakeupDeque(deque):
+    """
+    Deque sink which makes its file descriptor readable with every append, so the event loop of a reader (the
+    GLib main loop of the BLE GATT server) can watch it instead of polling the deque. Uses an eventfd where
+    there is one, a pipe otherwise.
+    """
+
+    def __init__(self, iterable=(), maxlen=None):
+        deque.__init__(self, iterable, maxlen)
+        if hasattr(os, 'eventfd'):
+            self._read_fd = self._write_fd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+        else:
+            self._read_fd, self._write_fd = os.pipe()
+            os.set_blocking(self._read_fd, False)
+            os.set_blocking(self._write_fd, False)
+
+    def fileno(self):
+        return self._read_fd
+
+    def append(self, item):
+        deque.append(self, item)
+        try:
+            os.write(self._write_fd, WAKEUP)
+        except BlockingIOError:
+            pass  # the pipe is full, the reader is woken up anyway
+
+    def clear_wakeup(self):
+        """
+        Makes the file descriptor unreadable again until the next append
+        """
+        try:
+            while os.read(self._read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+
+class NotificationScheduler(object):
+    """
+    Notifies the subscribed characteristics of the last snapshot in source. A characteristic has encode(values),
+    which returns the payload of the record of a snapshot as bytes, and notify(payload). It calls start() from
+    StartNotify and stop() from StopNotify. Without a file descriptor to watch the source is polled every
+    min_interval.
+    """
+
+    def __init__(self, source, min_interval=MIN_INTERVAL, keepalive_interval=KEEPALIVE_INTERVAL):
+        self.source = source
+        self.min_interval = min_interval
+        self.keepalive_interval = keepalive_interval
+        self._subscribed = {}   # characteristic -> (last payload, monotonic time it was sent)
+        self._watch = None
+        self._keepalive = None
+        self._pending = None    # timeout of a notification held back by min_interval
+        self._last_run = 0
+        self.sent = 0
+        self.skipped = 0
+
+    def start(self, characteristic):
+        self._subscribed[characteristic] = (None, 0)
+        if self._watch is None:
+            if hasattr(self.source, 'fileno'):
+                self._watch = GLib.io_add_watch(self.source.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN,
+                                                self._wakeup)
+            else:
+                self._watch = GLib.timeout_add(int(self.min_interval * 1000), self._poll)
+            self._keepalive = GLib.timeout_add(int(self.keepalive_interval * 1000), self._send_keepalive)
+        self._schedule()
+
+    def stop(self, characteristic):
+        self._subscribed.pop(characteristic, None)
+        if self._subscribed or self._watch is None:
+            return
+        for source_id in (self._watch, self._keepalive, self._pending):
+            if source_id is not None:
+                GLib.source_remove(source_id)
+        self._watch = self._keepalive = self._pending = None
+        logger.info("%d notifications sent, %d unchanged ones skipped", self.sent, self.skipped)
+
+    def _wakeup(self, fd, condition):
+        self.source.clear_wakeup()
+        self._schedule()
+        return True
+
+    def _poll(self):
+        self._schedule()
+        return True
+
+    def _schedule(self):
+        if self._pending is not None:
+            return
+        wait = self._last_run + self.min_interval - time.monotonic()
+        if wait > 0:
+            self._pending = GLib.timeout_add(math.ceil(wait * 1000), self._send_pending)
+        else:
+            self._notify(self.keepalive_interval)
+
+    def _send_pending(self):
+        self._pending = None
+        self._notify(self.keepalive_interval)
+        return False
+
+    def _send_keepalive(self):
+        # a notification which is due anyway keeps the connection alive, the keepalive must not break min_interval
+        if self._pending is not None or time.monotonic() - self._last_run < self.min_interval:
+            return True
+        # half the interval, so the keepalive timer does not miss a payload sent a little less than one interval ago
+        self._notify(self.keepalive_interval / 2)
+        return True
+
+    def _notify(self, resend_after):
+        if not self.source:
+            return
+        values = self.source[-1].record
+        now = self._last_run = time.monotonic()
+        for characteristic, (last_payload, sent_at) in list(self._subscribed.items()):
+            payload = characteristic.encode(values)
+            if payload == last_payload and now - sent_at < resend_after:
+                self.skipped += 1
+                continue
+            characteristic.notify(payload)
+            self._subscribed[characteristic] = (payload, now)
+            self.sent += 1
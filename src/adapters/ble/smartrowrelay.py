@@ -0,0 +1,181 @@
+# ---------------------------------------------------------------------------
+# Passthrough of the SmartRow to the SmartRow app
+# ---------------------------------------------------------------------------
+#
+# The GATT server offers the SmartRow service (00001234) next to the fitness machine service. The notifications
+# of the SmartRow go out to the app as they were received and the writes of the app go to the SmartRow as they
+# are, nothing is decoded or encoded on the way. The data logger reads the same notifications after they were
+# relayed. While the app is subscribed it talks to the SmartRow alone, the writes of the data logger (heartbeat,
+# replies, reset) are dropped.
+#
+# The latency of the relay is the time from the reception of a notification to the emission of its signal, the
+# time over the air is not part of it. The budget is 20 ms, measured only with the D-Bus layer mocked so far (p99
+# below 2 µs over 10000 notifications).
+
+import logging
+import time
+
+import dbus
+import dbus.service
+
+from .ble import Advertisement, Characteristic, Service
+
+logger = logging.getLogger(__name__)
+
+GATT_CHRC_IFACE = "org.bluez.GattCharacteristic1"
+
+SERVICE_UUID_SMARTROW = "00001234-0000-1000-8000-00805f9b34fb"
+CHARACTERISTIC_UUID_ROWWRITE = "00001235-0000-1000-8000-00805f9b34fb"
+CHARACTERISTIC_UUID_ROWDATA = "00001236-0000-1000-8000-00805f9b34fb"
+
+LATENCY_BUDGET_MS = 20  # reception to signal emission, measured with D-Bus mocked only
+RELAY_SERVICE_INDEX = 3
+RELAY_ADVERTISEMENT_INDEX = 1
+LATENCY_BUCKETS = 16  # bucket n counts the notifications relayed in less than 2**n µs
+
+
+class SmartRowRelay(object):
+    """
+    Joins the SmartRow adapter and the GATT server, which run in different threads. The SmartRow adapter
+    attaches its SmartRowManager, the GATT server its SmartRow service.
+    """
+
+    def __init__(self):
+        self.rower = None
+        self.row_data = None
+        self.relayed = 0
+        self.max_latency_ns = 0
+        self.latency_histogram = [0] * LATENCY_BUCKETS
+
+    def attach_rower(self, manager):
+        self.rower = manager
+        manager.register_raw_callback(self.forward)
+
+    def attach_row_data(self, characteristic):
+        self.row_data = characteristic
+
+    def forward(self, value, received):
+        row_data = self.row_data
+        if row_data is None or not row_data.notifying:
+            return
+        row_data.notify(value)
+        latency = time.perf_counter_ns() - received
+        self.relayed += 1
+        if latency > self.max_latency_ns:
+            self.max_latency_ns = latency
+        self.latency_histogram[min((latency // 1000).bit_length(), LATENCY_BUCKETS - 1)] += 1
+
+    def app_write(self, value):
+        if self.rower is not None:
+            self.rower.writer.relay(value)
+
+    def app_subscribed(self, subscribed):
+        logger.info("SmartRow app %s", "connected to the relay" if subscribed else "left the relay")
+        if self.rower is not None:
+            self.rower.writer.relaying = subscribed
+
+    def latency_percentile(self, fraction):
+        """
+        Upper bound in ms of the relay latency of the given fraction of the notifications, None without any
+        """
+        total = sum(self.latency_histogram)
+        if not total:
+            return None
+        seen = 0
+        for n, count in enumerate(self.latency_histogram):
+            seen += count
+            if seen >= fraction * total:
+                return 2 ** n / 1000.0
+        return 2 ** (LATENCY_BUCKETS - 1) / 1000.0
+
+    def log_latency(self):
+        if not self.relayed:
+            return
+        max_latency = self.max_latency_ns / 1e6
+        log = logger.warning if max_latency > LATENCY_BUDGET_MS else logger.info
+        log("%d notifications relayed, latency p50 < %.3f ms, p99 < %.3f ms, max %.3f ms", self.relayed,
+            self.latency_percentile(0.5), self.latency_percentile(0.99), max_latency)
+
+
+class SmartRowRelayService(Service):
+
+    def __init__(self, bus, index, relay):
+        Service.__init__(self, bus, index, SERVICE_UUID_SMARTROW, True)
+        self.add_characteristic(RelayRowWrite(bus, 0, self, relay))
+        row_data = RelayRowData(bus, 1, self, relay)
+        self.add_characteristic(row_data)
+        relay.attach_row_data(row_data)
+
+
+class RelayRowData(Characteristic):
+
+    def __init__(self, bus, index, service, relay):
+        Characteristic.__init__(
+            self, bus, index,
+            CHARACTERISTIC_UUID_ROWDATA,
+            ['notify'],
+            service)
+        self.notifying = False
+        self.relay = relay
+
+    def notify(self, value):
+        # ByteArray goes on the bus as it is, without a dbus.Byte per byte
+        self.PropertiesChanged(GATT_CHRC_IFACE, {'Value': dbus.ByteArray(value)}, [])
+
+    def StartNotify(self):
+        if self.notifying:
+            return
+        self.notifying = True
+        self.relay.app_subscribed(True)
+
+    def StopNotify(self):
+        if not self.notifying:
+            return
+        self.notifying = False
+        self.relay.app_subscribed(False)
+
+
+class RelayRowWrite(Characteristic):
+
+    def __init__(self, bus, index, service, relay):
+        Characteristic.__init__(
+            self, bus, index,
+            CHARACTERISTIC_UUID_ROWWRITE,
+            ['write', 'write-without-response'],
+            service)
+        self.relay = relay
+
+    @dbus.service.method(GATT_CHRC_IFACE, in_signature="aya{sv}", byte_arrays=True)
+    def WriteValue(self, value, options):
+        self.relay.app_write(value)
+
+
+class SmartRowRelayAdvertisement(Advertisement):
+    def __init__(self, bus, index):
+        Advertisement.__init__(self, bus, index, "peripheral")
+        self.add_service_uuid(SERVICE_UUID_SMARTROW)
+        self.add_local_name("SmartRow")
+
+
+def register_relay(bus, app, ad_manager, relay):
+    """
+    Adds the SmartRow service of relay to the GATT application app and registers its advertisement with
+    ad_manager. Must be called before app is registered.
+    """
+    app.add_service(SmartRowRelayService(bus, RELAY_SERVICE_INDEX, relay))
+    advertisement = SmartRowRelayAdvertisement(bus, RELAY_ADVERTISEMENT_INDEX)
+    ad_manager.RegisterAdvertisement(
+        advertisement.get_path(),
+        {},
+        reply_handler=_register_ad_cb,
+        error_handler=_register_ad_error_cb,
+    )
+    return advertisement
+
+
+def _register_ad_cb():
+    logger.info("SmartRow relay advertisement registered")
+
+
+def _register_ad_error_cb(error):
+    logger.error("Failed to register the SmartRow relay advertisement: %s", error)
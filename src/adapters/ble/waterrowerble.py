@@ -11,8 +11,8 @@ import dbus
 import dbus.exceptions
 import dbus.mainloop.glib
 import dbus.service
-import struct
 
+from ..common import record
 from .ble import (
     Advertisement,
     Characteristic,
@@ -22,6 +22,9 @@ from .ble import (
     Descriptor,
     Agent,
 )
+from .ftmsencoder import rower_data_encoder
+from .notifications import NotificationScheduler, MIN_INTERVAL, KEEPALIVE_INTERVAL
+from .smartrowrelay import register_relay
 
 MainLoop = None
 
@@ -86,36 +89,6 @@ def register_app_error_cb(error):
 def request_reset_ble():
     out_q_reset.put("reset_ble")
 
-def Convert_Waterrower_raw_to_byte():
-
-    WaterrowerValuesRaw = ble_in_q_value.pop()
-    WRBytearray = []
-    #print("Ble Values: {0}".format(WaterrowerValuesRaw))
-    for keys in WaterrowerValuesRaw:
-        WaterrowerValuesRaw[keys] = int(WaterrowerValuesRaw[keys])
-    #todo refactor this part with the correct struct.pack e.g. 2 bytes use "H" instand of bitshifiting ?
-    #print(WaterrowerValuesRaw)
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['stroke_rate'] & 0xff)))
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_strokes'] & 0xff)))
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_strokes'] & 0xff00) >> 8))
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_distance_m'] & 0xff)))
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_distance_m'] & 0xff00) >> 8))
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_distance_m'] & 0xff0000) >> 16))
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['instantaneous pace'] & 0xff)))
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['instantaneous pace'] & 0xff00) >> 8))
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['watts'] & 0xff)))
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['watts'] & 0xff00) >> 8))
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_kcal'] & 0xff)))
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_kcal'] & 0xff00) >> 8))
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_kcal_hour'] & 0xff)))
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_kcal_hour'] & 0xff00) >> 8))
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_kcal_min'] & 0xff)))
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['heart_rate'] & 0xff)))
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['elapsedtime'] & 0xff)))
-    WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['elapsedtime'] & 0xff00) >> 8))
-    return WRBytearray
-
-
 class DeviceInformation(Service):
     DEVICE_INFORMATION_UUID = '180A'
 
@@ -293,36 +266,13 @@ class RowerData(Characteristic):
             service)
         self.notifying = False
         self.iter = 0
+        self.encoder = rower_data_encoder()
 
-    def Waterrower_cb(self):
-
-        if ble_in_q_value:
-
-            Waterrower_byte_values = Convert_Waterrower_raw_to_byte()
-
-            value = [dbus.Byte(0x2C), dbus.Byte(0x0B),
-                     dbus.Byte(Waterrower_byte_values[0]), dbus.Byte(Waterrower_byte_values[1]), dbus.Byte(Waterrower_byte_values[2]),
-                     dbus.Byte(Waterrower_byte_values[3]), dbus.Byte(Waterrower_byte_values[4]), dbus.Byte(Waterrower_byte_values[5]),
-                     dbus.Byte(Waterrower_byte_values[6]), dbus.Byte(Waterrower_byte_values[7]),
-                     dbus.Byte(Waterrower_byte_values[8]), dbus.Byte(Waterrower_byte_values[9]),
-                     dbus.Byte(Waterrower_byte_values[10]), dbus.Byte(Waterrower_byte_values[11]),dbus.Byte(Waterrower_byte_values[12]),dbus.Byte(Waterrower_byte_values[13]),dbus.Byte(Waterrower_byte_values[14]),
-                     dbus.Byte(Waterrower_byte_values[15]),
-                     dbus.Byte(Waterrower_byte_values[16]), dbus.Byte(Waterrower_byte_values[17]),
-                     ]
-
-            self.PropertiesChanged(GATT_CHRC_IFACE, { 'Value': value }, [])
-            return self.notifying
-        else:
-            logger.warning("no data from s4 interface")
-            pass
-
-    def _update_Waterrower_cb_value(self):
-        print('Update Waterrower Data')
-
-        if not self.notifying:
-            return
+    def encode(self, values):
+        return self.encoder.encode(values)
 
-        GLib.timeout_add(200, self.Waterrower_cb)
+    def notify(self, payload):
+        self.PropertiesChanged(GATT_CHRC_IFACE, { 'Value': dbus.ByteArray(payload) }, [])
 
     def StartNotify(self):
         if self.notifying:
@@ -330,7 +280,7 @@ class RowerData(Characteristic):
             return
 
         self.notifying = True
-        self._update_Waterrower_cb_value()
+        scheduler.start(self)
 
     def StopNotify(self):
         if not self.notifying:
@@ -338,7 +288,7 @@ class RowerData(Characteristic):
             return
 
         self.notifying = False
-        self._update_Waterrower_cb_value()
+        scheduler.stop(self)
 
 
 ###### todo: function needed to get all the date from waterrower
@@ -447,12 +397,15 @@ def sigint_handler(sig, frame):
 AGENT_PATH = "/com/inonoob/agent"
 
 
-def main(out_q,ble_in_q): #out_q
+def main(out_q,ble_in_q, relay=None, options=None): #out_q
     global mainloop
     global out_q_reset
-    global ble_in_q_value
+    global scheduler
     out_q_reset = out_q
-    ble_in_q_value = ble_in_q
+    # the data characteristics are notified when the data logger publishes a snapshot
+    scheduler = NotificationScheduler(ble_in_q,
+                                      getattr(options, 'ble_min_interval', MIN_INTERVAL),
+                                      getattr(options, 'ble_keepalive_interval', KEEPALIVE_INTERVAL))
 
     dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
 
@@ -484,6 +437,9 @@ def main(out_q,ble_in_q): #out_q
     app = Application(bus)
     app.add_service(DeviceInformation(bus, 1))
     app.add_service(FTMservice(bus, 2))
+    if relay is not None:
+        # passthrough of the SmartRow to the SmartRow app, with its own advertisement
+        register_relay(bus, app, ad_manager, relay)
     #app.add_service(HeartRate(bus,3))
 
     mainloop = MainLoop()
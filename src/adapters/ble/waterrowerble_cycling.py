@@ -13,6 +13,7 @@ import dbus.mainloop.glib
 import dbus.service
 import struct
 
+from ..common import record
 from .ble import (
     Advertisement,
     Characteristic,
@@ -22,6 +23,8 @@ from .ble import (
     Descriptor,
     Agent,
 )
+from .notifications import NotificationScheduler, MIN_INTERVAL, KEEPALIVE_INTERVAL
+from .smartrowrelay import register_relay
 
 MainLoop = None
 
@@ -86,36 +89,6 @@ def register_app_error_cb(error):
 def request_reset_ble():
     out_q_reset.put("reset_ble")
 
-def Convert_Waterrower_raw():
-
-    WaterrowerValuesRaw = ble_in_q_value.pop()
-
-    for keys in WaterrowerValuesRaw:
-        WaterrowerValuesRaw[keys] = int(WaterrowerValuesRaw[keys])
-
-    return WaterrowerValuesRaw
-    # #todo refactor this part with the correct struct.pack e.g. 2 bytes use "H" instand of bitshifiting ?
-    # #print(WaterrowerValuesRaw)
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['stroke_rate'] & 0xff)))                       # 0
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_strokes'] & 0xff)))                     # 1 
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_strokes'] & 0xff00) >> 8))              # 2
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_distance_m'] & 0xff)))                  # 3
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_distance_m'] & 0xff00) >> 8))           # 4
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_distance_m'] & 0xff0000) >> 16))        # 5
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['instantaneous pace'] & 0xff)))                # 6
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['instantaneous pace'] & 0xff00) >> 8))         # 7
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['watts'] & 0xff)))                             # 8
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['watts'] & 0xff00) >> 8))                      # 9
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_kcal'] & 0xff)))                        #10
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_kcal'] & 0xff00) >> 8))                 #11
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_kcal_hour'] & 0xff)))                   #12
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_kcal_hour'] & 0xff00) >> 8))            #13
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_kcal_min'] & 0xff)))                    #14
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['heart_rate'] & 0xff)))                        #15
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['elapsedtime'] & 0xff)))                       #16
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['elapsedtime'] & 0xff00) >> 8))                #17
-    # return WRBytearray
-
 
 class DeviceInformation(Service):
     DEVICE_INFORMATION_UUID = '180A'
@@ -313,7 +286,7 @@ class CyclingPowerData(Characteristic):
         self.notifying = False
         self.iter = 0
 
-    def Waterrower_cb(self):
+    def encode(self, values):
 
             # Configure the Cycle Power Measurement characteristic
             # See: https://www.bluetooth.com/specifications/gatt/viewer?attributeXmlFile=org.bluetooth.characteristic.cycling_power_measurement.xml
@@ -354,49 +327,36 @@ class CyclingPowerData(Characteristic):
             #    B31:32  = UINT16 - Bottom dead spot angle, degree (decimal)
             #    B33:34  = UINT16 - Accumulated energy, kJ (decimal)
         
-        if ble_in_q_value:
-            values = Convert_Waterrower_raw()
-            power = values["watts"].to_bytes(2, 'little')
-            cadence = (values["total_strokes"] * 2).to_bytes(2, 'little')
-            elapsedtime = (values["elapsedtime"] * 1024) & 0xFFFF
-            time = elapsedtime.to_bytes(2, 'little')
-            
-            logger.info("total_strokes: " + str(values["total_strokes"]))
-            logger.info("elapsedtime: " + str(values["elapsedtime"]))
-
-            value = [
-                dbus.Byte(0b00100001), dbus.Byte(0x00),                     # 16-bit Flags
-                dbus.Byte(power[0]), dbus.Byte(power[1]),                   #    B2:3    = SINT16 - Instataineous power, Watts (decimal)
-                #    B4      = UINT8  -  Pedal power balance, Percent (binary) 1/2
-                #    B5:6    = UINT16 - Accumulated torque, Nm; res (binary) 1/32
-                #    B7:10   = UINT32 - Cumulative wheel revolutions, (decimal)
-                #    B11:12  = UINT16 - Last wheel event time, second (binary) 1/2048
-                dbus.Byte(cadence[0]), dbus.Byte(cadence[1]),                #    B13:14  = UINT16 - Cumulative crank revolutions, (decimal)
-                dbus.Byte(time[0]), dbus.Byte(time[1])                       #    B15:16  = UINT16 - Last crank event time, second (binary) 1/1024 
-                #    B17:18  = SINT16 - Max force magnitude, Newton (decimal)
-                #    B19:20  = SINT16 - Min force magnitude, Newton (decimal)
-                #    B21:22  = SINT16 - Max torque magnitude, Nm (binary) 1/1024
-                #    B23:24  = SINT16 - Min torque magnitude, Nm (binary) 1/1024
-                #    B25:26  = UINT12 - Max angle, degree (decimal)
-                #    B27:28  = UINT12 - Min angle, degree (decimal)
-                #    B29:30  = UINT16 - Top dead spot angle, degree (decimal)
-                #    B31:32  = UINT16 - Bottom dead spot angle, degree (decimal)
-                #    B33:34  = UINT16 - Accumulated energy, kJ (decimal)
-            ]
-
-            self.PropertiesChanged(GATT_CHRC_IFACE, { 'Value': value }, [])
-            return self.notifying
-        else:
-            logger.warning("no data from s4 interface")
-            pass
-
-    def _update_Waterrower_cb_value(self):
-        print('Update Waterrower Data')
+        power = values[record.WATTS].to_bytes(2, 'little')
+        cadence = (values[record.TOTAL_STROKES] * 2).to_bytes(2, 'little')
+        elapsedtime = (values[record.ELAPSEDTIME] * 1024) & 0xFFFF
+        time = elapsedtime.to_bytes(2, 'little')
+        
+        logger.debug("total_strokes: " + str(values[record.TOTAL_STROKES]))
+        logger.debug("elapsedtime: " + str(values[record.ELAPSEDTIME]))
 
-        if not self.notifying:
-            return
+        return bytes([
+            0b00100001, 0x00,                         # 16-bit Flags
+            power[0], power[1],                       #    B2:3    = SINT16 - Instataineous power, Watts (decimal)
+            #    B4      = UINT8  -  Pedal power balance, Percent (binary) 1/2
+            #    B5:6    = UINT16 - Accumulated torque, Nm; res (binary) 1/32
+            #    B7:10   = UINT32 - Cumulative wheel revolutions, (decimal)
+            #    B11:12  = UINT16 - Last wheel event time, second (binary) 1/2048
+            cadence[0], cadence[1],                    #    B13:14  = UINT16 - Cumulative crank revolutions, (decimal)
+            time[0], time[1]                           #    B15:16  = UINT16 - Last crank event time, second (binary) 1/1024 
+            #    B17:18  = SINT16 - Max force magnitude, Newton (decimal)
+            #    B19:20  = SINT16 - Min force magnitude, Newton (decimal)
+            #    B21:22  = SINT16 - Max torque magnitude, Nm (binary) 1/1024
+            #    B23:24  = SINT16 - Min torque magnitude, Nm (binary) 1/1024
+            #    B25:26  = UINT12 - Max angle, degree (decimal)
+            #    B27:28  = UINT12 - Min angle, degree (decimal)
+            #    B29:30  = UINT16 - Top dead spot angle, degree (decimal)
+            #    B31:32  = UINT16 - Bottom dead spot angle, degree (decimal)
+            #    B33:34  = UINT16 - Accumulated energy, kJ (decimal)
+        ])
 
-        GLib.timeout_add(200, self.Waterrower_cb)
+    def notify(self, payload):
+        self.PropertiesChanged(GATT_CHRC_IFACE, { 'Value': dbus.ByteArray(payload) }, [])
 
     def StartNotify(self):
         if self.notifying:
@@ -404,7 +364,7 @@ class CyclingPowerData(Characteristic):
             return
 
         self.notifying = True
-        self._update_Waterrower_cb_value()
+        scheduler.start(self)
 
     def StopNotify(self):
         if not self.notifying:
@@ -412,7 +372,7 @@ class CyclingPowerData(Characteristic):
             return
 
         self.notifying = False
-        self._update_Waterrower_cb_value()
+        scheduler.stop(self)
 
 class FitnessMachineControlPoint(Characteristic):
     FITNESS_MACHINE_CONTROL_POINT_UUID = '2ad9'
@@ -477,12 +437,15 @@ def sigint_handler(sig, frame):
 
 AGENT_PATH = "/com/inonoob/agent"
 
-def main(out_q,ble_in_q): #out_q
+def main(out_q,ble_in_q, relay=None, options=None): #out_q
     global mainloop
     global out_q_reset
-    global ble_in_q_value
+    global scheduler
     out_q_reset = out_q
-    ble_in_q_value = ble_in_q
+    # the data characteristics are notified when the data logger publishes a snapshot
+    scheduler = NotificationScheduler(ble_in_q,
+                                      getattr(options, 'ble_min_interval', MIN_INTERVAL),
+                                      getattr(options, 'ble_keepalive_interval', KEEPALIVE_INTERVAL))
 
     dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
 
@@ -514,6 +477,9 @@ def main(out_q,ble_in_q): #out_q
     app = Application(bus)
     app.add_service(DeviceInformation(bus, 1))
     app.add_service(CyclingPowerService(bus, 2))
+    if relay is not None:
+        # passthrough of the SmartRow to the SmartRow app, with its own advertisement
+        register_relay(bus, app, ad_manager, relay)
 
     mainloop = MainLoop()
 
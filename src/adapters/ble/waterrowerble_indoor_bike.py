@@ -13,6 +13,7 @@ import dbus.mainloop.glib
 import dbus.service
 import struct
 
+from ..common import record
 from .ble import (
     Advertisement,
     Characteristic,
@@ -22,6 +23,9 @@ from .ble import (
     Descriptor,
     Agent,
 )
+from .ftmsencoder import indoor_bike_data_encoder
+from .notifications import NotificationScheduler, MIN_INTERVAL, KEEPALIVE_INTERVAL
+from .smartrowrelay import register_relay
 
 MainLoop = None
 
@@ -86,36 +90,6 @@ def register_app_error_cb(error):
 def request_reset_ble():
     out_q_reset.put("reset_ble")
 
-def Convert_Waterrower_raw():
-
-    WaterrowerValuesRaw = ble_in_q_value.pop()
-
-    for keys in WaterrowerValuesRaw:
-        WaterrowerValuesRaw[keys] = int(WaterrowerValuesRaw[keys])
-
-    return WaterrowerValuesRaw
-    # #todo refactor this part with the correct struct.pack e.g. 2 bytes use "H" instand of bitshifiting ?
-    # #print(WaterrowerValuesRaw)
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['stroke_rate'] & 0xff)))                       # 0
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_strokes'] & 0xff)))                     # 1 
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_strokes'] & 0xff00) >> 8))              # 2
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_distance_m'] & 0xff)))                  # 3
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_distance_m'] & 0xff00) >> 8))           # 4
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_distance_m'] & 0xff0000) >> 16))        # 5
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['instantaneous pace'] & 0xff)))                # 6
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['instantaneous pace'] & 0xff00) >> 8))         # 7
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['watts'] & 0xff)))                             # 8
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['watts'] & 0xff00) >> 8))                      # 9
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_kcal'] & 0xff)))                        #10
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_kcal'] & 0xff00) >> 8))                 #11
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_kcal_hour'] & 0xff)))                   #12
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_kcal_hour'] & 0xff00) >> 8))            #13
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['total_kcal_min'] & 0xff)))                    #14
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['heart_rate'] & 0xff)))                        #15
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['elapsedtime'] & 0xff)))                       #16
-    # WRBytearray.append(struct.pack("B", (WaterrowerValuesRaw['elapsedtime'] & 0xff00) >> 8))                #17
-    # return WRBytearray
-
 
 class DeviceInformation(Service):
     DEVICE_INFORMATION_UUID = '180A'
@@ -309,50 +283,30 @@ class IndoorBikeData(Characteristic):
             service)
         self.notifying = False
         self.iter = 0
+        self.encoder = indoor_bike_data_encoder()
 
-    def Waterrower_cb(self):
-        if ble_in_q_value:
-            values = Convert_Waterrower_raw()
-            power = values["watts"].to_bytes(2, 'little')
-            cadence = (values["stroke_rate"] * 2).to_bytes(2, 'little')
-
-            # Bit  Definition
-            # 0     More Data
-            # 1     Average Speed
-            # 2     Instantaneous Cadence
-            # 3     Average Cadence
-            # 4     Total Distance 
-            # 5     Resistance Leve
-            # 6     Instantaneous Power
-            # 7     Average Power
-            # 8     Expended Energy
-            # 9     Heart Rate
-            # 10    Metabolic Equivalent
-            # 11    Elapsed Time
-            # 12    Remaining Time
-            # 13    Elapsed Time Supported
-            # 14    Remaining Time Supported     
-            
-            value = [
-                dbus.Byte(0b11000101), dbus.Byte(0x00),                     # 16-bit Flags
-                dbus.Byte(cadence[0]), dbus.Byte(cadence[1]),
-                dbus.Byte(power[0]), dbus.Byte(power[1]),
-                dbus.Byte(power[0]), dbus.Byte(power[1]),
-            ]
-
-            self.PropertiesChanged(GATT_CHRC_IFACE, { 'Value': value }, [])
-            return self.notifying
-        else:
-            logger.warning("no data from s4 interface")
-            pass
-
-    def _update_Waterrower_cb_value(self):
-        print('Update Waterrower Data')
-
-        if not self.notifying:
-            return
-
-        GLib.timeout_add(200, self.Waterrower_cb)
+    def encode(self, values):
+        # Flags 0b11000101: cadence, instantaneous and average power
+        # Bit  Definition
+        # 0     More Data
+        # 1     Average Speed
+        # 2     Instantaneous Cadence
+        # 3     Average Cadence
+        # 4     Total Distance
+        # 5     Resistance Leve
+        # 6     Instantaneous Power
+        # 7     Average Power
+        # 8     Expended Energy
+        # 9     Heart Rate
+        # 10    Metabolic Equivalent
+        # 11    Elapsed Time
+        # 12    Remaining Time
+        # 13    Elapsed Time Supported
+        # 14    Remaining Time Supported
+        return self.encoder.encode(values)
+
+    def notify(self, payload):
+        self.PropertiesChanged(GATT_CHRC_IFACE, { 'Value': dbus.ByteArray(payload) }, [])
 
     def StartNotify(self):
         if self.notifying:
@@ -360,7 +314,7 @@ class IndoorBikeData(Characteristic):
             return
 
         self.notifying = True
-        self._update_Waterrower_cb_value()
+        scheduler.start(self)
 
     def StopNotify(self):
         if not self.notifying:
@@ -368,7 +322,7 @@ class IndoorBikeData(Characteristic):
             return
 
         self.notifying = False
-        self._update_Waterrower_cb_value()
+        scheduler.stop(self)
 
 class FitnessMachineControlPoint(Characteristic):
     FITNESS_MACHINE_CONTROL_POINT_UUID = '2ad9'
@@ -435,12 +389,15 @@ def sigint_handler(sig, frame):
 
 AGENT_PATH = "/com/inonoob/agent"
 
-def main(out_q,ble_in_q): #out_q
+def main(out_q,ble_in_q, relay=None, options=None): #out_q
     global mainloop
     global out_q_reset
-    global ble_in_q_value
+    global scheduler
     out_q_reset = out_q
-    ble_in_q_value = ble_in_q
+    # the data characteristics are notified when the data logger publishes a snapshot
+    scheduler = NotificationScheduler(ble_in_q,
+                                      getattr(options, 'ble_min_interval', MIN_INTERVAL),
+                                      getattr(options, 'ble_keepalive_interval', KEEPALIVE_INTERVAL))
 
     dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
 
@@ -472,6 +429,9 @@ def main(out_q,ble_in_q): #out_q
     app = Application(bus)
     app.add_service(DeviceInformation(bus, 1))
     app.add_service(FitnessMachineService(bus, 2))
+    if relay is not None:
+        # passthrough of the SmartRow to the SmartRow app, with its own advertisement
+        register_relay(bus, app, ad_manager, relay)
 
     mainloop = MainLoop()
 
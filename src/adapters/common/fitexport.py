@@ -0,0 +1,247 @@
+# ---------------------------------------------------------------------------
+# FIT activity export of the workouts
+# ---------------------------------------------------------------------------
+#
+# The FIT file of a workout is written while rowing: one record message per second from the published snapshots,
+# at the end of the workout one lap, the session and the activity message. The totals are kept up to date with
+# every record and the CRC is computed while streaming, so finishing a file takes the same time after 5 minutes as
+# after 5 hours. A workout starts with the first distance or time and ends with the next reset.
+#
+# The files can be uploaded to Strava or Garmin Connect, sport is rowing, sub sport indoor rowing.
+
+import logging
+import os
+import struct
+import time
+
+from . import record
+from .snapshot import WorkoutSink
+
+logger = logging.getLogger(__name__)
+
+FIT_EPOCH = 631065600  # 1989-12-31 00:00:00 UTC in unix time
+PROTOCOL_VERSION = 0x20
+PROFILE_VERSION = 2132
+HEADER = struct.Struct('<BBHI4s')  # without the header CRC
+HEADER_SIZE = HEADER.size + 2
+
+# base types
+ENUM, UINT8, UINT16, UINT32, UINT32Z = 0x00, 0x02, 0x84, 0x86, 0x8C
+BASE_TYPES = {ENUM: 'B', UINT8: 'B', UINT16: 'H', UINT32: 'I', UINT32Z: 'I'}
+INVALID = {ENUM: 0xFF, UINT8: 0xFF, UINT16: 0xFFFF, UINT32: 0xFFFFFFFF, UINT32Z: 0}
+
+# profile values
+FILE_ACTIVITY = 4
+MANUFACTURER_DEVELOPMENT = 255
+SPORT_ROWING = 15
+SUB_SPORT_INDOOR_ROWING = 14
+EVENT_TIMER, EVENT_SESSION, EVENT_LAP, EVENT_ACTIVITY = 0, 8, 9, 26
+EVENT_TYPE_START, EVENT_TYPE_STOP, EVENT_TYPE_STOP_ALL = 0, 1, 4
+ACTIVITY_MANUAL = 0
+
+# (local message type, global message number, ((field number, base type), ...))
+FILE_ID = (0, 0, ((0, ENUM), (1, UINT16), (2, UINT16), (3, UINT32Z), (4, UINT32)))
+EVENT = (1, 21, ((253, UINT32), (0, ENUM), (1, ENUM)))
+RECORD = (2, 20, ((253, UINT32), (5, UINT32), (6, UINT16), (7, UINT16), (4, UINT8), (3, UINT8)))
+LAP = (3, 19, ((253, UINT32), (0, ENUM), (1, ENUM), (2, UINT32), (7, UINT32), (8, UINT32), (9, UINT32),
+               (10, UINT32), (11, UINT16), (13, UINT16), (14, UINT16), (15, UINT8), (16, UINT8), (17, UINT8),
+               (18, UINT8), (19, UINT16), (20, UINT16), (25, ENUM), (39, ENUM)))
+SESSION = (4, 18, ((253, UINT32), (0, ENUM), (1, ENUM), (2, UINT32), (5, ENUM), (6, ENUM), (7, UINT32),
+                   (8, UINT32), (9, UINT32), (10, UINT32), (11, UINT16), (14, UINT16), (15, UINT16), (16, UINT8),
+                   (17, UINT8), (18, UINT8), (19, UINT8), (20, UINT16), (21, UINT16), (25, UINT16), (26, UINT16)))
+ACTIVITY = (5, 34, ((253, UINT32), (0, UINT32), (1, UINT16), (2, ENUM), (3, ENUM), (4, ENUM), (5, UINT32)))
+
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC_TABLE = _crc_table()
+
+
+def crc16(data, crc=0):
+    """
+    CRC of the FIT protocol (CRC-16/ARC)
+    """
+    table = CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def _gf2_times(matrix, vector):
+    result = 0
+    i = 0
+    while vector:
+        if vector & 1:
+            result ^= matrix[i]
+        vector >>= 1
+        i += 1
+    return result
+
+
+def crc16_shift(crc, length):
+    """
+    Returns the CRC after length zero bytes more, in O(log length). The FIT CRC has neither start value nor final
+    xor, so the CRC of a||b is crc16_shift(crc16(a), len(b)) ^ crc16(b).
+    """
+    # the matrix of one zero bit, the CRC register is shifted right and the polynomial added when a 1 drops out
+    matrix = [0xA001] + [1 << (bit - 1) for bit in range(1, 16)]
+    length *= 8
+    while length and crc:
+        matrix_squared = [_gf2_times(matrix, column) for column in matrix]
+        if length & 1:
+            crc = _gf2_times(matrix, crc)
+        length >>= 1
+        matrix = matrix_squared
+    return crc
+
+
+def fit_time(unix_time):
+    return int(unix_time) - FIT_EPOCH
+
+
+class FitWriter(object):
+    """
+    Writes the messages of one FIT file, the definitions are written before the first message of their type
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'wb')
+        self._file.write(bytes(HEADER_SIZE))  # the header is written again with the data size when finished
+        self._structs = {}
+        self.data_size = 0
+        self._crc = 0  # CRC of the data records alone
+
+    def _write(self, data):
+        self._file.write(data)
+        self._crc = crc16(data, self._crc)
+        self.data_size += len(data)
+
+    def message(self, message, *values):
+        local_type, global_number, fields = message
+        packer = self._structs.get(local_type)
+        if packer is None:
+            definition = struct.pack('<BBBHB', 0x40 | local_type, 0, 0, global_number, len(fields))
+            for number, base_type in fields:
+                definition += struct.pack('<BBB', number, struct.calcsize(BASE_TYPES[base_type]), base_type)
+            self._write(definition)
+            packer = self._structs[local_type] = struct.Struct('<B' + ''.join(BASE_TYPES[t] for _, t in fields))
+        values = [INVALID[base_type] if value is None else value for value, (_, base_type) in zip(values, fields)]
+        self._write(packer.pack(local_type, *values))
+
+    def close(self):
+        header = HEADER.pack(HEADER_SIZE, PROTOCOL_VERSION, PROFILE_VERSION, self.data_size, b'.FIT')
+        header += struct.pack('<H', crc16(header))
+        crc = crc16_shift(crc16(header), self.data_size) ^ self._crc
+        self._file.write(struct.pack('<H', crc))
+        self._file.seek(0)
+        self._file.write(header)
+        self._file.close()
+
+
+class FitExporter(WorkoutSink):
+    """
+    Sink for the SinkPublisher, writes one FIT file per workout into folder
+    """
+
+    def __init__(self, folder, serial_number=1):
+        WorkoutSink.__init__(self)
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.serial_number = serial_number
+        self._writer = None
+        self._last_timestamp = None
+        self._wall_offset = time.time() - time.monotonic()
+
+    def _timestamp(self, at):
+        return fit_time(at / 1e9 + self._wall_offset)
+
+    def start_workout(self, snapshot):
+        timestamp = self._timestamp(snapshot.at)
+        path = os.path.join(self.folder, time.strftime('workout-%Y%m%d-%H%M%S.fit',
+                                                       time.localtime(timestamp + FIT_EPOCH)))
+        self._writer = FitWriter(path)
+        self._writer.message(FILE_ID, FILE_ACTIVITY, MANUFACTURER_DEVELOPMENT, 0, self.serial_number, timestamp)
+        self._writer.message(EVENT, timestamp, EVENT_TIMER, EVENT_TYPE_START)
+        self._start_time = timestamp
+        self._last_timestamp = None
+        # elapsed and timer time are both taken from the snapshots, the first and the last one of the workout
+        self._start_at = self._last_at = snapshot.at
+        self._start_seconds = self._seconds = snapshot.record[record.ELAPSEDTIME]
+        self._records = 0
+        self._power_sum = self._cadence_sum = self._heart_rate_sum = self._heart_rate_records = 0
+        self._max_power = self._max_cadence = self._max_heart_rate = self._max_speed = 0
+        self._distance = self._strokes = self._kcal = 0
+        logger.info("writing workout to %s", path)
+
+    def add_snapshot(self, snapshot):
+        values = snapshot.record
+        self._last_at = snapshot.at
+        self._seconds = values[record.ELAPSEDTIME]
+        timestamp = self._timestamp(snapshot.at)
+        if timestamp == self._last_timestamp:
+            return  # one record per second
+        self._last_timestamp = timestamp
+        watts = values[record.WATTS]
+        cadence = min(values[record.STROKE_RATE] // 2, 254)
+        heart_rate = values[record.HEART_RATE]
+        speed = min(values[record.SPEED] * 10, 65534)  # cm/s to mm/s
+        self._distance = values[record.TOTAL_DISTANCE_M]
+        self._strokes = values[record.TOTAL_STROKES]
+        self._kcal = values[record.TOTAL_KCAL]
+        self._records += 1
+        self._power_sum += watts
+        self._cadence_sum += cadence
+        self._max_power = max(self._max_power, watts)
+        self._max_cadence = max(self._max_cadence, cadence)
+        self._max_speed = max(self._max_speed, speed)
+        if heart_rate:
+            self._heart_rate_sum += heart_rate
+            self._heart_rate_records += 1
+            self._max_heart_rate = max(self._max_heart_rate, heart_rate)
+        self._writer.message(RECORD, timestamp, self._distance * 100, speed, watts, cadence, heart_rate or None)
+
+    def finish_workout(self):
+        writer = self._writer
+        self._writer = None
+        end = self._last_timestamp or self._start_time
+        elapsed = (self._last_at - self._start_at) // 1000000
+        # the clock of the rower stands still in the pauses, it can not have run longer than the workout
+        timer = min((self._seconds - self._start_seconds) * 1000, elapsed)
+        records = self._records or 1
+        avg_speed = min(self._distance * 1000000 // timer, 65534) if timer else 0
+        avg_power = self._power_sum // records
+        avg_cadence = self._cadence_sum // records
+        avg_heart_rate = self._heart_rate_sum // self._heart_rate_records if self._heart_rate_records else None
+        max_heart_rate = self._max_heart_rate or None
+        writer.message(EVENT, end, EVENT_TIMER, EVENT_TYPE_STOP_ALL)
+        writer.message(LAP, end, EVENT_LAP, EVENT_TYPE_STOP, self._start_time, elapsed, timer, self._distance * 100,
+                       self._strokes, self._kcal, avg_speed, self._max_speed, avg_heart_rate, max_heart_rate,
+                       avg_cadence, self._max_cadence, avg_power, self._max_power, SPORT_ROWING,
+                       SUB_SPORT_INDOOR_ROWING)
+        writer.message(SESSION, end, EVENT_SESSION, EVENT_TYPE_STOP, self._start_time, SPORT_ROWING,
+                       SUB_SPORT_INDOOR_ROWING, elapsed, timer, self._distance * 100, self._strokes, self._kcal,
+                       avg_speed, self._max_speed, avg_heart_rate, max_heart_rate, avg_cadence, self._max_cadence,
+                       avg_power, self._max_power, 0, 1)
+        local_offset = -time.altzone if time.localtime().tm_isdst > 0 else -time.timezone
+        writer.message(ACTIVITY, end, timer, 1, ACTIVITY_MANUAL, EVENT_ACTIVITY, EVENT_TYPE_STOP, end + local_offset)
+        writer.close()
+        logger.info("workout of %d m written to %s", self._distance, writer.path)
+
+
+def open_exporter(options):
+    """
+    Returns a FitExporter writing to options.fit_dir, None without it
+    """
+    folder = getattr(options, 'fit_dir', None)
+    if not folder:
+        return None
+    return FitExporter(folder)
@@ -0,0 +1,308 @@
+# ---------------------------------------------------------------------------
+# Workout history
+# ---------------------------------------------------------------------------
+#
+# SQLite database (WAL mode) with one row of precomputed totals per finished workout, the best times over the
+# usual race distances and the per second samples and strokes of every workout as packed int32 blobs. The screen
+# or a web UI query the totals and bests through the indexes on date and distance and never touch the raw data.
+#
+# Last 30 days and personal bests from the src folder:
+#
+#   python3 -m adapters.common.history history.db --days 30
+
+import argparse
+import logging
+import sqlite3
+import sys
+import time
+from array import array
+
+from . import record
+from .snapshot import WorkoutSink
+
+logger = logging.getLogger(__name__)
+
+BEST_DISTANCES = (500, 1000, 2000, 5000, 6000, 10000, 21097, 42195)
+SPLIT_DISTANCE = 500
+SAMPLE_FIELDS = ('time_s', 'distance_m', 'watts', 'stroke_rate', 'speed', 'heart_rate')
+SAMPLE_WIDTH = len(SAMPLE_FIELDS)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    started INTEGER NOT NULL,        -- unix time
+    duration_s INTEGER NOT NULL,
+    distance_m INTEGER NOT NULL,
+    strokes INTEGER NOT NULL,
+    kcal INTEGER NOT NULL,
+    avg_watts INTEGER NOT NULL,
+    max_watts INTEGER NOT NULL,
+    avg_stroke_rate REAL NOT NULL,   -- strokes/min
+    avg_split_ms INTEGER,            -- per 500 m
+    best_split_ms INTEGER
+);
+CREATE INDEX IF NOT EXISTS sessions_started ON sessions (started);
+CREATE INDEX IF NOT EXISTS sessions_distance ON sessions (distance_m);
+CREATE TABLE IF NOT EXISTS splits (
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    number INTEGER NOT NULL,
+    split_ms INTEGER NOT NULL,
+    PRIMARY KEY (session_id, number)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS bests (
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    distance_m INTEGER NOT NULL,
+    time_ms INTEGER NOT NULL,
+    PRIMARY KEY (session_id, distance_m)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS bests_distance ON bests (distance_m, time_ms);
+CREATE TABLE IF NOT EXISTS session_data (
+    session_id INTEGER PRIMARY KEY REFERENCES sessions (id) ON DELETE CASCADE,
+    samples BLOB NOT NULL,           -- SAMPLE_FIELDS per second, int32 little endian
+    strokes BLOB NOT NULL            -- the stroke records of strokes.py, int32 little endian
+);
+"""
+
+
+def _blob(values):
+    values = array('i', values)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _unblob(data):
+    values = array('i')
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def best_time(times, distances, distance):
+    """
+    Shortest time in which distance was covered, from samples of time and total distance, None if never covered
+    """
+    best = None
+    start = 0
+    for end in range(len(times)):
+        while start + 1 < end and distances[end] - distances[start + 1] >= distance:
+            start += 1
+        if distances[end] - distances[start] >= distance:
+            rowed = distances[end] - distances[start]
+            # the samples hardly ever hit the distance exactly, the time is scaled down to it
+            elapsed = (times[end] - times[start]) * distance / rowed
+            if best is None or elapsed < best:
+                best = elapsed
+    return best
+
+
+def split_times(times, distances, split=SPLIT_DISTANCE):
+    """
+    Time of every full split, interpolated between the samples
+    """
+    splits = []
+    previous_time = 0.0
+    mark = split
+    for i in range(1, len(times)):
+        while distances[i] >= mark > distances[i - 1]:
+            fraction = (mark - distances[i - 1]) / (distances[i] - distances[i - 1])
+            crossed = times[i - 1] + (times[i] - times[i - 1]) * fraction
+            splits.append(crossed - previous_time)
+            previous_time = crossed
+            mark += split
+    return splits
+
+
+class HistoryStore(object):
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+
+    def add_session(self, started, samples, strokes=(), kcal=0, total_strokes=0):
+        """
+        Stores a finished workout. samples are SAMPLE_FIELDS per second one after the other, strokes the stroke
+        records one after the other. Returns the id of the session.
+        """
+        times = samples[0::SAMPLE_WIDTH]
+        distances = samples[1::SAMPLE_WIDTH]
+        watts = samples[2::SAMPLE_WIDTH]
+        stroke_rates = samples[3::SAMPLE_WIDTH]
+        count = len(times)
+        duration = times[-1] if count else 0
+        distance = distances[-1] if count else 0
+        splits = split_times(times, distances)
+        with self._db:
+            cursor = self._db.execute(
+                "INSERT INTO sessions (started, duration_s, distance_m, strokes, kcal, avg_watts, max_watts, "
+                "avg_stroke_rate, avg_split_ms, best_split_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (int(started), duration, distance, total_strokes, kcal,
+                 sum(watts) // count if count else 0, max(watts) if count else 0,
+                 sum(stroke_rates) / 2.0 / count if count else 0.0,
+                 int(duration * 1000 * SPLIT_DISTANCE / distance) if distance else None,
+                 int(min(splits) * 1000) if splits else None))
+            session_id = cursor.lastrowid
+            self._db.executemany("INSERT INTO splits VALUES (?, ?, ?)",
+                                 [(session_id, number, int(split * 1000)) for number, split in enumerate(splits, 1)])
+            bests = [(session_id, best, int(time_s * 1000)) for best, time_s in
+                     ((best, best_time(times, distances, best)) for best in BEST_DISTANCES if best <= distance)
+                     if time_s is not None]
+            self._db.executemany("INSERT INTO bests VALUES (?, ?, ?)", bests)
+            self._db.execute("INSERT INTO session_data VALUES (?, ?, ?)",
+                             (session_id, _blob(samples), _blob(strokes)))
+        logger.info("workout of %d m added to the history as session %d", distance, session_id)
+        return session_id
+
+    def recent(self, days=30, now=None):
+        since = (time.time() if now is None else now) - days * 86400
+        return self._db.execute("SELECT * FROM sessions WHERE started >= ? ORDER BY started DESC",
+                                (since,)).fetchall()
+
+    def totals(self, days=30, now=None):
+        since = (time.time() if now is None else now) - days * 86400
+        return self._db.execute("SELECT COUNT(*) AS sessions, COALESCE(SUM(distance_m), 0) AS distance_m, "
+                                "COALESCE(SUM(duration_s), 0) AS duration_s FROM sessions WHERE started >= ?",
+                                (since,)).fetchone()
+
+    def best(self, distance):
+        """
+        Fastest time over distance of all sessions with the session, None without any
+        """
+        return self._db.execute("SELECT bests.time_ms, sessions.* FROM bests JOIN sessions ON sessions.id = "
+                                "bests.session_id WHERE bests.distance_m = ? ORDER BY bests.time_ms LIMIT 1",
+                                (distance,)).fetchone()
+
+    def personal_bests(self):
+        return self._db.execute("SELECT distance_m, MIN(time_ms) AS time_ms FROM bests GROUP BY distance_m "
+                                "ORDER BY distance_m").fetchall()
+
+    def splits(self, session_id):
+        return [row[0] for row in self._db.execute("SELECT split_ms FROM splits WHERE session_id = ? ORDER BY number",
+                                                   (session_id,))]
+
+    def session_data(self, session_id):
+        """
+        Returns the samples and strokes of a session as flat int arrays
+        """
+        row = self._db.execute("SELECT samples, strokes FROM session_data WHERE session_id = ?",
+                               (session_id,)).fetchone()
+        return (_unblob(row[0]), _unblob(row[1])) if row else (None, None)
+
+    def close(self):
+        self._db.close()
+
+
+class HistorySink(WorkoutSink):
+    """
+    Sink for the SinkPublisher, collects one sample per second of a workout and adds the workout to the history
+    when it is finished. With the StrokeStore of a data logger the strokes are stored too.
+    """
+
+    def __init__(self, store, strokes=None):
+        WorkoutSink.__init__(self)
+        self.store = store
+        self._strokes = strokes
+        self._stroke_count = 0
+        if strokes is not None:
+            # a reset clears the store before the snapshot which ends the workout is published
+            strokes.register_clear_callback(self._collect_before_clear)
+        self._wall_offset = time.time() - time.monotonic()
+        self._reset_workout()
+
+    def _reset_workout(self):
+        self._samples = array('i')
+        self._stroke_records = array('i')
+        self._started = None
+        self._last_second = None
+        self._kcal = 0
+        self._total_strokes = 0
+
+    def start_workout(self, snapshot):
+        self._reset_workout()
+        self._started = snapshot.at / 1e9 + self._wall_offset
+        if self._strokes is not None:
+            self._stroke_count = len(self._strokes)
+
+    def add_snapshot(self, snapshot):
+        values = snapshot.record
+        second = values[record.ELAPSEDTIME]
+        self._kcal = values[record.TOTAL_KCAL]
+        self._total_strokes = values[record.TOTAL_STROKES]
+        if second != self._last_second:
+            self._last_second = second
+            self._samples.extend((second, values[record.TOTAL_DISTANCE_M], values[record.WATTS],
+                                  values[record.STROKE_RATE], values[record.SPEED], values[record.HEART_RATE]))
+        self._collect_strokes()
+
+    def _collect_before_clear(self):
+        with self._lock:
+            if self.in_workout:
+                self._collect_strokes()
+
+    def _collect_strokes(self):
+        strokes = self._strokes
+        if strokes is None:
+            return
+        count = len(strokes)
+        if count < self._stroke_count:
+            self._stroke_count = count  # the store was cleared by a reset
+        new = min(count - self._stroke_count, strokes.in_memory)
+        if new > 0:
+            for stroke in strokes.last(new):
+                self._stroke_records.extend(stroke)
+        self._stroke_count = count
+
+    def finish_workout(self):
+        if not self._samples:
+            return
+        try:
+            self.store.add_session(self._started, self._samples, self._stroke_records, self._kcal,
+                                   self._total_strokes)
+        except sqlite3.Error as e:
+            logger.error("workout could not be added to the history: %s", e)
+        self._reset_workout()
+
+
+def open_history(options, strokes=None):
+    """
+    Returns a HistorySink for the database options.history_db, None without it
+    """
+    path = getattr(options, 'history_db', None)
+    if not path:
+        return None
+    return HistorySink(HistoryStore(path), strokes)
+
+
+def _format_ms(ms):
+    minutes, seconds = divmod(ms / 1000.0, 60)
+    return "%d:%04.1f" % (minutes, seconds)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Workout history")
+    parser.add_argument("database", help="history database written with --history-db")
+    parser.add_argument("--days", type=int, default=30, help="show the sessions of the last DAYS days")
+    args = parser.parse_args(args)
+
+    store = HistoryStore(args.database)
+    totals = store.totals(args.days)
+    print("last %d days: %d sessions, %d m, %d min" % (
+        args.days, totals['sessions'], totals['distance_m'], totals['duration_s'] // 60))
+    for session in store.recent(args.days):
+        print("  %s  %6d m  %s  %3d W avg  split %s" % (
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(session['started'])), session['distance_m'],
+            _format_ms(session['duration_s'] * 1000), session['avg_watts'],
+            _format_ms(session['avg_split_ms']) if session['avg_split_ms'] else '-'))
+    print("personal bests:")
+    for best in store.personal_bests():
+        print("  %6d m  %s" % (best['distance_m'], _format_ms(best['time_ms'])))
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
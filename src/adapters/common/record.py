@@ -0,0 +1,42 @@
+from array import array
+
+# Schema of the rowing values which the data loggers publish. Every field is an integer in the unit noted
+# next to it, so the BLE and ANT+ encoders can pack it without conversion. The index of a field is its
+# position in FIELDS and is available as module constant.
+FIELDS = (
+    'stroke_rate',         # 0.5 strokes/min, as in the FTMS rower data
+    'total_strokes',       # strokes
+    'total_distance_m',    # m
+    'instantaneous_pace',  # s/500 m
+    'speed',               # cm/s
+    'watts',               # W
+    'total_kcal',          # kcal
+    'total_kcal_hour',     # kcal/h
+    'total_kcal_min',      # kcal/min
+    'heart_rate',          # bpm
+    'elapsedtime',         # s
+    'work',                # 0.1 J per stroke (SmartRow)
+    'stroke_length',       # cm (SmartRow)
+    'force',               # N (SmartRow)
+    'watts_avg',           # 0.1 W (SmartRow)
+    'pace_avg',            # s/500 m (SmartRow)
+)
+
+(STROKE_RATE, TOTAL_STROKES, TOTAL_DISTANCE_M, INSTANTANEOUS_PACE, SPEED, WATTS, TOTAL_KCAL, TOTAL_KCAL_HOUR,
+ TOTAL_KCAL_MIN, HEART_RATE, ELAPSEDTIME, WORK, STROKE_LENGTH, FORCE, WATTS_AVG, PACE_AVG) = range(len(FIELDS))
+
+FIELD_INDEX = {name: index for index, name in enumerate(FIELDS)}
+
+TYPECODE = 'i'
+ZERO_RECORD = array(TYPECODE, [0] * len(FIELDS))
+
+
+def new_record():
+    """
+    Returns a record with all fields 0
+    """
+    return array(TYPECODE, ZERO_RECORD)
+
+
+def record_to_dict(record):
+    return dict(zip(FIELDS, record))
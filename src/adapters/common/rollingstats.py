@@ -0,0 +1,190 @@
+import time
+from collections import deque
+
+# Window specs of the displayed metrics. A number is a window over that many values (for the power: strokes),
+# a number with "s" a window over that many seconds and "ema" followed by a factor an exponential smoothing.
+# "1" shows the last value as it is.
+DEFAULT_WINDOWS = {
+    'watts': '1',
+    'pace': '1',
+    'stroke_rate': '1',
+    'speed': '1',
+}
+
+
+class RollingWindow(object):
+    """
+    Sum, mean and max of the last length values in a ring buffer, every append is O(1)
+    """
+
+    def __init__(self, length):
+        if length < 1:
+            raise ValueError("window length must be at least 1")
+        self.length = length
+        self.reset()
+
+    def reset(self):
+        self._values = [0] * self.length
+        self._index = 0
+        self._appended = 0
+        self.count = 0
+        self.sum = 0
+        self._max = deque()  # (position, value) with decreasing values, the head is the max of the window
+
+    def append(self, value, at=None):
+        index = self._index
+        self.sum += value - self._values[index]
+        self._values[index] = value
+        self._index = index = (index + 1) % self.length
+        if index == 0:
+            # the running sum of floats drifts, it is summed up fresh once per round through the ring
+            self.sum = sum(self._values)
+        position = self._appended
+        self._appended += 1
+        maxima = self._max
+        while maxima and maxima[-1][1] <= value:
+            maxima.pop()
+        maxima.append((position, value))
+        if maxima[0][0] <= position - self.length:
+            maxima.popleft()
+        if self.count < self.length:
+            self.count += 1
+        return self.mean
+
+    @property
+    def full(self):
+        return self.count == self.length
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0
+
+    @property
+    def max(self):
+        return self._max[0][1] if self._max else 0
+
+
+class TimeWindow(object):
+    """
+    Sum, mean and max of the values of the last seconds, every append is O(1) amortized
+    """
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError("window length must be positive")
+        self.seconds = seconds
+        self._window_ns = int(seconds * 1e9)
+        self.reset()
+
+    def reset(self):
+        self._values = deque()
+        self._max = deque()
+        self.sum = 0
+        self._full = False
+
+    @property
+    def count(self):
+        return len(self._values)
+
+    def append(self, value, at=None):
+        if at is None:
+            at = time.monotonic_ns()
+        values = self._values
+        oldest = at - self._window_ns
+        if values and values[0][0] <= oldest:
+            self._full = True
+            while values and values[0][0] <= oldest:
+                self.sum -= values.popleft()[1]
+            if not values:
+                self.sum = 0
+        values.append((at, value))
+        self.sum += value
+        maxima = self._max
+        while maxima and maxima[-1][1] <= value:
+            maxima.pop()
+        maxima.append((at, value))
+        while maxima[0][0] <= oldest:
+            maxima.popleft()
+        return self.mean
+
+    @property
+    def full(self):
+        # the window covers its whole time span once the first value dropped out of it
+        return self._full
+
+    @property
+    def mean(self):
+        return self.sum / len(self._values) if self._values else 0
+
+    @property
+    def max(self):
+        return self._max[0][1] if self._max else 0
+
+
+class Ema(object):
+    """
+    Exponential smoothing, mean = factor * value + (1 - factor) * mean
+    """
+
+    def __init__(self, factor):
+        if not 0 < factor <= 1:
+            raise ValueError("smoothing factor must be in (0, 1]")
+        self.factor = factor
+        self.reset()
+
+    def reset(self):
+        self.mean = 0
+        self.max = 0
+        self.count = 0
+
+    def append(self, value, at=None):
+        if self.count:
+            self.mean += self.factor * (value - self.mean)
+        else:
+            self.mean = value
+        self.max = max(self.max, value)
+        self.count += 1
+        return self.mean
+
+    @property
+    def full(self):
+        return self.count > 0
+
+
+def make_window(spec):
+    """
+    Creates the window for a spec like "4" (last 4 values), "10s" (last 10 seconds) or "ema0.3"
+    """
+    spec = str(spec).strip().lower()
+    if spec.startswith('ema'):
+        return Ema(float(spec[3:]))
+    if spec.endswith('s'):
+        return TimeWindow(float(spec[:-1]))
+    return RollingWindow(int(spec))
+
+
+class RollingStats(object):
+    """
+    One window per metric, built from a dict of window specs. Metrics without spec are passed through.
+    """
+
+    def __init__(self, specs=None, options=None):
+        specs = dict(DEFAULT_WINDOWS, **(specs or {}))
+        for metric in specs:
+            spec = getattr(options, metric + '_window', None)
+            if spec is not None:
+                specs[metric] = spec
+        self.windows = {metric: make_window(spec) for metric, spec in specs.items()}
+
+    def __getitem__(self, metric):
+        return self.windows[metric]
+
+    def update(self, metric, value, at=None):
+        window = self.windows.get(metric)
+        if window is None:
+            return value
+        return window.append(value, at)
+
+    def reset(self):
+        for window in self.windows.values():
+            window.reset()
@@ -0,0 +1,110 @@
+import time
+
+NS = 1000000000
+MINUTE_NS = 60 * NS
+HOUR_NS = 60 * MINUTE_NS
+ROLLOVER_SECONDS = (58, 59, 0, 1, 2)
+ROLLOVER_MINUTES = (59, 0)
+
+
+class SessionClock(object):
+    """
+    Elapsed time of a rowing session on the monotonic clock. It runs between start()/resume() and pause(),
+    the rower display can be used to correct it with sync_seconds(), sync_minutes() and sync_hours()
+    now and then.
+    All methods take the time of the event in monotonic ns, default is now from clock (time.monotonic_ns without).
+    """
+
+    def __init__(self, clock=None):
+        self._now = clock or time.monotonic_ns
+        self._elapsed_ns = 0
+        self._since = None
+        self.started = False
+
+    def reset(self):
+        self._elapsed_ns = 0
+        self._since = None
+        self.started = False
+
+    @property
+    def running(self):
+        return self._since is not None
+
+    def start(self, at=None):
+        if self._since is None:
+            self._since = self._now() if at is None else at
+            self.started = True
+
+    resume = start
+
+    def pause(self, at=None):
+        if self._since is not None:
+            at = self._now() if at is None else at
+            self._elapsed_ns += max(0, at - self._since)
+            self._since = None
+
+    def elapsed_ns(self, at=None):
+        if self._since is None:
+            return self._elapsed_ns
+        at = self._now() if at is None else at
+        return self._elapsed_ns + max(0, at - self._since)
+
+    @property
+    def elapsed(self):
+        return self.elapsed_ns() / NS
+
+    @property
+    def seconds(self):
+        return self.elapsed_ns() // NS
+
+    def _set_elapsed_ns(self, elapsed_ns, at):
+        self._elapsed_ns += elapsed_ns - self.elapsed_ns(at)
+
+    def sync_seconds(self, display_sec, at=None):
+        """
+        Corrects the clock with the seconds of a display (0-59) which shows whole seconds. A clock which is off
+        by less than 30 s is moved to the nearest time matching the display, a bigger error is up to
+        sync_minutes() and sync_hours(). Returns the correction in ns.
+        """
+        elapsed_ns = self.elapsed_ns(at)
+        offset_ns = (elapsed_ns - display_sec * NS) % MINUTE_NS
+        if offset_ns < NS:
+            return 0
+        if offset_ns < 30 * NS:
+            correction = NS - 1 - offset_ns  # ahead of the display
+        else:
+            correction = MINUTE_NS - offset_ns  # behind the display
+        self._set_elapsed_ns(elapsed_ns + correction, at)
+        return correction
+
+    def sync_minutes(self, display_min, at=None):
+        """
+        Corrects the clock with the minutes of a display (0-59), except close to the full minute as the registers
+        of a display are read at different times. Returns the correction in ns.
+        """
+        elapsed_ns = self.elapsed_ns(at)
+        if (elapsed_ns // NS) % 60 in ROLLOVER_SECONDS:
+            return 0
+        difference = (display_min - elapsed_ns // MINUTE_NS + 30) % 60 - 30
+        if not difference:
+            return 0
+        correction = difference * MINUTE_NS
+        if elapsed_ns + correction < 0:
+            correction += HOUR_NS
+        self._set_elapsed_ns(elapsed_ns + correction, at)
+        return correction
+
+    def sync_hours(self, display_hr, at=None):
+        """
+        Corrects the hours of the clock with the hours of a display, except close to the full hour. Returns the
+        correction in ns.
+        """
+        elapsed_ns = self.elapsed_ns(at)
+        if (elapsed_ns // MINUTE_NS) % 60 in ROLLOVER_MINUTES:
+            return 0
+        difference = display_hr - elapsed_ns // HOUR_NS
+        if not difference:
+            return 0
+        correction = difference * HOUR_NS
+        self._set_elapsed_ns(elapsed_ns + correction, at)
+        return correction
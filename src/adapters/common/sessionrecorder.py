@@ -0,0 +1,199 @@
+# ---------------------------------------------------------------------------
+# Columnar recording of the published rowing snapshots
+# ---------------------------------------------------------------------------
+#
+# A session is a folder with one file per column, every column is a plain little endian int32 array which can be
+# memory mapped:
+#   header      magic "PRFSESS1", uint16 version, uint64 wall clock time of the start in ns, uint16 column count,
+#               followed by the comma separated column names
+#   time_ms.col ms since the start of the recording, then one <field>.col per field of the rowing record
+#   index       one entry per segment: uint32 first row, uint32 time_ms and int32 distance of that row
+# Rows are collected in memory and written as one segment every SEGMENT_SECONDS, the files are only synced to
+# the SD card at the end of a segment.
+#
+# Summary of a recorded session from the src folder:
+#
+#   python3 -m adapters.common.sessionrecorder sessions/session-20240101-120000
+
+import argparse
+import bisect
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from .record import FIELDS, TYPECODE, TOTAL_DISTANCE_M
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PRFSESS1'
+VERSION = 1
+HEADER = struct.Struct('<8sHQH')
+INDEX = struct.Struct('<IIi')
+COLUMNS = ('time_ms',) + FIELDS
+SEGMENT_SECONDS = 30
+COLUMN_SUFFIX = '.col'
+
+
+class SessionRecorder(object):
+    """
+    Sink for the SinkPublisher, records every new snapshot as one row. Snapshots which are published again
+    without change are skipped.
+    """
+
+    def __init__(self, path, segment_seconds=SEGMENT_SECONDS):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.rows = 0
+        self._segment_ns = int(segment_seconds * 1e9)
+        self._lock = threading.Lock()
+        self._rows = array(TYPECODE)  # the rows of the current segment, one after the other
+        self._start = None
+        self._segment_start = None
+        self._last_version = None
+        with open(os.path.join(path, 'header'), 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, time.time_ns(), len(COLUMNS)))
+            f.write(','.join(COLUMNS).encode('ascii'))
+        self._columns = [open(os.path.join(path, column + COLUMN_SUFFIX), 'wb') for column in COLUMNS]
+        self._index = open(os.path.join(path, 'index'), 'wb')
+        logger.info("recording the session to %s", path)
+
+    def append(self, snapshot):
+        with self._lock:
+            if snapshot.version == self._last_version or self._index is None:
+                return
+            self._last_version = snapshot.version
+            if self._start is None:
+                self._start = self._segment_start = snapshot.at
+            self._rows.append((snapshot.at - self._start) // 1000000)
+            self._rows.extend(snapshot.record)
+            if snapshot.at - self._segment_start >= self._segment_ns:
+                self._write_segment()
+                self._segment_start = snapshot.at
+
+    def _write_segment(self):
+        rows = self._rows
+        if not rows:
+            return
+        width = len(COLUMNS)
+        count = len(rows) // width
+        self._index.write(INDEX.pack(self.rows, rows[0], rows[1 + TOTAL_DISTANCE_M]))
+        if sys.byteorder != 'little':
+            rows.byteswap()
+        for offset, f in enumerate(self._columns):
+            f.write(rows[offset::width].tobytes())
+        for f in self._columns + [self._index]:
+            f.flush()
+            os.fsync(f.fileno())
+        self.rows += count
+        self._rows = array(TYPECODE)
+
+    def flush(self):
+        with self._lock:
+            if self._index is not None:
+                self._write_segment()
+
+    def close(self):
+        with self._lock:
+            if self._index is None:
+                return
+            self._write_segment()
+            for f in self._columns + [self._index]:
+                f.close()
+            self._index = None
+            logger.info("%d rows recorded to %s", self.rows, self.path)
+
+
+def open_recorder(options):
+    """
+    Returns a SessionRecorder for a new session folder in options.record_dir, None without it
+    """
+    folder = getattr(options, 'record_dir', None)
+    if not folder:
+        return None
+    return SessionRecorder(os.path.join(folder, time.strftime('session-%Y%m%d-%H%M%S')))
+
+
+def read_header(path):
+    with open(os.path.join(path, 'header'), 'rb') as f:
+        data = f.read()
+    magic, version, started, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("%s is not a recorded session" % path)
+    columns = data[HEADER.size:].decode('ascii').split(',')
+    return started, columns[:count]
+
+
+def read_index(path):
+    with open(os.path.join(path, 'index'), 'rb') as f:
+        data = f.read()
+    return [INDEX.unpack_from(data, offset) for offset in range(0, len(data) - INDEX.size + 1, INDEX.size)]
+
+
+class Session(object):
+    """
+    NumPy view of a recorded session, the columns are memory mapped and only read when used
+    """
+
+    def __init__(self, path):
+        import numpy
+
+        self.path = path
+        self.started_ns, self.column_names = read_header(path)
+        self.index = read_index(path)
+        self.columns = {}
+        for name in self.column_names:
+            column_path = os.path.join(path, name + COLUMN_SUFFIX)
+            if os.path.getsize(column_path):
+                self.columns[name] = numpy.memmap(column_path, dtype='<i4', mode='r')
+            else:
+                self.columns[name] = numpy.zeros(0, dtype='<i4')
+
+    def __len__(self):
+        return len(self.columns['time_ms'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def _seek(self, column, position, value):
+        # the index narrows the search down to one segment
+        segment = bisect.bisect_right([entry[position] for entry in self.index], value) - 1
+        if segment < 0:
+            return 0
+        start = self.index[segment][0]
+        end = self.index[segment + 1][0] if segment + 1 < len(self.index) else len(self)
+        return start + int(self.columns[column][start:end].searchsorted(value))
+
+    def row_at_time(self, time_ms):
+        """
+        Returns the first row recorded at or after time_ms
+        """
+        return self._seek('time_ms', 1, time_ms)
+
+    def row_at_distance(self, distance_m):
+        """
+        Returns the first row with a total distance of at least distance_m (within one rowing between two resets)
+        """
+        return self._seek('total_distance_m', 2, distance_m)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Summary of a recorded session")
+    parser.add_argument("session", help="session folder written with --record-dir")
+    args = parser.parse_args(args)
+
+    started = time.perf_counter()
+    session = Session(args.session)
+    watts = session['watts'][:]
+    loaded = time.perf_counter() - started
+    print("%d rows in %d segments, loaded in %.1f ms" % (len(session), len(session.index), loaded * 1000))
+    if len(session):
+        print("duration %.1f s, distance %d m, max power %d W" % (
+            session['time_ms'][-1] / 1000.0, session['total_distance_m'].max(), watts.max()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import threading
+import time
+from array import array
+from collections.abc import Mapping
+
+from .record import FIELDS, FIELD_INDEX, TOTAL_DISTANCE_M, ELAPSEDTIME, record_to_dict
+
+MIN_PUBLISH_INTERVAL = 0.05  # seconds, upper bound of the publish rate while values change
+MAX_PUBLISH_INTERVAL = 1.0   # seconds, the last snapshot is published again if nothing changed for that long
+
+
+class Snapshot(Mapping):
+    """
+    Read-only set of rowing values as published by a data logger. One snapshot is shared by all sinks
+    (BLE, ANT+, ...) so nobody copies it and nobody can change it under the feet of another thread. Every
+    published change gets a new, higher version. The values are a record (see record.py) behind a read-only
+    memoryview, encoders index snapshot.record directly with the field constants, everybody else can look them
+    up by field name. No sink needs a copy of its own.
+    """
+    __slots__ = ('version', 'at', 'record')
+
+    def __init__(self, record, version=0, at=None):
+        self.record = memoryview(record).toreadonly()
+        self.version = version
+        self.at = time.monotonic_ns() if at is None else at
+
+    def __getitem__(self, key):
+        return self.record[FIELD_INDEX[key]]
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __repr__(self):
+        return "Snapshot(v%d, %r)" % (self.version, record_to_dict(self.record))
+
+    def changed_since(self, version):
+        return self.version > version
+
+
+class SnapshotPublisher(object):
+    """
+    Keeps the last published snapshot of a data logger. publish() only creates a new snapshot when the
+    values differ from the last one, so readers can tell with the version whether anything changed.
+    """
+
+    def __init__(self, record):
+        self._snapshot = Snapshot(array(record.typecode, record))
+        self._lock = threading.Lock()
+        self.changed = threading.Event()  # set whenever a new snapshot has been created
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def publish(self, record):
+        with self._lock:
+            snapshot = self._snapshot
+            if record != snapshot.record:
+                snapshot = self._snapshot = Snapshot(array(record.typecode, record), snapshot.version + 1)
+                self.changed.set()
+        return snapshot
+
+    def changed_since(self, version):
+        return self._snapshot.version > version
+
+
+class SinkPublisher(object):
+    """
+    Hands the snapshots of a data logger to the sinks (the BLE and ANT+ deques) when they change instead
+    of in a fixed loop. A change is published at most every min_interval, so a burst of changes ends up
+    as one publish, and the current snapshot is published again after max_interval without change.
+    """
+
+    def __init__(self, source, changed, sinks, min_interval=MIN_PUBLISH_INTERVAL, max_interval=MAX_PUBLISH_INTERVAL):
+        self._source = source
+        self._changed = changed
+        self._sinks = sinks
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.published = 0
+
+    def run(self, stop_event=None):
+        last_version = -1
+        last_publish = 0
+        while not (stop_event and stop_event.is_set()):
+            self._changed.wait(self.max_interval)
+            self._changed.clear()
+            wait = last_publish + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            snapshot = self._source()
+            now = time.monotonic()
+            if snapshot.version == last_version and now - last_publish < self.max_interval:
+                continue
+            for sink in self._sinks:
+                sink.append(snapshot)
+            last_version = snapshot.version
+            last_publish = now
+            self.published += 1
+
+
+class WorkoutSink(object):
+    """
+    Base of the sinks which handle whole workouts. A workout starts with the first snapshot with a distance or
+    time and ends with the reset of the rower (or close()). Subclasses implement start_workout(), add_snapshot()
+    and finish_workout(), which are called with the lock held. Snapshots published again are skipped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_version = None
+        self.in_workout = False
+
+    def append(self, snapshot):
+        with self._lock:
+            if snapshot.version == self._last_version:
+                return
+            self._last_version = snapshot.version
+            values = snapshot.record
+            rowing = values[TOTAL_DISTANCE_M] or values[ELAPSEDTIME]
+            if not self.in_workout:
+                if not rowing:
+                    return
+                self.in_workout = True
+                self.start_workout(snapshot)
+            elif not rowing:
+                self.in_workout = False
+                self.finish_workout()
+                return
+            self.add_snapshot(snapshot)
+
+    def close(self):
+        with self._lock:
+            if self.in_workout:
+                self.in_workout = False
+                self.finish_workout()
+
+    def start_workout(self, snapshot):
+        pass
+
+    def add_snapshot(self, snapshot):
+        pass
+
+    def finish_workout(self):
+        pass
@@ -0,0 +1,200 @@
+import logging
+import struct
+import sys
+from array import array
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# One record per stroke, integers in the unit noted next to the field. A stroke lasts from one stroke start to
+# the next, the drive from the stroke start to the stroke end.
+STROKE_FIELDS = (
+    'number',        # strokes since the reset, starting at 1
+    'start_ms',      # session time of the stroke start, ms
+    'drive_ms',      # ms
+    'recovery_ms',   # ms
+    'peak_watts',    # W, highest power during the drive
+    'avg_watts',     # W, mean power over the whole stroke
+    'distance_cm',   # cm
+    'stroke_rate',   # 0.1 strokes/min, from the duration of this stroke
+)
+STROKE_WIDTH = len(STROKE_FIELDS)
+Stroke = namedtuple('Stroke', STROKE_FIELDS)
+
+TYPECODE = 'i'
+SPILL_MAGIC = b'PRFSTRK1'
+SPILL_HEADER = struct.Struct('<8sH')
+SPILL_CAPACITY = 4096  # strokes kept in memory when spilling to disk, the older ones go to the spill file
+
+
+class StrokeStore(object):
+    """
+    Append-only store of stroke records in one flat array. The last strokes are in memory, with a spill file
+    the older ones are written there in blocks and dropped from memory, without they are all kept.
+    """
+
+    def __init__(self, spill_path=None, capacity=SPILL_CAPACITY):
+        self._strokes = array(TYPECODE)
+        self._spilled = 0        # strokes since the reset which went to the spill file
+        self._spill_total = 0    # strokes in the spill file, over all resets
+        self.capacity = capacity
+        self._clear_callbacks = []
+        self._spill = None
+        if spill_path:
+            self._spill = open(spill_path, 'wb')
+            self._spill.write(SPILL_HEADER.pack(SPILL_MAGIC, STROKE_WIDTH))
+            logger.info("spilling strokes to %s", spill_path)
+
+    def __len__(self):
+        return self._spilled + len(self._strokes) // STROKE_WIDTH
+
+    @property
+    def in_memory(self):
+        return len(self._strokes) // STROKE_WIDTH
+
+    def append(self, values):
+        self._strokes.extend(values)
+        if self._spill and len(self._strokes) >= 2 * self.capacity * STROKE_WIDTH:
+            self._spill_oldest(self.capacity)
+
+    def _spill_oldest(self, count):
+        end = count * STROKE_WIDTH
+        block = self._strokes[:end]
+        if sys.byteorder != 'little':
+            block.byteswap()
+        self._spill.write(block.tobytes())
+        self._spill.flush()
+        del self._strokes[:end]
+        self._spilled += count
+        self._spill_total += count
+
+    def __getitem__(self, index):
+        """
+        Stroke by its position since the reset, negative positions count from the last stroke
+        """
+        if index < 0:
+            index += len(self)
+        position = index - self._spilled
+        if not 0 <= position < self.in_memory:
+            raise IndexError("stroke %d is not in memory" % index)
+        start = position * STROKE_WIDTH
+        return Stroke(*self._strokes[start:start + STROKE_WIDTH])
+
+    def last(self, count=1):
+        """
+        Returns the last count strokes in memory, the oldest first
+        """
+        count = min(count, self.in_memory)
+        strokes = self._strokes[len(self._strokes) - count * STROKE_WIDTH:]
+        return [Stroke(*strokes[i:i + STROKE_WIDTH]) for i in range(0, len(strokes), STROKE_WIDTH)]
+
+    def column(self, field, count=None):
+        """
+        Returns one field of the last count strokes in memory (all without count) as array
+        """
+        offset = STROKE_FIELDS.index(field)
+        start = 0 if count is None else max(0, self.in_memory - count) * STROKE_WIDTH
+        return self._strokes[start + offset::STROKE_WIDTH]
+
+    def register_clear_callback(self, cb):
+        """
+        cb() is called by clear() while the strokes since the reset are still there
+        """
+        self._clear_callbacks.append(cb)
+
+    def clear(self):
+        for cb in self._clear_callbacks:
+            cb()
+        if self._spill:
+            self._spill_oldest(self.in_memory)
+        self._strokes = array(TYPECODE)
+        # the positions count from the reset, the spill file keeps the strokes of all of them
+        self._spilled = 0
+
+    def close(self):
+        if self._spill:
+            self._spill_oldest(self.in_memory)
+            self._spill.close()
+            logger.info("%d strokes spilled to %s", self._spill_total, self._spill.name)
+            self._spill = None
+
+
+def read_spill(path):
+    """
+    Yields the strokes of a spill file
+    """
+    with open(path, 'rb') as f:
+        magic, width = SPILL_HEADER.unpack(f.read(SPILL_HEADER.size))
+        if magic != SPILL_MAGIC:
+            raise ValueError("%s is not a stroke spill file" % path)
+        record = struct.Struct('<%di' % width)
+        while True:
+            data = f.read(record.size)
+            if len(data) < record.size:
+                return
+            yield Stroke(*record.unpack(data)[:STROKE_WIDTH])
+
+
+class StrokeSegmenter(object):
+    """
+    Cuts the rowing into strokes from the stroke start and end events and the power readings in between.
+    A stroke is complete with the start of the next one and then appended to the store.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.reset()
+
+    def reset(self):
+        self._number = 0
+        self._start = None
+        self._end = None
+        self._start_ms = 0
+        self._start_distance = 0
+        self._peak = 0
+        self._power_sum = 0
+        self._power_samples = 0
+
+    def stroke_start(self, at, distance_m, session_ms):
+        if self._start is not None and self._end is not None:
+            self._finish(at, distance_m)
+        self._start = at
+        self._end = None
+        self._start_ms = session_ms
+        self._start_distance = distance_m
+        self._peak = 0
+        self._power_sum = 0
+        self._power_samples = 0
+
+    def stroke_end(self, at):
+        if self._start is not None and self._end is None:
+            self._end = at
+
+    def power(self, watts):
+        if self._start is None:
+            return
+        if self._end is None and watts > self._peak:
+            self._peak = watts
+        self._power_sum += watts
+        self._power_samples += 1
+
+    def abort(self):
+        # at standstill the stroke in progress has no end, it is dropped
+        self._start = None
+        self._end = None
+
+    def _finish(self, at, distance_m):
+        duration = at - self._start
+        if duration <= 0:
+            return
+        self._number += 1
+        self.store.append((
+            self._number,
+            self._start_ms,
+            (self._end - self._start) // 1000000,
+            (at - self._end) // 1000000,
+            self._peak,
+            self._power_sum // self._power_samples if self._power_samples else 0,
+            max(0, distance_m - self._start_distance) * 100,
+            600000000000 // duration,
+        ))
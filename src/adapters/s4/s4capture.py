@@ -0,0 +1,195 @@
+# ---------------------------------------------------------------------------
+# Capture and replay of the raw S4 serial traffic
+# ---------------------------------------------------------------------------
+#
+# File format (little endian):
+#   header: magic "PRFS4CAP", uint16 version, uint64 wall clock time of the capture start in ns
+#   record: uint64 monotonic ns since the capture start, uint16 length, payload
+# The payload of a record are the complete CR/LF terminated lines received with one read of the serial port.
+#
+# Replay from the src folder as fast as possible to benchmark the parsing and DataLogger path:
+#
+#   python3 -m adapters.s4.s4capture capture.s4cap --speed 0
+
+import argparse
+import logging
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PRFS4CAP'
+VERSION = 1
+HEADER = struct.Struct('<8sHQ')
+RECORD = struct.Struct('<QH')
+FLUSH_INTERVAL_NS = 1000000000  # the process is usually killed, so the capture is flushed every second
+
+
+class CaptureWriter(object):
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, time.time_ns()))
+        self._start = time.monotonic_ns()
+        self._last_flush = self._start
+        self._lock = threading.Lock()
+        logger.info("capturing S4 serial traffic to %s", path)
+
+    def write(self, lines, at=None):
+        if at is None:
+            at = time.monotonic_ns()
+        with self._lock:
+            if self._file:
+                self._file.write(RECORD.pack(at - self._start, len(lines)))
+                self._file.write(lines)
+                if at - self._last_flush > FLUSH_INTERVAL_NS:
+                    self._file.flush()
+                    self._last_flush = at
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+def read_capture(path):
+    """
+    Yields (ns since capture start, lines) for every record of a capture file
+    """
+    with open(path, 'rb') as f:
+        magic, version, _ = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a S4 capture file" % path)
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            offset, length = RECORD.unpack(head)
+            lines = f.read(length)
+            if len(lines) < length:
+                logger.warning("capture %s is truncated", path)
+                return
+            yield offset, lines
+
+
+class ReplaySerial(object):
+    """
+    Stands in for serial.Serial in the Rower and hands out the lines of a capture file with their original
+    timing divided by speed, or as fast as they are read if speed is 0. Everything written to it is dropped.
+    clock() is the capture time of the lines read last, the Rower stamps the events with it, so the standstill
+    check and the session clock of the DataLogger run on the captured time at any speed.
+    """
+
+    def __init__(self, path, speed=1.0):
+        self.port = path
+        self.baudrate = None
+        self.timeout = None
+        self.speed = speed
+        self.finished = threading.Event()
+        self.lines_replayed = 0
+        self.first_read = None
+        self.last_read = None
+        self._records = None
+        self._next = None
+        self._pending = b''
+        self._start = None
+        self._offset = 0
+
+    def clock(self):
+        return self._offset
+
+    def open(self):
+        self._records = read_capture(self.port)
+        self._next = next(self._records, None)
+        self._pending = b''
+        self._start = time.monotonic_ns()
+        self.finished.clear()
+        logger.info("replaying S4 capture %s at speed %s", self.port, self.speed or "max")
+
+    def isOpen(self):
+        return self._records is not None
+
+    is_open = property(isOpen)
+
+    def close(self):
+        self._records = None
+
+    def _due(self):
+        if self._next is None:
+            return False
+        if not self.speed:
+            return True
+        return time.monotonic_ns() - self._start >= self._next[0] / self.speed
+
+    @property
+    def in_waiting(self):
+        if not self._pending and self._due():
+            self._advance()
+        return len(self._pending)
+
+    def _advance(self):
+        if self.first_read is None:
+            self.first_read = time.monotonic()
+        self.last_read = time.monotonic()
+        self._offset, self._pending = self._next
+        self.lines_replayed += self._pending.count(b'\n')
+        self._next = next(self._records, None)
+
+    def read(self, size=1):
+        if not self._pending:
+            if self._next is None:
+                self.finished.set()
+                time.sleep(self.timeout or 0.1)
+                return b''
+            if not self._due():
+                wait = (self._start + self._next[0] / self.speed - time.monotonic_ns()) / 1e9
+                time.sleep(min(wait, self.timeout) if self.timeout else wait)
+                if not self._due():
+                    return b''
+            self._advance()
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self._pending = b''
+
+
+def main(args=None):
+    from . import waterrowerinterface
+    from . import wrtobleant
+
+    parser = argparse.ArgumentParser(description="Replay a S4 capture through the Rower and DataLogger")
+    parser.add_argument("capture", help="capture file written with --s4-capture")
+    parser.add_argument("--speed", type=float, default=0, help="replay speed, 1 is real time, 0 as fast as possible")
+    args = parser.parse_args(args)
+
+    options = argparse.Namespace(s4_replay=args.capture, replay_speed=args.speed)
+    rower = waterrowerinterface.Rower(options)
+    datalogger = wrtobleant.DataLogger(rower)
+    counter = {'events': 0}
+
+    def count(events):
+        counter['events'] += len(events)
+
+    rower.subscribe(count, batched=True)
+    replay = rower._serial
+    cpu_started = time.process_time()
+    rower.open()
+    replay.finished.wait()
+    cpu = time.process_time() - cpu_started
+    rower.close()
+    elapsed = max(replay.last_read - replay.first_read, 1e-6) if replay.first_read else 1e-6
+    print("%d lines, %d events in %.3f s (%.0f lines/s, cpu %.3f s)" % (
+        replay.lines_replayed, counter['events'], elapsed, replay.lines_replayed / elapsed, cpu))
+    print(datalogger.get_WRValues())
+
+
+if __name__ == '__main__':
+    main()
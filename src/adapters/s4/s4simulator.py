@@ -0,0 +1,286 @@
+# ---------------------------------------------------------------------------
+# S4 monitor simulator on a pseudo terminal
+# ---------------------------------------------------------------------------
+#
+# Opens a Linux pty and answers the commands of the S4 serial protocol (USB, IV?, IR[SDT]xxx, RESET, EXIT)
+# from a synthetic memory which is driven by a simple stroke model. While rowing it sends the SS/SE stroke
+# events and the P pulse counts like the real monitor, at standstill it sends PING.
+#
+# Run the simulator and point PiRowFlo at the printed port:
+#
+#   python3 -m adapters.s4.s4simulator --spm 26 --watts 180 --latency 3 --jitter 1
+#   python3 waterrowerthreads.py -i s4 --s4-port /dev/pts/3
+#
+# or measure polling throughput, reply latency and cpu usage of the S4 path in one process:
+#
+#   python3 -m adapters.s4.s4simulator --bench 30
+
+import argparse
+import heapq
+import logging
+import math
+import os
+import random
+import threading
+import time
+import tty
+
+from . import waterrowerinterface
+from .waterrowerinterface import MEMORY_MAP
+
+logger = logging.getLogger(__name__)
+
+TICK = 0.025                # the S4 reports pulse counts every 25 ms
+PULSES_PER_METER = 4.8      # teeth per meter of the paddle wheel which produce a pulse
+DRIVE_RATIO = 0.35          # part of a stroke spent in the drive
+POWER_TO_SPEED = 2.8        # P = 2.8 * v^3, the usual rowing power to boat speed relation
+PING_INTERVAL = 1.0
+VALUE_DIGITS = {'single': 2, 'double': 4, 'triple': 6}
+
+
+class S4Simulator(object):
+    def __init__(self, spm=24, watts=150, latency=0.003, jitter=0.001, baudrate=19200, work=0, rest=0):
+        self.spm = spm
+        self.watts = watts
+        self.latency = latency
+        self.jitter = jitter
+        self.baudrate = baudrate
+        self.work = work
+        self.rest = rest
+        self.requests = 0
+        self.errors = 0
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._stop_event = threading.Event()
+        self._cond = threading.Condition()
+        self._outgoing = []
+        self._sequence = 0
+        self._line_free_at = 0
+        self._last_due = 0
+        self._memory = {}
+        self._reset_memory()
+        self._threads = [threading.Thread(target=target, daemon=True)
+                         for target in (self._read_commands, self._write_replies, self._run_model)]
+
+    def start(self):
+        for t in self._threads:
+            t.start()
+        logger.info("S4 simulator listening on %s", self.port)
+
+    def stop(self):
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify()
+
+    def _reset_memory(self):
+        self._memory = dict.fromkeys(MEMORY_MAP, 0)
+        self._distance = 0.0
+        self._kcal = 0.0
+        self._strokes = 0
+        self._started = time.monotonic()
+
+    def _send(self, text, delay=0.0):
+        data = (text + '\r\n').encode()
+        with self._cond:
+            # the jitter must not reorder the replies, a serial line keeps them in sequence
+            due = max(time.monotonic() + delay, self._last_due)
+            self._last_due = due
+            self._sequence += 1
+            heapq.heappush(self._outgoing, (due, self._sequence, data))
+            self._cond.notify()
+
+    def _reply_delay(self):
+        return max(0.0, random.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+
+    def _write_replies(self):
+        while not self._stop_event.is_set():
+            with self._cond:
+                while not self._stop_event.is_set():
+                    now = time.monotonic()
+                    if self._outgoing and self._outgoing[0][0] <= now:
+                        data = heapq.heappop(self._outgoing)[2]
+                        break
+                    self._cond.wait(self._outgoing[0][0] - now if self._outgoing else None)
+                else:
+                    return
+            if self.baudrate:
+                # a byte is 10 bits on the wire, the line is busy until the previous reply is out
+                now = time.monotonic()
+                start = max(now, self._line_free_at)
+                self._line_free_at = start + len(data) * 10.0 / self.baudrate
+                if self._line_free_at > now:
+                    time.sleep(self._line_free_at - now)
+            os.write(self._master, data)
+
+    def _read_commands(self):
+        buffer = b''
+        while not self._stop_event.is_set():
+            try:
+                data = os.read(self._master, 256)
+            except OSError:
+                return
+            buffer += data
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                line = line.strip().decode('ascii', 'replace')
+                if line:
+                    self._handle(line)
+
+    def _handle(self, cmd):
+        if cmd == waterrowerinterface.USB_REQUEST:
+            self._send(waterrowerinterface.WR_RESPONSE, self._reply_delay())
+        elif cmd == waterrowerinterface.EXIT_REQUEST:
+            self._send(waterrowerinterface.OK_RESPONSE, self._reply_delay())
+        elif cmd == waterrowerinterface.RESET_REQUEST:
+            self._reset_memory()
+            self._send(waterrowerinterface.OK_RESPONSE, self._reply_delay())
+        elif cmd == waterrowerinterface.MODEL_INFORMATION_REQUEST:
+            self._send("IV40210", self._reply_delay())
+        elif cmd[:2] == waterrowerinterface.READ_MEMORY_REQUEST and len(cmd) == 6:
+            self.requests += 1
+            self._send(self._read_memory(cmd[2], cmd[3:6]), self._reply_delay())
+        else:
+            self.errors += 1
+            self._send(waterrowerinterface.ERROR_RESPONSE, self._reply_delay())
+
+    def _read_memory(self, size, address):
+        memory = MEMORY_MAP.get(address)
+        if memory is None:
+            self.errors += 1
+            return waterrowerinterface.ERROR_RESPONSE
+        digits = VALUE_DIGITS[memory['size']]
+        value = self._memory[address] % (memory['base'] ** digits)
+        if memory['base'] == 10:
+            text = '%0*d' % (digits, value)
+        else:
+            text = '%0*X' % (digits, value)
+        return 'ID' + size + address + text
+
+    def _rowing(self, now):
+        if not self.work or not self.rest:
+            return self.spm > 0
+        return (now - self._started) % (self.work + self.rest) < self.work
+
+    def _run_model(self):
+        next_tick = time.monotonic()
+        last_ping = 0
+        stroke_phase = 0.0
+        in_drive = False
+        pulse_remainder = 0.0
+        while not self._stop_event.is_set():
+            next_tick += TICK
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            now = time.monotonic()
+            memory = self._memory
+            if not self._rowing(now):
+                memory['088'] = memory['148'] = memory['14A'] = memory['1A9'] = 0
+                in_drive = False
+                if now - last_ping >= PING_INTERVAL:
+                    self._send(waterrowerinterface.PING_RESPONSE)
+                    last_ping = now
+                continue
+
+            stroke_time = 60.0 / self.spm
+            stroke_phase += TICK / stroke_time
+            if stroke_phase >= 1.0:
+                stroke_phase -= 1.0
+                self._strokes += 1
+            drive = stroke_phase < DRIVE_RATIO
+            if drive and not in_drive:
+                self._send(waterrowerinterface.STROKE_START_RESPONSE)
+            elif not drive and in_drive:
+                self._send(waterrowerinterface.STROKE_END_RESPONSE)
+            in_drive = drive
+
+            # power peaks in the middle of the drive and decays during the recovery, averaging self.watts
+            if drive:
+                power = self.watts * 1.9 * math.sin(math.pi * stroke_phase / DRIVE_RATIO) + self.watts * 0.3
+            else:
+                power = self.watts * 0.3
+            power = max(0.0, random.gauss(power, power * 0.03))
+            speed = (self.watts / POWER_TO_SPEED) ** (1.0 / 3.0) * (1.1 if drive else 0.95)
+            self._distance += speed * TICK
+            self._kcal += (4 * power + 300) * TICK / 3600.0  # kcal/h = 4 * watts + 300
+
+            pulses = speed * TICK * PULSES_PER_METER + pulse_remainder
+            pulse_remainder = pulses - int(pulses)
+            if int(pulses):
+                self._send('P%02X' % int(pulses))
+
+            elapsed = now - self._started
+            memory['055'] = int(self._distance)
+            memory['140'] = self._strokes
+            memory['088'] = int(power)
+            memory['08A'] = int(self._kcal * 1000)
+            memory['148'] = int(speed * 100)
+            memory['14A'] = int(speed * 100)
+            memory['1A9'] = int(self.spm)
+            memory['1A6'] = int(speed * 100)
+            memory['142'] = int(stroke_time * 25)
+            memory['143'] = int(stroke_time * DRIVE_RATIO * 25)
+            memory['1E0'] = int(elapsed * 10) % 10
+            memory['1E1'] = int(elapsed) % 60
+            memory['1E2'] = int(elapsed / 60) % 60
+            memory['1E3'] = int(elapsed / 3600)
+
+
+def bench(simulator, duration):
+    from . import wrtobleant
+
+    options = argparse.Namespace(s4_port=simulator.port)
+    rower = waterrowerinterface.Rower(options)
+    datalogger = wrtobleant.DataLogger(rower)
+    rower.open()
+    rower.reset_request()
+    cpu_started = time.process_time()
+    time.sleep(duration)
+    cpu = time.process_time() - cpu_started
+    print("requests answered: %d (%.1f/s, minimum rates %.1f/s), cpu %.1f%% (simulator included)" % (
+        simulator.requests, simulator.requests / duration, sum(rower.target_rates().values()),
+        cpu / duration * 100))
+    for field, rate in sorted(rower.refresh_rates().items()):
+        print("  %-24s %6.2f Hz" % (field, rate))
+    for address, stats in sorted(rower.latency_stats().items()):
+        print("  %-24s rtt avg %5.1f ms max %5.1f ms timeouts %d lost %d" % (
+            MEMORY_MAP[address]['type'], stats['avg'] * 1000, stats['max'] * 1000, stats['timeouts'],
+            stats['lost']))
+    print(datalogger.get_WRValues())
+    rower.close()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Simulate a Waterrower S4 monitor on a pseudo terminal")
+    parser.add_argument("--spm", type=float, default=24, help="stroke rate in strokes per minute")
+    parser.add_argument("--watts", type=float, default=150, help="average power in watts")
+    parser.add_argument("--latency", type=float, default=3, help="reply latency in ms")
+    parser.add_argument("--jitter", type=float, default=1, help="standard deviation of the reply latency in ms")
+    parser.add_argument("--baud", type=int, default=19200, help="simulated line speed, 0 for unlimited")
+    parser.add_argument("--work", type=float, default=0, help="seconds of rowing before a rest, 0 rows continuously")
+    parser.add_argument("--rest", type=float, default=0, help="seconds of standstill after each work period")
+    parser.add_argument("--bench", type=float, default=0, metavar="SECONDS",
+                        help="run a Rower against the simulator for SECONDS and print its statistics")
+    args = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO)
+    simulator = S4Simulator(spm=args.spm, watts=args.watts, latency=args.latency / 1000.0,
+                            jitter=args.jitter / 1000.0, baudrate=args.baud, work=args.work, rest=args.rest)
+    simulator.start()
+    if args.bench:
+        bench(simulator, args.bench)
+        simulator.stop()
+        return
+    print("S4 simulator on %s" % simulator.port)
+    try:
+        while True:
+            time.sleep(10)
+            logger.info("%d memory requests answered, %d errors", simulator.requests, simulator.errors)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -7,34 +7,49 @@
 # -*- coding: utf-8 -*-
 import threading
 import logging
+import heapq
 
 import time
+from collections import deque
 import serial
 import serial.tools.list_ports
 
 logger = logging.getLogger(__name__)
 
-MEMORY_MAP = {'055': {'type': 'total_distance_m', 'size': 'double', 'base': 16},
-              '140': {'type': 'total_strokes', 'size': 'double', 'base': 16},
-              '088': {'type': 'watts', 'size': 'double', 'base': 16},
-              '08A': {'type': 'total_kcal', 'size': 'triple', 'base': 16},
-              '14A': {'type': 'avg_distance_cmps', 'size': 'double', 'base': 16},
-              '148': {'type': 'total_speed_cmps', 'size': 'double', 'base': 16},
-              '1E0': {'type': 'display_sec_dec', 'size': 'single', 'base': 10},
-              '1E1': {'type': 'display_sec', 'size': 'single', 'base': 10},
-              '1E2': {'type': 'display_min', 'size': 'single', 'base': 10},
-              '1E3': {'type': 'display_hr', 'size': 'single', 'base': 10},
+# 'rate' is the minimum refresh rate in Hz for the address, 'priority' breaks ties between addresses which are
+# due at the same time (lower value wins). The hot fields are refreshed several times per polling cycle, the slow
+# ones only every few seconds. What the serial line can do on top is shared in proportion to the rates.
+MEMORY_MAP = {'055': {'type': 'total_distance_m', 'size': 'double', 'base': 16, 'rate': 5, 'priority': 1},
+              '140': {'type': 'total_strokes', 'size': 'double', 'base': 16, 'rate': 2, 'priority': 1},
+              '088': {'type': 'watts', 'size': 'double', 'base': 16, 'rate': 16, 'priority': 0},
+              '08A': {'type': 'total_kcal', 'size': 'triple', 'base': 16, 'rate': 1, 'priority': 2},
+              '14A': {'type': 'avg_distance_cmps', 'size': 'double', 'base': 16, 'rate': 8, 'priority': 0},
+              '148': {'type': 'total_speed_cmps', 'size': 'double', 'base': 16, 'rate': 8, 'priority': 0},
+              # the elapsed time comes from the session clock, the display is only read to keep the clock in sync
+              '1E0': {'type': 'display_sec_dec', 'size': 'single', 'base': 10, 'not_in_loop': True},
+              '1E1': {'type': 'display_sec', 'size': 'single', 'base': 10, 'rate': 0.2, 'priority': 3},
+              '1E2': {'type': 'display_min', 'size': 'single', 'base': 10, 'rate': 0.1, 'priority': 3},
+              '1E3': {'type': 'display_hr', 'size': 'single', 'base': 10, 'rate': 0.02, 'priority': 3},
               # from zone math
-              '1A0': {'type': 'heart_rate', 'size': 'double', 'base': 16},
-              '1A6': {'type': '500mps', 'size': 'double', 'base': 16},
-              '1A9': {'type': 'stroke_rate', 'size': 'single', 'base': 16},
+              '1A0': {'type': 'heart_rate', 'size': 'double', 'base': 16, 'rate': 1, 'priority': 2},
+              '1A6': {'type': '500mps', 'size': 'double', 'base': 16, 'rate': 0.5, 'priority': 3},
+              '1A9': {'type': 'stroke_rate', 'size': 'single', 'base': 16, 'rate': 8, 'priority': 0},
               # explore
-              '142': {'type': 'avg_time_stroke_whole', 'size': 'single', 'base': 16},
-              '143': {'type': 'avg_time_stroke_pull', 'size': 'single', 'base': 16},
+              '142': {'type': 'avg_time_stroke_whole', 'size': 'single', 'base': 16, 'rate': 0.2, 'priority': 3},
+              '143': {'type': 'avg_time_stroke_pull', 'size': 'single', 'base': 16, 'rate': 0.2, 'priority': 3},
               #other
               '0A9': {'type': 'tank_volume', 'size': 'single', 'base': 16, 'not_in_loop': True},
              }
 
+PIPELINE_WINDOW = 2       # memory requests which may be in flight at the same time
+POLL_AHEAD = True         # request the next address as soon as a slot is free instead of waiting until it is due
+REPLY_TIMEOUT = 0.1       # seconds after which a memory request without reply is considered lost
+REPLY_RETRIES = 2         # how often a lost memory request is sent again before it is given up
+RATE_WINDOW = 10          # seconds over which the achieved refresh rate is measured
+RATE_LOG_INTERVAL = 60    # seconds between two refresh rate reports in the log
+READ_TIMEOUT = 0.1        # seconds a read on the serial port waits for the first byte
+MAX_LINE_LENGTH = 1024    # bytes without line end after which the receive buffer is considered garbage
+
 
 # ACH values = Ascii coded hexadecimal
 # REQUEST sent from PC to device
@@ -109,9 +124,34 @@ UNIT_MAP = {'meters': 1,
             'km': 3,
             'strokes': 4}
 
-SIZE_PARSE_MAP = {'single': lambda cmd: cmd[6:8],
-                  'double': lambda cmd: cmd[6:10],
-                  'triple': lambda cmd: cmd[6:12]}
+# end of the hex value in a reply line ID + (S,D,T) + XXX + value
+SIZE_PARSE_MAP = {'single': 8,
+                  'double': 10,
+                  'triple': 12}
+
+# Event type codes. The events which are not a memory value come first, the fields of MEMORY_MAP follow in
+# their order. Consumers compare the integer code, EVENT_TYPES gives back the name for logging.
+EVENT_TYPES = ('stroke_start', 'stroke_end', 'pulse', 'ping', 'model', 'error', 'reset', 'exit') + \
+              tuple(memory['type'] for memory in MEMORY_MAP.values())
+EVENT_CODES = {type: code for code, type in enumerate(EVENT_TYPES)}
+
+EVENT_STROKE_START = EVENT_CODES['stroke_start']
+EVENT_STROKE_END = EVENT_CODES['stroke_end']
+EVENT_PULSE = EVENT_CODES['pulse']
+EVENT_PING = EVENT_CODES['ping']
+EVENT_MODEL = EVENT_CODES['model']
+EVENT_ERROR = EVENT_CODES['error']
+EVENT_RESET = EVENT_CODES['reset']
+EVENT_EXIT = EVENT_CODES['exit']
+
+# precomputed from MEMORY_MAP: address as received in the ID reply -> (code, start, end, base) of the value
+REPLY_MAP = {address.encode(): (EVENT_CODES[memory['type']], 6, SIZE_PARSE_MAP[memory['size']], memory['base'])
+             for address, memory in MEMORY_MAP.items()}
+
+# event code -> address, used to match a reply event with its outstanding request
+CODE_ADDRESS = [None] * len(EVENT_TYPES)
+for address, memory in MEMORY_MAP.items():
+    CODE_ADDRESS[EVENT_CODES[memory['type']]] = address
 
 
 
@@ -138,72 +178,330 @@ def build_daemon(target):
     return t
 
 
-def build_event(type, value=None, raw=None):
-    return {"type": type,
-            "value": value,
-            "raw": raw,
-            "at": int(round(time.time() * 1000))}
+class Event(object):
+    """
+    One message of the S4: the event type code, the value of a memory reply (None otherwise) and the
+    timestamp in ns of its reception, time.monotonic_ns() or the capture time when replaying
+    """
+    __slots__ = ('code', 'value', 'at')
+
+    def __init__(self, code, value, at):
+        self.code = code
+        self.value = value
+        self.at = at
+
+    @property
+    def type(self):
+        return EVENT_TYPES[self.code]
+
+    def __repr__(self):
+        return "Event(%s, %r, %d)" % (EVENT_TYPES[self.code], self.value, self.at)
+
+
+def build_event(code, value=None, at=None):
+    return Event(code, value, time.monotonic_ns() if at is None else at)
 
 
 def is_live_thread(t):
     return t and t.is_alive()
 
 
-def read_reply(cmd):
-    address = cmd[3:6]
-    memory = MEMORY_MAP.get(address)
+def read_reply(line, at):
+    memory = REPLY_MAP.get(line[3:6])
     if memory:
-        size = memory['size']
-        value_fn = SIZE_PARSE_MAP.get(size, lambda cmd: None)
-        value = value_fn(cmd)
-        if value is None:
-            logger.error('unknown size: %s', size)
-        else:
-            return build_event(memory['type'], int(value, base=memory['base']), cmd)
+        code, start, end, base = memory
+        return Event(code, int(line[start:end], base), at)
     else:
-        logger.error('cannot read reply for %s', cmd)
-
-
-def event_from(line):
-    try:
-        cmd = line.strip()  # to ensure no space are in front or at the back call the function strip()
-        cmd = cmd.decode('utf8')  # encode it to utf8 ro remove b'
-        if cmd == STROKE_START_RESPONSE:  # with is "SS" from the waterrower
-            return build_event(type='stroke_start', raw=cmd)  # Call the methode to create a dict with the name stroke_start and the row command used for it "SS"
-        elif cmd == STROKE_END_RESPONSE:  # with is "SE" from the waterrower
-            return build_event(type='stroke_end', raw=cmd)  # Call the methode to create a dict with the name stroke_end and the row command used for it "SE"
-        elif cmd == OK_RESPONSE:  # If waterrower responce "OK" do nothing
-            return None
-        elif cmd[:2] == MODEL_INFORMATION_RESPONSE:  # If MODEL information has been request, the model responce would be "IV"
-            return build_event(type='model', raw=cmd)  # Call the methode to create a dict with the model and the row command used for it "SE"
-        elif cmd[:2] == READ_MEMORY_RESPONSE:  # if after memory request the responce comes from the waterrower
-            return read_reply(cmd)  # proced to the function read_reply which strips away everything and keeps the value and create the event dict for that request
-        elif cmd[:4] == PING_RESPONSE:  # if Ping responce is recived which is all the time the rower is in standstill
-            return build_event(type='ping', raw=cmd)  # do nothing
-        elif cmd[:1] == PULSE_COUNT_RESPONSE:  # Pluse count count the amount of 25 teeth passed 25teeth passed = P1
-            return build_event(type='pulse', raw=cmd)  # do nothing
-        elif cmd == ERROR_RESPONSE:  # If Waterrower responce with an error
-            return build_event(type='error', raw=cmd)  # crate an event with the dict entry error and the raw command
-        elif cmd[:2] == STROKE_START_RESPONSE:  # Pluse count count the amount of 25 teeth passed 25teeth passed = P1
-            print(cmd)
-        else:
-            return None
-    except Exception as e:
-        logger.error('could not build event for: %s %s', line, e)
+        logger.error('cannot read reply for %s', line)
+
+
+def _stroke_event(line, at):
+    if line == b'SS':  # "SS" from the waterrower
+        return Event(EVENT_STROKE_START, None, at)
+    elif line == b'SE':  # "SE" from the waterrower
+        return Event(EVENT_STROKE_END, None, at)
+
+
+def _info_event(line, at):
+    if line[1:2] == b'D':  # "ID" reply after a memory request
+        return read_reply(line, at)
+    elif line[1:2] == b'V':  # "IV" model information
+        return Event(EVENT_MODEL, None, at)
+
+
+def _pulse_event(line, at):
+    if line[:4] == b'PING':  # received all the time the rower is in standstill
+        return Event(EVENT_PING, None, at)
+    return Event(EVENT_PULSE, None, at)  # Pulse count XX in the last 25mS, 25 teeth passed = P1
+
+
+def _error_event(line, at):
+    if line == b'ERROR':
+        return Event(EVENT_ERROR, None, at)
+
+
+# first byte of a line -> parser for the messages starting with it, everything else ("OK", "_WR_", "AK1"...)
+# does not create an event
+EVENT_PARSERS = {ord('S'): _stroke_event,
+                 ord('I'): _info_event,
+                 ord('P'): _pulse_event,
+                 ord('E'): _error_event}
+
+
+def events_from(buffer, at=None):
+    """
+    Builds the events for a buffer holding several CR/LF terminated lines in one call. All of them get the
+    same timestamp as they were received with the same read
+    """
+    if at is None:
+        at = time.monotonic_ns()
+    events = []
+    append = events.append
+    get_parser = EVENT_PARSERS.get
+    for line in buffer.split(b'\n'):
+        line = line.strip()
+        if not line:
+            continue
+        parser = get_parser(line[0])
+        if parser:
+            try:
+                event = parser(line, at)
+            except Exception as e:
+                logger.error('could not build event for: %s %s', line, e)
+                continue
+            if event:
+                append(event)
+    return events
+
+
+class SerialLineReader(object):
+    """
+    Reads the serial port in bulk instead of byte by byte as readline() does. One read drains everything the
+    driver has buffered into a reusable bytearray, the complete lines are handed out together and a partial
+    line at the end stays in the buffer until the rest of it arrives with a later read.
+    """
+
+    def __init__(self, port):
+        self._port = port
+        self._buffer = bytearray()
+
+    def reset(self):
+        del self._buffer[:]
+
+    def read_lines(self):
+        """
+        Blocks until data arrives or the port timeout expires and returns all complete lines received so
+        far as one bytes object, b'' if there is none yet
+        """
+        data = self._port.read(self._port.in_waiting or 1)
+        if not data:
+            return b''
+        buffer = self._buffer
+        buffer += data
+        end = buffer.rfind(b'\n') + 1
+        if not end:
+            if len(buffer) > MAX_LINE_LENGTH:
+                logger.error("no line end in %d bytes, dropping them", len(buffer))
+                del buffer[:]
+            return b''
+        lines = bytes(buffer[:end])
+        del buffer[:end]  # bytearray only moves its start offset when deleting from the front
+        return lines
+
+
+class PollScheduler(object):
+    """
+    Decides which MEMORY_MAP address is requested next. Every address in the polling loop gets a deadline
+    from its 'rate'; the address with the earliest deadline is requested first and 'priority' breaks ties.
+    Each request moves the deadline of its address one interval further, so an address which is requested
+    before it is due (see POLL_AHEAD) still gets its share of the requests in proportion to its rate, whether
+    the serial line is faster or slower than the sum of the rates. The replies are counted per field so the
+    achieved refresh rate can be reported.
+    """
+
+    def __init__(self, memory_map=MEMORY_MAP, window=RATE_WINDOW):
+        self._lock = threading.Lock()
+        self._memory_map = memory_map
+        self._window = window
+        self._intervals = {}
+        self._queue = []
+        self._replies = {}
+        now = time.monotonic()
+        for address, memory in memory_map.items():
+            if 'not_in_loop' in memory or not memory.get('rate'):
+                continue
+            self._intervals[address] = 1.0 / memory['rate']
+            self._replies[address] = deque()
+            heapq.heappush(self._queue, (now, memory.get('priority', 0), address))
+
+    def next_address(self):
+        """
+        Returns the address which should be requested next and the monotonic time at which it is due.
+        The address is rescheduled one interval after its due time (or after now if it is already late)
+        """
+        with self._lock:
+            due, priority, address = heapq.heappop(self._queue)
+            now = time.monotonic()
+            heapq.heappush(self._queue, (max(due, now) + self._intervals[address], priority, address))
+        return address, due
+
+    def record_reply(self, address, at=None):
+        replies = self._replies.get(address)
+        if replies is None:
+            return
+        if at is None:
+            at = time.monotonic()
+        with self._lock:
+            replies.append(at)
+            while replies and replies[0] < at - self._window:
+                replies.popleft()
+
+    def refresh_rates(self):
+        """
+        Returns the achieved refresh rate in Hz per field over the last measuring window
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {self._memory_map[address]['type']:
+                    sum(1 for at in replies if at >= now - self._window) / self._window
+                    for address, replies in self._replies.items()}
+
+    def target_rates(self):
+        return {self._memory_map[address]['type']: 1.0 / interval for address, interval in self._intervals.items()}
+
+
+class RequestPipeline(object):
+    """
+    Keeps up to 'window' memory requests in flight on the serial line. A new request is only sent when a
+    slot is free, i.e. as soon as the reply to an earlier one arrived, instead of after a fixed delay. The
+    ID replies are matched to the outstanding requests by address which gives the round trip time of every
+    request. Requests without reply are sent again after 'timeout' and given up after 'retries' attempts.
+    """
+
+    def __init__(self, send, window=PIPELINE_WINDOW, timeout=REPLY_TIMEOUT, retries=REPLY_RETRIES):
+        self._send = send
+        self._window = window
+        self._timeout = timeout
+        self._retries = retries
+        self._cond = threading.Condition()
+        self._in_flight = {}
+        self._stats = {}
+
+    def reset(self):
+        with self._cond:
+            self._in_flight.clear()
+            self._cond.notify_all()
+
+    def submit(self, address, stop_event):
+        """
+        Sends a request for address as soon as a slot in the window is free. Lost requests found while
+        waiting are sent again first. Returns False if the address is already in flight or stop_event is set
+        """
+        while True:
+            with self._cond:
+                resend = self._expire()
+                while not resend and len(self._in_flight) >= self._window:
+                    if stop_event.is_set():
+                        return False
+                    self._cond.wait(self._next_expiry())
+                    resend = self._expire()
+                if not resend:
+                    if address in self._in_flight:
+                        return False
+                    self._in_flight[address] = [time.monotonic(), 1]
+            # write outside of the lock so the capture thread can match replies meanwhile
+            if not resend:
+                self._send(address)
+                return True
+            for lost in resend:
+                self._send(lost)
+
+    def complete(self, address):
+        """
+        Matches a reply to its outstanding request. Returns the round trip time in seconds or None if no
+        request for the address was in flight
+        """
+        now = time.monotonic()
+        with self._cond:
+            request = self._in_flight.pop(address, None)
+            if request is None:
+                return None
+            latency = now - request[0]
+            stats = self._stats_for(address)
+            stats['replies'] += 1
+            stats['last'] = latency
+            stats['max'] = max(stats['max'], latency)
+            stats['avg'] = latency if stats['replies'] == 1 else stats['avg'] * 0.9 + latency * 0.1
+            self._cond.notify()
+        return latency
+
+    def latency_stats(self):
+        """
+        Returns per address the number of replies, the last, smoothed average and max round trip time in
+        seconds and the number of timeouts and finally lost requests
+        """
+        with self._cond:
+            return {address: dict(stats) for address, stats in self._stats.items()}
+
+    def _stats_for(self, address):
+        stats = self._stats.get(address)
+        if stats is None:
+            stats = self._stats[address] = {'replies': 0, 'last': 0.0, 'avg': 0.0, 'max': 0.0,
+                                            'timeouts': 0, 'lost': 0}
+        return stats
+
+    def _expire(self):
+        # must be called with the lock held, returns the addresses which have to be sent again
+        now = time.monotonic()
+        resend = []
+        for address, request in list(self._in_flight.items()):
+            if now - request[0] < self._timeout:
+                continue
+            stats = self._stats_for(address)
+            stats['timeouts'] += 1
+            if request[1] > self._retries:
+                stats['lost'] += 1
+                del self._in_flight[address]
+                logger.debug("no reply for memory request %s, given up", address)
+            else:
+                request[0] = now
+                request[1] += 1
+                resend.append(address)
+        return resend
+
+    def _next_expiry(self):
+        if not self._in_flight:
+            return self._timeout
+        oldest = min(request[0] for request in self._in_flight.values())
+        return max(0.001, oldest + self._timeout - time.monotonic())
 
 
 class Rower(object):
     def __init__(self, options=None):
-        self._callbacks = set()
+        self.clock = time.monotonic_ns  # timestamps of the events, the capture time when replaying
+        self._subscriptions = []
+        self._dispatch_table = [()] * len(EVENT_TYPES)
+        self._batch_callbacks = ()
         self._stop_event = threading.Event()
         self._demo = False
-        # if options and options.demo:
-        #     from demo import FakeS4
-        #     self._serial = FakeS4()
-        #     self._demo = True
-        # else:
-        self._serial = serial.Serial()
-        self._serial.baudrate = 19200
+        self._port = getattr(options, 's4_port', None) if options else None
+        self._capture = None
+        if options and getattr(options, 's4_replay', None):
+            from .s4capture import ReplaySerial
+            self._serial = ReplaySerial(options.s4_replay, getattr(options, 'replay_speed', 1.0))
+            self._demo = True
+            self.clock = self._serial.clock
+        else:
+            self._serial = serial.Serial()
+            self._serial.baudrate = 19200
+        if options and getattr(options, 's4_capture', None):
+            from .s4capture import CaptureWriter
+            self._capture = CaptureWriter(options.s4_capture)
+        self._serial.timeout = READ_TIMEOUT
+        self._reader = SerialLineReader(self._serial)
+        self._scheduler = PollScheduler()
+        self._pipeline = RequestPipeline(self.request_address)
+        self._last_rate_log = time.monotonic()
 
         self._request_thread = build_daemon(target=self.start_requesting)
         self._capture_thread = build_daemon(target=self.start_capturing)
@@ -215,7 +513,9 @@ class Rower(object):
             is_live_thread(self._capture_thread)
 
     def _find_serial(self):
-        if not self._demo:
+        if self._port:
+            self._serial.port = self._port  # e.g. the pty of the S4 simulator
+        elif not self._demo:
             self._serial.port = find_port()
         try:
             self._serial.open()
@@ -230,6 +530,7 @@ class Rower(object):
     def open(self):
         if self._serial and self._serial.isOpen():
             self._serial.close()
+        self._pipeline.reset()
         self._find_serial()
         if self._stop_event.is_set():
             #print("reset threads")
@@ -245,13 +546,15 @@ class Rower(object):
         self.write(USB_REQUEST)
 
     def close(self):
-        self.notify_callbacks(build_event("exit"))
+        self.notify_callbacks(build_event(EVENT_EXIT, at=self.clock()))
         if self._stop_event:
             self._stop_event.set()
         if self._serial and self._serial.isOpen():
             self.write(EXIT_REQUEST)
             time.sleep(0.1)  # time for capture and request loops to stop running
             self._serial.close()
+        if self._capture:
+            self._capture.close()
 
     def write(self, raw):
         try:
@@ -267,14 +570,24 @@ class Rower(object):
         while not self._stop_event.is_set():
             if self._serial.isOpen():
                 try:
-                    line = self._serial.readline()
-                    event = event_from(line)
-                    if event:
-                        self.notify_callbacks(event)
+                    lines = self._reader.read_lines()
+                    if lines:
+                        at = self.clock()
+                        if self._capture:
+                            # a replay captured again gets the time of the capture writer
+                            self._capture.write(lines, None if self._demo else at)
+                        events = events_from(lines, at)
+                        for event in events:
+                            address = CODE_ADDRESS[event.code]
+                            if address:
+                                self._pipeline.complete(address)
+                                self._scheduler.record_reply(address)
+                        self.notify_batch(events)
                 except Exception as e:
                     #print("could not read %s" % e)
                     logger.error("could not read %s" % e)
                     try:
+                        self._reader.reset()
                         self._serial.reset_input_buffer()
                     except Exception as e2:
                         #print("could not reset_input_buffer %s" % e2)
@@ -286,17 +599,41 @@ class Rower(object):
     def start_requesting(self):
         while not self._stop_event.is_set():
             if self._serial.isOpen():
-                for address in MEMORY_MAP:
-                    if 'not_in_loop' not in MEMORY_MAP[address]:
-                        self.request_address(address)
-                        self._stop_event.wait(0.025)
+                address, due = self._scheduler.next_address()
+                delay = due - time.monotonic()
+                # ahead of time the request only waits for a free slot of the pipeline in submit()
+                if not POLL_AHEAD and delay > 0 and self._stop_event.wait(delay):
+                    break
+                self._pipeline.submit(address, self._stop_event)
+                self._log_refresh_rates()
             else:
                 self._stop_event.wait(0.1)
 
+    def _log_refresh_rates(self):
+        now = time.monotonic()
+        if now - self._last_rate_log < RATE_LOG_INTERVAL:
+            return
+        self._last_rate_log = now
+        logger.debug("refresh rates [Hz]: %s", ", ".join(
+            "%s %.2f" % (field, rate) for field, rate in sorted(self._scheduler.refresh_rates().items())))
+        logger.debug("round trip [ms]: %s", ", ".join(
+            "%s %.1f/%.1f lost %d" % (MEMORY_MAP[address]['type'], stats['avg'] * 1000, stats['max'] * 1000,
+                                      stats['lost'])
+            for address, stats in sorted(self._pipeline.latency_stats().items()) if address in MEMORY_MAP))
+
+    def refresh_rates(self):
+        return self._scheduler.refresh_rates()
+
+    def target_rates(self):
+        return self._scheduler.target_rates()
+
+    def latency_stats(self):
+        return self._pipeline.latency_stats()
+
 
     def reset_request(self):
         self.write(RESET_REQUEST)
-        self.notify_callbacks(build_event('reset'))
+        self.notify_callbacks(build_event(EVENT_RESET, at=self.clock()))
         logger.info("Reset requested")
 
     def request_info(self):
@@ -308,15 +645,50 @@ class Rower(object):
         cmd = SIZE_MAP[size]
         self.write(cmd + address)
 
+    def subscribe(self, cb, codes=None, batched=False):
+        """
+        Registers cb for the event type codes given (all events if codes is None). A normal subscriber is
+        called with each event, a batched one once per serial read with the list of its events of that read
+        """
+        codes = frozenset(range(len(EVENT_TYPES)) if codes is None else codes)
+        self._subscriptions.append((cb, codes, batched))
+        self._build_dispatch_table()
+
+    def unsubscribe(self, cb):
+        self._subscriptions = [subscription for subscription in self._subscriptions if subscription[0] != cb]
+        self._build_dispatch_table()
+
     def register_callback(self, cb):
-        self._callbacks.add(cb)
+        self.subscribe(cb)
 
     def remove_callback(self, cb):
-        self._callbacks.remove(cb)
+        self.unsubscribe(cb)
+
+    def _build_dispatch_table(self):
+        # swapped in as a whole so the capture thread never sees a half built table
+        table = [[] for _ in EVENT_TYPES]
+        batch_callbacks = []
+        for cb, codes, batched in self._subscriptions:
+            if batched:
+                batch_callbacks.append((cb, codes))
+            else:
+                for code in codes:
+                    table[code].append(cb)
+        self._dispatch_table = [tuple(callbacks) for callbacks in table]
+        self._batch_callbacks = tuple(batch_callbacks)
 
     def notify_callbacks(self, event):
-        for cb in self._callbacks:
-            cb(event)
+        self.notify_batch([event])
+
+    def notify_batch(self, events):
+        table = self._dispatch_table
+        for event in events:
+            for cb in table[event.code]:
+                cb(event)
+        for cb, codes in self._batch_callbacks:
+            selected = [event for event in events if event.code in codes]
+            if selected:
+                cb(selected)
 
 
 
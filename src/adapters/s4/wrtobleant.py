@@ -3,20 +3,28 @@
 # https://github.com/bfritscher/waterrower
 # ---------------------------------------------------------------------------
 
+import atexit
 import threading
 import time
-import datetime
 import logging
-import numpy
-from copy import deepcopy
 
 from . import waterrowerinterface
+from ..common import record
+from ..common.record import new_record, ZERO_RECORD
+from ..common.rollingstats import RollingStats
+from ..common.sessionclock import SessionClock, NS
+from ..common.fitexport import open_exporter
+from ..common.history import open_history
+from ..common.sessionrecorder import open_recorder
+from ..common.strokes import StrokeStore, StrokeSegmenter
+from ..common.snapshot import SnapshotPublisher, SinkPublisher, MIN_PUBLISH_INTERVAL, MAX_PUBLISH_INTERVAL
+from .waterrowerinterface import EVENT_CODES
 
 logger = logging.getLogger(__name__)
 '''
-We register 3 callback function to the WaterrowerInterface with the event as input. Those function get exectuted 
-as soon as an event is register from "capturing". 
-We create 3 differnt dict with 3 different value sets. 
+We subscribe one handler per event type to the WaterrowerInterface with the event as input. Those function get
+exectuted as soon as an event of their type is register from "capturing". 
+We create 3 differnt records (see common/record.py) with 3 different value sets. 
 - first case: rowing has been reseted so only 0 value should be send even if in the WR memory old values persists 
 - second case: we do HIIT training and the rower is at standstill. The value are not set to 0 in the WR memory. therfore set all instantaneous value to 0 e.g power, pace, stroke rate 
 - last case: Normal rowing get data from WR memory without touching it 
@@ -24,19 +32,57 @@ We create 3 differnt dict with 3 different value sets.
 Depeding on thoses cases send to the bluetooth module only the value dict with the correct numbers. 
 '''
 
-IGNORE_LIST = ['graph', 'tank_volume', 'display_sec_dec']
-POWER_AVG_STROKES = 4
+POWER_AVG_STROKES = 4  # default window of the displayed power, the mean of the peak power of the last strokes
+PULSE_TIMEOUT_NS = 300 * 1000000  # no pulse for that long means the paddle stands still
+STANDSTILL_FIELDS = (record.STROKE_RATE, record.INSTANTANEOUS_PACE, record.SPEED, record.WATTS)
+
+STROKE_START = EVENT_CODES['stroke_start']
+STROKE_END = EVENT_CODES['stroke_end']
+PULSE = EVENT_CODES['pulse']
+RESET = EVENT_CODES['reset']
+EXIT = EVENT_CODES['exit']
+STROKE_RATE = EVENT_CODES['stroke_rate']
+TOTAL_STROKES = EVENT_CODES['total_strokes']
+TOTAL_DISTANCE_M = EVENT_CODES['total_distance_m']
+AVG_DISTANCE_CMPS = EVENT_CODES['avg_distance_cmps']
+WATTS = EVENT_CODES['watts']
+TOTAL_KCAL = EVENT_CODES['total_kcal']
+HEART_RATE = EVENT_CODES['heart_rate']
+DISPLAY_SEC = EVENT_CODES['display_sec']
+DISPLAY_MIN = EVENT_CODES['display_min']
+DISPLAY_HR = EVENT_CODES['display_hr']
 
 
 class DataLogger(object):
-    def __init__(self, rower_interface):
+    def __init__(self, rower_interface, options=None):
         self._rower_interface = rower_interface
-        self._rower_interface.register_callback(self.reset_requested)
-        self._rower_interface.register_callback(self.pulse)
-        self._rower_interface.register_callback(self.on_rower_event)
+        self._rower_interface.subscribe(self.reset_requested, [RESET])
+        self._rower_interface.subscribe(self.on_exit, [EXIT])
+        self._rower_interface.subscribe(self.pulse, [PULSE])
+        self._rower_interface.subscribe(self.check_paddle, batched=True)
+        self._rower_interface.subscribe(self.check_changed, batched=True)
+        handlers = {STROKE_START: self.on_stroke_start,
+                    STROKE_END: self.on_stroke_end,
+                    STROKE_RATE: self.on_stroke_rate,
+                    TOTAL_STROKES: self.on_total_strokes,
+                    TOTAL_DISTANCE_M: self.on_total_distance,
+                    AVG_DISTANCE_CMPS: self.on_avg_distance,
+                    WATTS: self.on_watts,
+                    TOTAL_KCAL: self.on_total_kcal,
+                    HEART_RATE: self.on_heart_rate,
+                    DISPLAY_SEC: self.on_display_sec,
+                    DISPLAY_MIN: self.on_display_min,
+                    DISPLAY_HR: self.on_display_hr}
+        for code, handler in handlers.items():
+            self._rower_interface.subscribe(handler, [code])
         self._stop_event = threading.Event()
 
-        self._InstaPowerStroke = None
+        self._stats = RollingStats({'watts': POWER_AVG_STROKES}, options)
+        # the time of the events, the capture time when a capture is replayed
+        self._now = getattr(rower_interface, 'clock', None) or time.monotonic_ns
+        self._clock = SessionClock(self._now)
+        self.strokes = StrokeStore(getattr(options, 'stroke_spill', None))
+        self._segmenter = StrokeSegmenter(self.strokes)
         self.maxpowerStroke = None
         self._StrokeStart = None
         self._StrokeTotal = None
@@ -50,153 +96,170 @@ class DataLogger(object):
         self.rowerreset = None
         self.WRValues_rst = None
         self.WRValues = None
-        self.WRValues_standstill = None
         self.BLEvalues = None
         self.ANTvalues = None
         self.secondsWR = None
         self.minutesWR = None
         self.hoursWR = None
-        self.elapsetime = None
-        self.elapsetimeprevious = None
+        self._publisher = None
 
         self._reset_state()
 
     def _reset_state(self):
-        self._InstaPowerStroke = []
+        self._stats.reset()
         self.maxpowerStroke = 0
         self._StrokeStart = False
         self._StrokeTotal = 0
         self.Watts = 0
         self.AvgInstaPower = 0
         self.Lastcheckforpulse = 0
-        self.PulseEventTime = 0
+        self.PulseEventTime = None  # no pulse since the reset or the last standstill
         self.InstantaneousPace = 0
-        self.DeltaPulse = 0
+        self.DeltaPulse = None
         self.PaddleTurning = False
         self.rowerreset = True
-        self.WRValues_rst = {
-                'stroke_rate': 0,
-                'total_strokes': 0,
-                'total_distance_m': 0,
-                'instantaneous pace': 0,
-                'speed': 0,
-                'watts': 0,
-                'total_kcal': 0,
-                'total_kcal_hour': 0,
-                'total_kcal_min': 0,
-                'heart_rate': 0,
-                'elapsedtime': 0.0,
-            }
-        self.WRValues = deepcopy(self.WRValues_rst)
-        self.WRValues_standstill = deepcopy(self.WRValues_rst)
-        self.BLEvalues = deepcopy(self.WRValues_rst)
-        self.ANTvalues = deepcopy(self.WRValues_rst)
+        self.WRValues_rst = ZERO_RECORD
+        self.WRValues = new_record()
+        if self._publisher is None:
+            self._publisher = SnapshotPublisher(self.WRValues_rst)
+        self.BLEvalues = self.ANTvalues = self._publisher.publish(self.WRValues_rst)
         self.secondsWR = 0
         self.minutesWR = 0
         self.hoursWR = 0
-        self.elapsetime = 0
-        self.elapsetimeprevious = 0
-
-    def on_rower_event(self, event):
-        if event['type'] in IGNORE_LIST:
-            return
-        if event['type'] == 'stroke_start':
-            self._StrokeStart = True
-        if event['type'] == 'stroke_end':
-            self._StrokeStart = False
-        if event['type'] == 'stroke_rate':
-            self.WRValues.update({'stroke_rate': (event['value']*2)})
-        if event['type'] == 'total_strokes':
-            self._StrokeTotal = event['value']
-            self.WRValues.update({'total_strokes': event['value']})
-        if event['type'] == 'total_distance_m':
-            self.WRValues.update({'total_distance_m': (event['value'])})
-        if event['type'] == 'avg_distance_cmps':
-            if event['value'] == 0:
-                self.WRValues.update({'instantaneous pace': 0})
-                self.WRValues.update({'speed':0})
-            else:
-                self.InstantaneousPace = (500 * 100) / event['value']
-                #print(self.InstantaneousPace)
-                self.WRValues.update({'instantaneous pace': self.InstantaneousPace})
-                self.WRValues.update({'speed':event['value']})
-        if event['type'] == 'watts':
-            self.Watts = event['value']
-            self.avgInstaPowercalc(self.Watts)
-        if event['type'] == 'total_kcal':
-            self.WRValues.update({'total_kcal': (event['value']/1000)})  # in cal now in kcal
-        if event['type'] == 'total_kcal_h':  # must calclatre it first
-            self.WRValues.update({'total_kcal': 0})
-        if event['type'] == 'total_kcal_min':  # must calclatre it first
-            self.WRValues.update({'total_kcal': 0})
-        if event['type'] == 'heart_rate':
-            self.WRValues.update({'heart_rate': (event['value'])})  # in cal
-        if event['type'] == 'display_sec':
-            self.secondsWR = event['value']
-        if event['type'] == 'display_min':
-            self.minutesWR = event['value']
-        if event['type'] == 'display_hr':
-            self.hoursWR = event['value']
-        self.TimeElapsedcreator()
-
-
-    def pulse(self,event):
-        self.Lastcheckforpulse = int(round(time.time() * 1000))
-        if event['type'] == 'pulse':
-            self.PulseEventTime = event['at']
-            self.rowerreset = False
-        self.DeltaPulse = self.Lastcheckforpulse - self.PulseEventTime
-        if self.DeltaPulse <= 300:
+        self._clock.reset()
+        self._segmenter.reset()
+        self.strokes.clear()
+
+    def on_stroke_start(self, event):
+        self._StrokeStart = True
+        self._segmenter.stroke_start(event.at, self.WRValues[record.TOTAL_DISTANCE_M],
+                                     self._clock.elapsed_ns(event.at) // 1000000)
+
+    def on_stroke_end(self, event):
+        self._StrokeStart = False
+        self._segmenter.stroke_end(event.at)
+
+    def on_stroke_rate(self, event):
+        self.WRValues[record.STROKE_RATE] = int(round(self._stats.update('stroke_rate', event.value*2, event.at)))
+
+    def on_total_strokes(self, event):
+        self._StrokeTotal = event.value
+        self.WRValues[record.TOTAL_STROKES] = event.value
+
+    def on_total_distance(self, event):
+        self.WRValues[record.TOTAL_DISTANCE_M] = event.value
+
+    def on_avg_distance(self, event):
+        if event.value == 0:
+            self.WRValues[record.INSTANTANEOUS_PACE] = 0
+            self.WRValues[record.SPEED] = 0
+        else:
+            self.InstantaneousPace = self._stats.update('pace', (500 * 100) / event.value, event.at)
+            #print(self.InstantaneousPace)
+            self.WRValues[record.INSTANTANEOUS_PACE] = int(round(self.InstantaneousPace))
+            self.WRValues[record.SPEED] = int(round(self._stats.update('speed', event.value, event.at)))
+
+    def on_watts(self, event):
+        self.Watts = event.value
+        self.avgInstaPowercalc(self.Watts, event.at)
+        self._segmenter.power(event.value)
+
+    def on_total_kcal(self, event):
+        self.WRValues[record.TOTAL_KCAL] = event.value // 1000  # in cal now in kcal
+
+    def on_heart_rate(self, event):
+        self.WRValues[record.HEART_RATE] = event.value
+
+    def on_display_sec(self, event):
+        self.secondsWR = event.value
+        if self._clock.started:
+            self._clock.sync_seconds(event.value, event.at)
+
+    def on_display_min(self, event):
+        self.minutesWR = event.value
+        if self._clock.started:
+            self._clock.sync_minutes(event.value, event.at)
+
+    def on_display_hr(self, event):
+        self.hoursWR = event.value
+        if self._clock.started:
+            self._clock.sync_hours(event.value, event.at)
+
+    def pulse(self, event):
+        self.PulseEventTime = event.at
+        self.rowerreset = False
+        if not self._clock.running:
+            self._clock.resume(event.at)
+
+    def check_paddle(self, events):
+        # called once per serial read, which happens every few ms as long as the S4 is connected
+        self.Lastcheckforpulse = self._now()
+        # the clock of a replay starts at 0, so a time is no sign of a pulse, None is
+        self.DeltaPulse = None if self.PulseEventTime is None else self.Lastcheckforpulse - self.PulseEventTime
+        if self.DeltaPulse is not None and self.DeltaPulse <= PULSE_TIMEOUT_NS:
             self.PaddleTurning = True
         else:
+            if self.PaddleTurning:
+                # the windows start over when rowing resumes, the clock stands still until then
+                self._stats.reset()
+                self._clock.pause(self.PulseEventTime)
+                self._segmenter.abort()
             self.PaddleTurning = False
             self._StrokeStart = False
-            self.PulseEventTime = 0
-            self._InstaPowerStroke = []
+            self.PulseEventTime = None
             self.AvgInstaPower = 0
-            self.WRValuesStandstill()
+        elapsedtime = self._clock.elapsed_ns(self.Lastcheckforpulse) // NS
+        if elapsedtime > self.WRValues[record.ELAPSEDTIME]:
+            self.WRValues[record.ELAPSEDTIME] = elapsedtime
+
+    def check_changed(self, events):
+        # publishing wakes up the SinkPublisher if one of the values changed with this read
+        self.get_WRValues()
+
+    @property
+    def changed(self):
+        return self._publisher.changed
+
+    def on_exit(self, event):
+        self.strokes.close()
 
     def reset_requested(self,event):
-        if event['type'] == 'reset':
-            self._reset_state()
-            logger.info("value reseted")
-
-    def TimeElapsedcreator(self):
-        self.elapsetime = datetime.timedelta(seconds=self.secondsWR, minutes=self.minutesWR, hours=self.hoursWR)
-        self.elapsetime = int(self.elapsetime.total_seconds())
-        if  self.elapsetime >= self.elapsetimeprevious:
-        # print('sec:{0};min:{1};hr:{2}'.format(self.secondsWR,self.minutesWR,self.hoursWR))
-            self.WRValues.update({'elapsedtime': self.elapsetime})
-            self.elapsetimeprevious = self.elapsetime
+        self._reset_state()
+        logger.info("value reseted")
 
     def WRValuesStandstill(self):
-        self.WRValues_standstill = deepcopy(self.WRValues)
-        self.WRValues_standstill.update({'stroke_rate': 0})
-        self.WRValues_standstill.update({'instantaneous pace': 0})
-        self.WRValues_standstill.update({'speed': 0})
-        self.WRValues_standstill.update({'watts': 0})
+        # at standstill the S4 memory keeps the last instantaneous values, they are sent as 0
+        values = self.WRValues[:]
+        for field in STANDSTILL_FIELDS:
+            values[field] = 0
+        return values
 
-    def avgInstaPowercalc(self,watts):
+    def avgInstaPowercalc(self,watts, at=None):
         if self._StrokeStart:
             self.maxpowerStroke = max(self.maxpowerStroke, watts)
-        else:
-            if self.maxpowerStroke:
-                self._InstaPowerStroke.append(self.maxpowerStroke)
-                self.maxpowerStroke = 0
-            while len(self._InstaPowerStroke) > POWER_AVG_STROKES:
-                self._InstaPowerStroke.pop(0)
-            if len(self._InstaPowerStroke) == POWER_AVG_STROKES:
-                self.AvgInstaPower = int(numpy.average(self._InstaPowerStroke))
-                self.WRValues.update({'watts': self.AvgInstaPower})
+        elif self.maxpowerStroke:
+            power = self._stats['watts']
+            power.append(self.maxpowerStroke, at)
+            self.maxpowerStroke = 0
+            if power.full:
+                self.AvgInstaPower = int(power.mean)
+                self.WRValues[record.WATTS] = self.AvgInstaPower
 
 
     def get_WRValues(self):
+        """
+        Publishes the current values and returns them as read-only snapshot, which is shared by all sinks.
+        A new snapshot (with a new version) is only created if a value changed
+        """
         if self.rowerreset:
-            return deepcopy(self.WRValues_rst)
+            return self._publisher.publish(self.WRValues_rst)
         elif self.PaddleTurning:
-            return deepcopy(self.WRValues)
+            return self._publisher.publish(self.WRValues)
         else:
-            return deepcopy(self.WRValues_standstill)
+            return self._publisher.publish(self.WRValuesStandstill())
+
+    def changed_since(self, version):
+        return self._publisher.changed_since(version)
 
     def SendToBLE(self):
         self.BLEvalues = self.get_WRValues()
@@ -205,28 +268,31 @@ class DataLogger(object):
     def SendToANT(self):
         self.ANTvalues = self.get_WRValues()
 
-def main(in_q, ble_out_q,ant_out_q):
-    S4 = waterrowerinterface.Rower()
+def wait_for_reset(in_q, S4):
+    while True:
+        ResetRequest_ble = in_q.get()  # blocks until the BLE control point requests a reset
+        logger.info("reset requested over BLE: %s", ResetRequest_ble)
+        S4.reset_request()
+
+
+def main(in_q, ble_out_q,ant_out_q, options=None):
+    S4 = waterrowerinterface.Rower(options)
     S4.open()
     S4.reset_request()
-    WRtoBLEANT = DataLogger(S4)
+    WRtoBLEANT = DataLogger(S4, options)
     logger.info("Waterrower Ready and sending data to BLE and ANT Thread")
-    while True:
-        if not in_q.empty():
-            ResetRequest_ble = in_q.get()
-            print(ResetRequest_ble)
-            S4.reset_request()
-        else:
-            pass
-        WRtoBLEANT.SendToBLE()
-        WRtoBLEANT.SendToANT()
-        ble_out_q.append(WRtoBLEANT.BLEvalues)
-        ant_out_q.append(WRtoBLEANT.ANTvalues) # here it is a class deque
-        #print(type(ant_out_q))
-        #print(ant_out_q)
-        #logger.info(WRtoBLEANT.BLEvalues)
-        #ant_out_q.append(WRtoBLEANT.ANTvalues)
-        time.sleep(0.1)
+    reset_thread = threading.Thread(target=wait_for_reset, args=(in_q, S4))
+    reset_thread.daemon = True
+    reset_thread.start()
+    sinks = [ble_out_q, ant_out_q]
+    for sink in (open_recorder(options), open_exporter(options), open_history(options, WRtoBLEANT.strokes)):
+        if sink:
+            sinks.append(sink)
+            atexit.register(sink.close)
+    publisher = SinkPublisher(WRtoBLEANT.get_WRValues, WRtoBLEANT.changed, sinks,
+                              getattr(options, 'min_publish_interval', MIN_PUBLISH_INTERVAL),
+                              getattr(options, 'max_publish_interval', MAX_PUBLISH_INTERVAL))
+    publisher.run()
 
 
 # def maintest():
@@ -0,0 +1,161 @@
+import logging
+import struct
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+# The force curve of a stroke comes in three messages, x, y and z one after the other. After the message type
+# each one holds force samples in N as decimal fields of SAMPLE_WIDTH characters, padded with spaces like the
+# values of the other messages.
+FRAGMENT_TYPES = 'xyz'
+SAMPLE_WIDTH = 3
+QUESTION_MARK = 0x3F    # stands in for a character which is no ASCII
+MAX_SAMPLES = 120       # raw samples of one curve at most, the rest is dropped
+CURVE_POINTS = 50       # every curve is resampled to this many points over the drive
+CURVE_CAPACITY = 512    # curves of the last strokes kept in memory
+SPILL_MAGIC = b'PRFCURV1'
+SPILL_HEADER = struct.Struct('<8sH')
+
+
+class ForceCurveStore(object):
+    """
+    Ring buffer of the force curves of the last strokes, one row of CURVE_POINTS float32 per stroke. With a
+    spill file every curve is also appended there.
+    """
+
+    def __init__(self, spill_path=None, capacity=CURVE_CAPACITY, points=CURVE_POINTS):
+        self.curves = numpy.zeros((capacity, points), dtype=numpy.float32)
+        self.capacity = capacity
+        self.points = points
+        self.count = 0
+        self._spill = None
+        if spill_path:
+            self._spill = open(spill_path, 'wb')
+            self._spill.write(SPILL_HEADER.pack(SPILL_MAGIC, points))
+            logger.info("writing force curves to %s", spill_path)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def in_memory(self):
+        return min(self.count, self.capacity)
+
+    def next_row(self):
+        """
+        Row of the ring buffer which the next curve is written to, it is added with commit()
+        """
+        return self.curves[self.count % self.capacity]
+
+    def commit(self):
+        if self._spill:
+            curve = self.curves[self.count % self.capacity]
+            self._spill.write(curve.astype('<f4', copy=False).tobytes())
+        self.count += 1
+
+    def last(self, count=None):
+        """
+        Returns the last count curves in memory (all without count) as (count, points) array, the oldest first
+        """
+        count = self.in_memory if count is None else min(count, self.in_memory)
+        rows = numpy.arange(self.count - count, self.count) % self.capacity
+        return self.curves[rows]
+
+    def metrics(self, count=None):
+        return curve_metrics(self.last(count))
+
+    def clear(self):
+        self.count = 0
+
+    def close(self):
+        if self._spill:
+            self._spill.close()
+            self._spill = None
+
+
+def read_curves(path):
+    """
+    Returns the curves of a spill file as memory mapped (strokes, points) array
+    """
+    with open(path, 'rb') as f:
+        magic, points = SPILL_HEADER.unpack(f.read(SPILL_HEADER.size))
+    if magic != SPILL_MAGIC:
+        raise ValueError("%s is not a force curve file" % path)
+    curves = numpy.memmap(path, dtype='<f4', mode='r', offset=SPILL_HEADER.size)
+    return curves[:len(curves) // points * points].reshape(-1, points)
+
+
+def curve_metrics(curves):
+    """
+    Metrics of every curve of a (strokes, points) array, the points are spread evenly over the drive:
+    peak_force       N
+    peak_position    position of the peak in the drive, 0 at the catch to 1 at the finish
+    mean_force       N, area under the curve over the drive
+    smoothness       1 for a curve which only rises to the peak and falls after it, lower with every dip
+    """
+    curves = numpy.asarray(curves, dtype=numpy.float32)
+    points = curves.shape[1]
+    peak = curves.max(axis=1)
+    # the rise to the peak and the fall after it, all further ups and downs add to the variation
+    variation = numpy.abs(numpy.diff(curves, axis=1)).sum(axis=1)
+    monotonic = 2 * peak - curves[:, 0] - curves[:, -1]
+    return {
+        'peak_force': peak,
+        'peak_position': curves.argmax(axis=1) / float(points - 1),
+        'mean_force': (curves[:, :-1] + curves[:, 1:]).sum(axis=1) / (2.0 * (points - 1)),
+        'smoothness': numpy.divide(monotonic, variation, out=numpy.ones_like(peak), where=variation > 0),
+    }
+
+
+class ForceCurveAssembler(object):
+    """
+    Puts the x, y and z messages of a stroke together into one force curve. The characters of the fragments are
+    copied into one preallocated buffer, they are only decoded when the z message completes the curve.
+    Fragments out of order drop the curve.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._raw = bytearray(MAX_SAMPLES * SAMPLE_WIDTH)
+        self._digits = numpy.frombuffer(self._raw, dtype=numpy.uint8)
+        self._weights = 10 ** numpy.arange(SAMPLE_WIDTH - 1, -1, -1)
+        self._positions = numpy.linspace(0.0, 1.0, store.points)
+        self._length = 0
+        self._next = None  # index in FRAGMENT_TYPES of the next fragment, None while waiting for an x message
+        self.dropped = 0
+
+    def fragment(self, event):
+        index = FRAGMENT_TYPES.find(event[:1])
+        if index < 0:
+            return
+        if index == 0:
+            self._length = 0
+        elif index != self._next:
+            if self._next is not None:
+                self.dropped += 1
+            self._next = None
+            return
+        raw = self._raw
+        position = self._length
+        # character by character, neither a str slice nor bytes per fragment
+        for i in range(1, min(len(event), len(raw) - position + 1)):
+            code = ord(event[i])
+            raw[position] = code if code < 128 else QUESTION_MARK  # like encode('ascii', 'replace')
+            position += 1
+        self._length = position
+        self._next = index + 1
+        if self._next == len(FRAGMENT_TYPES):
+            self._next = None
+            self._complete()
+
+    def _complete(self):
+        samples = self._length // SAMPLE_WIDTH
+        if samples < 2:
+            self.dropped += 1
+            return
+        digits = self._digits[:samples * SAMPLE_WIDTH].reshape(samples, SAMPLE_WIDTH).astype(numpy.int16) - 48
+        # spaces pad the fields like zeros
+        forces = numpy.clip(digits, 0, 9) @ self._weights
+        self.store.next_row()[:] = numpy.interp(self._positions, numpy.linspace(0.0, 1.0, samples), forces)
+        self.store.commit()
@@ -0,0 +1,203 @@
+# ---------------------------------------------------------------------------
+# Capture and replay of the raw SmartRow traffic
+# ---------------------------------------------------------------------------
+#
+# File format (little endian):
+#   header: magic "PRFSRCAP", uint16 version, uint64 wall clock time of the capture start in ns
+#   record: uint64 monotonic ns since the capture start, uint8 direction, uint16 length, payload
+# The payload is one notification of the SmartRow (direction NOTIFICATION) or the bytes of one write to the
+# SmartRow (direction WRITE), e.g. the heartbeat or the answer to the V3 KEYLOCK challenge.
+#
+# Replay from the src folder as fast as possible to benchmark the parser and DataLogger path:
+#
+#   python3 -m adapters.smartrow.smartrowcapture capture.srcap --speed 0
+
+import argparse
+import logging
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PRFSRCAP'
+VERSION = 1
+HEADER = struct.Struct('<8sHQ')
+RECORD = struct.Struct('<QBH')
+NOTIFICATION, WRITE = 0, 1
+FLUSH_INTERVAL_NS = 1000000000  # the process is usually killed, so the capture is flushed every second
+
+
+class CaptureWriter(object):
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, time.time_ns()))
+        self._start = time.monotonic_ns()
+        self._last_flush = self._start
+        self._lock = threading.Lock()
+        logger.info("capturing SmartRow traffic to %s", path)
+
+    def _write(self, direction, payload, at):
+        if at is None:
+            at = time.monotonic_ns()
+        with self._lock:
+            if self._file:
+                self._file.write(RECORD.pack(at - self._start, direction, len(payload)))
+                self._file.write(payload)
+                if at - self._last_flush > FLUSH_INTERVAL_NS:
+                    self._file.flush()
+                    self._last_flush = at
+
+    def notification(self, value, received=None):
+        # received is the perf counter time of the raw callbacks, the capture uses its own monotonic time
+        self._write(NOTIFICATION, bytes(value), None)
+
+    def written(self, data, at=None):
+        self._write(WRITE, bytes(data), at)
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+def read_capture(path):
+    """
+    Yields (ns since capture start, direction, payload) for every record of a capture file
+    """
+    with open(path, 'rb') as f:
+        magic, version, _ = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a SmartRow capture file" % path)
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            offset, direction, length = RECORD.unpack(head)
+            payload = f.read(length)
+            if len(payload) < length:
+                logger.warning("capture %s is truncated", path)
+                return
+            yield offset, direction, payload
+
+
+class FakeSmartRow(object):
+    """
+    Stands in for the SmartRowManager as rower interface of the DataLogger and hands the notifications of a
+    capture file to the callbacks with their original timing divided by speed, or as fast as possible if speed
+    is 0. clock() is the capture time of the current notification, so the session clock of the DataLogger runs
+    on the captured time at any speed. Writes are kept in written to compare them with the captured ones. Like
+    the WriteQueue it takes the writes of the SmartRow app from the relay and drops the own ones meanwhile.
+    """
+
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.speed = speed
+        self.connected = threading.Event()
+        self.finished = threading.Event()
+        self.writer = self
+        self.relaying = False
+        self.written = []
+        self.captured_writes = []
+        self.notifications = 0
+        self.replay_seconds = 0.0
+        self._callbacks = set()
+        self._raw_callbacks = set()
+        self._now = 0
+
+    def clock(self):
+        return self._now
+
+    def ready(self):
+        return self.connected.is_set()
+
+    def register_callback(self, cb):
+        self._callbacks.add(cb)
+
+    def remove_callback(self, cb):
+        self._callbacks.remove(cb)
+
+    def register_raw_callback(self, cb):
+        self._raw_callbacks.add(cb)
+
+    def characteristic_write_value(self, value):
+        if not self.relaying:
+            self.written.append(bytes(value))
+
+    def relay(self, data):
+        self.written.append(bytes(data))
+
+    def start_heartbeat(self):
+        pass
+
+    def wait_sent(self, timeout=None):
+        return True
+
+    def connect_smartrow(self):
+        self.connected.set()
+
+    def run(self):
+        """
+        Replays the whole capture in the calling thread
+        """
+        logger.info("replaying SmartRow capture %s at speed %s", self.path, self.speed or "max")
+        started = time.monotonic_ns()
+        for offset, direction, payload in read_capture(self.path):
+            if direction == WRITE:
+                self.captured_writes.append(payload)
+                continue
+            if self.speed:
+                wait = (started + offset / self.speed - time.monotonic_ns()) / 1e9
+                if wait > 0:
+                    time.sleep(wait)
+            self._now = offset
+            received = time.perf_counter_ns()
+            for cb in self._raw_callbacks:
+                cb(payload, received)
+            event = payload.decode()
+            for cb in self._callbacks:
+                cb(event)
+            self.notifications += 1
+        self.replay_seconds = (time.monotonic_ns() - started) / 1e9
+        self.finished.set()
+
+
+def main(args=None):
+    from . import smartrowreader, smartrowtobleant
+    from ..common import record
+
+    parser = argparse.ArgumentParser(description="Replay a SmartRow capture through the DataLogger")
+    parser.add_argument("capture", help="capture file written with --smartrow-capture")
+    parser.add_argument("--speed", type=float, default=0, help="replay speed, 1 is real time, 0 as fast as possible")
+    args = parser.parse_args(args)
+
+    smartrow = FakeSmartRow(args.capture, args.speed)
+    datalogger = smartrowtobleant.DataLogger(smartrow)
+    datalogger.Initial_reset = True
+    halts = {'count': 0, 'halted': None}
+
+    def count_halts(event):
+        if datalogger.SmartRowHalt != halts['halted']:
+            halts['halted'] = datalogger.SmartRowHalt
+            halts['count'] += datalogger.SmartRowHalt
+
+    smartrow.register_callback(count_halts)
+    cpu_started = time.process_time()
+    smartrow.run()
+    cpu = time.process_time() - cpu_started
+    elapsed = max(smartrow.replay_seconds, 1e-6)
+    print("%d notifications in %.3f s (%.0f/s, cpu %.3f s), %d halts" % (
+        smartrow.notifications, elapsed, smartrow.notifications / elapsed, cpu, halts['count']))
+    # the heartbeat and the resets do not come from the DataLogger
+    own = (smartrowreader.HEARTBEAT, smartrowtobleant.RESET_COMMAND)
+    replies = [w for w in smartrow.written if w not in own]
+    captured = [w for w in smartrow.captured_writes if w not in own]
+    print("replies: %d replayed, %d captured%s" % (
+        len(replies), len(captured), ", the same" if replies == captured else ", they differ"))
+    print("messages: %s" % datalogger.message_stats.summary())
+    print(record.record_to_dict(datalogger.WRValues))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import re
+
+# Layout of the SmartRow notifications: the first character is the message type, the values follow as decimal
+# fields of fixed width, padded with spaces. message type -> ((start, end) of every value, minimal length)
+MESSAGE_LAYOUTS = {
+    'a': (((1, 6), (6, 10)), 10),                                  # distance m, energy kcal
+    'b': (((1, 6), (7, 11), (11, 14)), 14),                        # distance m, work 0.1 J, stroke length cm
+    'c': (((1, 6), (6, 9), (9, 14)), 14),                          # distance m, power W, average power 0.1 W
+    'd': (((1, 6), (6, 8), (9, 13)), 13),                          # distance m, stroke rate, strokes
+    'e': (((1, 6), (6, 7), (7, 9), (9, 10), (10, 12)), 12),        # distance m, pace min:s, average pace min:s
+    'f': (((1, 6), (7, 11)), 12),                                  # distance m, force N, "!" at 11 when halted
+    'x': ((), 1),                                                  # force curve, part 1
+    'y': ((), 1),                                                  # force curve, part 2
+    'z': ((), 1),                                                  # force curve, part 3
+}
+MESSAGE_TYPES = frozenset(MESSAGE_LAYOUTS)
+
+SPACES_TO_ZEROS = str.maketrans(' ', '0')
+# SmartRow V3 obfuscates the characters 1 to 5 of a message, the low nibble is the digit
+V3_DIGITS = {c: c & 15 | 0x30 for c in range(256)}
+
+HISTOGRAM_BUCKETS = 12  # parse time histogram, bucket n counts the messages parsed in less than 2**n µs
+
+
+def _pattern(fields, length):
+    # the fields must be digits once the spaces are zeros, whatever is between them is skipped
+    pattern = ''
+    position = 1
+    for start, end in fields:
+        pattern += '.{%d}([0-9]{%d})' % (start - position, end - start)
+        position = end
+    return re.compile(pattern + '.{%d}' % max(0, length - position), re.DOTALL)
+
+
+MESSAGE_PATTERNS = {message_type: _pattern(fields, length)
+                    for message_type, (fields, length) in MESSAGE_LAYOUTS.items() if fields}
+
+
+def v3_decrypt(event):
+    return event[0] + event[1:6].translate(V3_DIGITS) + event[6:]
+
+
+def parse(event):
+    """
+    Returns the message type and the values of one SmartRow message, the values are None if the message is not
+    a valid message of its type. Messages of other types return None.
+    """
+    message_type = event[:1]
+    pattern = MESSAGE_PATTERNS.get(message_type)
+    if pattern is None:
+        return (message_type, []) if message_type in MESSAGE_TYPES else None
+    match = pattern.match(event.translate(SPACES_TO_ZEROS), 1)
+    if match is None:
+        return message_type, None
+    return message_type, [int(value) for value in match.groups()]
+
+
+class MessageStats(object):
+    """
+    Number of parsed and malformed messages and histogram of the parse times per message type
+    """
+
+    def __init__(self):
+        self.counts = dict.fromkeys(MESSAGE_TYPES, 0)
+        self.malformed = dict.fromkeys(MESSAGE_TYPES, 0)
+        self.histograms = {message_type: [0] * HISTOGRAM_BUCKETS for message_type in MESSAGE_TYPES}
+        self.other = 0
+
+    def add(self, message_type, parse_ns):
+        self.counts[message_type] += 1
+        self.histograms[message_type][min((parse_ns // 1000).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    def add_malformed(self, message_type):
+        self.malformed[message_type] += 1
+
+    def add_other(self):
+        self.other += 1
+
+    def histogram(self, message_type):
+        """
+        Returns (upper bound in µs, count) of every bucket, the last bucket has no upper bound
+        """
+        counts = self.histograms[message_type]
+        return [(2 ** n if n < HISTOGRAM_BUCKETS - 1 else None, count) for n, count in enumerate(counts)]
+
+    def percentile(self, message_type, fraction):
+        """
+        Upper bound in µs of the bucket with the given fraction of the parse times at or below it
+        """
+        counts = self.histograms[message_type]
+        total = sum(counts)
+        if not total:
+            return None
+        seen = 0
+        for n, count in enumerate(counts):
+            seen += count
+            if seen >= fraction * total:
+                return 2 ** n
+        return 2 ** (HISTOGRAM_BUCKETS - 1)
+
+    def summary(self):
+        parts = ['%s: %d (%d malformed, p50 < %s µs, p99 < %s µs)' % (
+                     message_type, self.counts[message_type], self.malformed[message_type],
+                     self.percentile(message_type, 0.5), self.percentile(message_type, 0.99))
+                 for message_type in sorted(MESSAGE_TYPES)
+                 if self.counts[message_type] or self.malformed[message_type]]
+        parts.append('other: %d' % self.other)
+        return ', '.join(parts)
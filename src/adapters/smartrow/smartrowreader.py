@@ -1,31 +1,101 @@
 import gatt
+import json
 import logging
+import os
 import threading
-from time import time
+import time
+from collections import deque
+
+from gi.repository import GLib
 
 logger = logging.getLogger(__name__)
 
+CACHE_VERSION = 1
+WRITE_PIPELINE = 2          # writes to the SmartRow which may wait for their response at the same time
+WRITE_TIMEOUT = 1.0         # seconds after which a write without response is considered lost
+COALESCE_WRITES = True      # a command of several bytes is one write, otherwise one write per byte
+HEARTBEAT_INTERVAL = 1      # seconds between two heartbeats
+HEARTBEAT = b'\x24'
+
 #This SDK requires you to create subclasses of gatt.DeviceManager and gatt.Device. The other two classes gatt.Service and gatt.Characteristic are not supposed to be subclassed.
 
 #The SDK entry point is the DeviceManager class. Check the following example to dicover any Bluetooth Low Energy device nearby.
 
 
+def load_cache(path):
+    """
+    Returns the MAC address and GATT handles of the last SmartRow saved in path, an empty dict without
+    """
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) and cache.get('version') == CACHE_VERSION else {}
+
+
+def save_cache(path, mac_address, handles):
+    cache = {'version': CACHE_VERSION, 'mac_address': mac_address, 'handles': handles}
+    try:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(cache, f)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        logger.warning("cannot save the SmartRow to %s: %s", path, e)
+
+
+class CachedService(object):
+    """
+    Stands in for the gatt.Service of the SmartRow service when its handles are known. gatt.Service reads all
+    objects of BlueZ to find its characteristics, once per service of the device.
+    """
+
+    def __init__(self, device, path, uuid):
+        self.device = device
+        self.uuid = uuid
+        self._path = path
+        self._bus = device._bus
+        self._object_manager = device._object_manager
+        self.characteristics = []
+
+    def _connect_signals(self):
+        for characteristic in self.characteristics:
+            characteristic._connect_signals()
+
+    def _disconnect_signals(self):
+        for characteristic in self.characteristics:
+            characteristic._disconnect_signals()
+
+
 class SmartRow(gatt.Device):
 
     SERVICE_UUID_SMARTROW = "00001234-0000-1000-8000-00805f9b34fb"
     CHARACTERISTIC_UUID_ROWWRITE = "00001235-0000-1000-8000-00805f9b34fb"
     CHARACTERISTIC_UUID_ROWDATA = "00001236-0000-1000-8000-00805f9b34fb"
 
-    def __init__(self, mac_address, manager):
+    def __init__(self, mac_address, manager, handles=None):
         super().__init__(mac_address=mac_address, manager=manager)
         self._callbacks = set()
+        self._raw_callbacks = set()
         self.lock = threading.Lock()
         self.is_connected = False
+        # D-Bus paths of the service and characteristics from the last connection, see services_resolved()
+        self.handles = handles
 
     def ready(self):
       with self.lock: #"Lock Acquired"
           return self.is_connected
-      
+
+    def connect(self):
+        # Device.connect() waits in the D-Bus call until BlueZ connected, which blocks the main loop it is called
+        # from. The reply comes back through the main loop instead, connect_succeeded() follows the Connected
+        # property as before.
+        self._object.Connect(reply_handler=self._connect_replied, error_handler=self.connect_failed)
+
+    def _connect_replied(self):
+        if not self.services and self.is_services_resolved():
+            self.services_resolved()
+
     def connect_succeeded(self):
         super().connect_succeeded()
         logger.info("Connected to [{}]".format(self.mac_address))
@@ -34,6 +104,8 @@ class SmartRow(gatt.Device):
     def connect_failed(self, error):
         super().connect_failed(error)
         logger.info("Connection failed [{}]: {}".format(self.mac_address, error))
+        if hasattr(self.manager, 'smartrow_connect_failed'):
+            self.manager.smartrow_connect_failed(self, error)
 
     def disconnect_succeeded(self):
         super().disconnect_succeeded()
@@ -54,6 +126,10 @@ class SmartRow(gatt.Device):
         return None
 
     def services_resolved(self):
+        if self.handles:
+            self._use_handles(self.handles)
+            return
+
         super().services_resolved()
 
         logger.info("Resolved services [{}]".format(self.mac_address))
@@ -63,15 +139,68 @@ class SmartRow(gatt.Device):
                 logger.info("\t\tCharacteristic [{}]".format(characteristic.uuid))
 
         self.serviceSmartRow = self.find_service(self.SERVICE_UUID_SMARTROW)
+        if self.serviceSmartRow is None:
+            logger.error("[{}] has no SmartRow service".format(self.mac_address))
+            return
         self.chrstcRowData = self.find_characteristic(self.serviceSmartRow, self.CHARACTERISTIC_UUID_ROWDATA)
-        self.chrstcRowData.enable_notifications()
-
         self.chrstcRowWrite = self.find_characteristic(self.serviceSmartRow, self.CHARACTERISTIC_UUID_ROWWRITE)
+        self.handles = {'service': self.serviceSmartRow._path,
+                        'rowdata': self.chrstcRowData._path,
+                        'rowwrite': self.chrstcRowWrite._path}
+        self._characteristics_ready()
+
+    def _use_handles(self, handles):
+        # the characteristics are built from the handles of the last connection without asking BlueZ for them,
+        # if they are outdated enabling the notifications fails and the services are resolved again
+        self._disconnect_service_signals()
+        self.serviceSmartRow = CachedService(self, handles['service'], self.SERVICE_UUID_SMARTROW)
+        self.chrstcRowData = gatt.Characteristic(self.serviceSmartRow, handles['rowdata'],
+                                                 self.CHARACTERISTIC_UUID_ROWDATA)
+        self.chrstcRowWrite = gatt.Characteristic(self.serviceSmartRow, handles['rowwrite'],
+                                                  self.CHARACTERISTIC_UUID_ROWWRITE)
+        self.serviceSmartRow.characteristics = [self.chrstcRowData, self.chrstcRowWrite]
+        self.services = [self.serviceSmartRow]
+        self._connect_service_signals()
+        logger.info("Using the known services [{}]".format(self.mac_address))
+        self._characteristics_ready()
+
+    def _characteristics_ready(self):
+        self.chrstcRowData.enable_notifications()
         with self.lock: #"Lock Acquired"
             self.is_connected = True
-        
+        if hasattr(self.manager, 'smartrow_ready'):
+            self.manager.smartrow_ready(self)
+
+    def characteristic_write_value_succeeded(self, characteristic):
+        super().characteristic_write_value_succeeded(characteristic)
+        if hasattr(self.manager, 'smartrow_write_done'):
+            self.manager.smartrow_write_done(self)
+
+    def characteristic_write_value_failed(self, characteristic, error):
+        super().characteristic_write_value_failed(characteristic, error)
+        logger.warning("Write failed [{}]: {}".format(self.mac_address, error))
+        if hasattr(self.manager, 'smartrow_write_done'):
+            self.manager.smartrow_write_done(self)
+
+    def characteristic_enable_notifications_failed(self, characteristic, error):
+        super().characteristic_enable_notifications_failed(characteristic, error)
+        if isinstance(self.serviceSmartRow, CachedService):
+            logger.info("Known services outdated [{}]: {}".format(self.mac_address, error))
+            with self.lock:
+                self.is_connected = False
+            self.handles = None
+            self.services = []
+            self.services_resolved()
+        else:
+            logger.error("Notifications failed [{}]: {}".format(self.mac_address, error))
+
     def characteristic_value_updated(self, characteristic, value):
         super().characteristic_value_updated(characteristic, value)
+        if self._raw_callbacks:
+            # the undecoded notification goes out first, e.g. to the relay to the SmartRow app
+            received = time.perf_counter_ns()
+            for cb in self._raw_callbacks:
+                cb(value, received)
         self.buffer = value.decode()
         self.notify_callbacks(self.buffer)
 
@@ -91,36 +220,211 @@ class SmartRow(gatt.Device):
         for cb in self._callbacks:
             cb(event)
 
+    def register_raw_callback(self, cb):
+        """
+        cb is called with the bytes of every notification and its time.perf_counter_ns() reception time
+        """
+        self._raw_callbacks.add(cb)
+
+    def notify_raw_callbacks(self, value, received):
+        for cb in self._raw_callbacks:
+            cb(value, received)
+
+class WriteQueue(object):
+    """
+    Serializes all writes to the SmartRow in the GATT main loop. write() can be called from any thread, the
+    writes are sent in order with up to WRITE_PIPELINE of them waiting for their response, the next one goes out
+    as soon as a response arrives. While the SmartRow is not connected the writes are kept. wait_sent() waits
+    until a connected SmartRow answered all of them.
+    """
+
+    def __init__(self, manager):
+        self._manager = manager
+        self._lock = threading.Lock()
+        # while the SmartRow app is connected through the relay it talks to the SmartRow, only its writes go out
+        self.relaying = False
+        self.capture = None
+        self._queue = deque()
+        self._in_flight = deque()  # send times of the writes waiting for their response
+        self._scheduled = False
+        self._heartbeat = None
+        self._sent = threading.Event()  # set while no write is queued or waits for its response
+        self._sent.set()
+
+    def write(self, data):
+        with self._lock:
+            if self.relaying:
+                return
+            if COALESCE_WRITES:
+                self._queue.append(bytes(data))
+            else:
+                self._queue.extend(bytes((b,)) for b in data)
+            self._sent.clear()
+        self.flush()
+
+    def relay(self, data):
+        """
+        Queues a write of the SmartRow app, it goes out as it is
+        """
+        with self._lock:
+            self._queue.append(data)
+            self._sent.clear()
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+        GLib.idle_add(self._pump)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._queue)
+
+    def wait_sent(self, timeout=None):
+        """
+        Waits until the SmartRow answered all writes so far, returns False after timeout seconds
+        """
+        return self._sent.wait(timeout)
+
+    def _pump(self):
+        smartrow = self._manager.smartrow
+        with self._lock:
+            self._scheduled = False
+            if smartrow is None or not smartrow.ready():
+                return False
+            now = time.monotonic()
+            while self._in_flight and now - self._in_flight[0] > WRITE_TIMEOUT:
+                self._in_flight.popleft()
+                logger.warning("write to the SmartRow without response")
+            writes = []
+            while self._queue and len(self._in_flight) + len(writes) < WRITE_PIPELINE:
+                writes.append(self._queue.popleft())
+            self._in_flight.extend([now] * len(writes))
+            if not self._queue and not self._in_flight:
+                self._sent.set()
+        for data in writes:
+            smartrow.characteristic_write_value(data)
+            if self.capture:
+                self.capture.written(data)
+        return False
+
+    def response(self):
+        with self._lock:
+            if self._in_flight:
+                self._in_flight.popleft()
+        self._pump()
+
+    def start_heartbeat(self):
+        if self._heartbeat is None:
+            self._heartbeat = GLib.timeout_add_seconds(HEARTBEAT_INTERVAL, self._beat)
+
+    def _beat(self):
+        with self._lock:
+            # a heartbeat which did not go out yet is enough
+            queued = HEARTBEAT in self._queue
+        if not queued:
+            self.write(HEARTBEAT)
+        else:
+            self._pump()
+        return True
+
+
 class SmartRowManager(gatt.DeviceManager):
-    def __init__(self,*args,**kwargs):
+    """
+    Finds and connects the SmartRow: the last SmartRow from the cache file is connected directly, only if that
+    fails (or without cache) a discovery is started. Callbacks and writes go to the connected SmartRow, so the
+    manager can be used as rower interface before the SmartRow is known.
+    """
+
+    def __init__(self, *args, cache_path=None, **kwargs):
         gatt.DeviceManager.__init__(self, *args, **kwargs)
         self.lock = threading.Lock()
-        self.discovered=False 
+        self.discovered = False
+        self.cache_path = cache_path
+        self.smartrow = None
+        self.smartrowmac = None
+        self.connected = threading.Event()
+        self.writer = WriteQueue(self)
+        self._callbacks = set()
+        self._raw_callbacks = set()
 
     def ready(self):
-        with self.lock:
-            return self.discovered
-        
+        return self.connected.is_set()
+
+    def connect_smartrow(self):
+        cache = load_cache(self.cache_path) if self.cache_path else {}
+        if cache.get('mac_address'):
+            logger.info("connecting to the last SmartRow %s", cache['mac_address'])
+            self._connect(cache['mac_address'], cache.get('handles'))
+        else:
+            self._discover()
+
+    def _discover(self):
+        logger.info("starting discovery")
+        self.start_discovery()
+
+    def _connect(self, mac_address, handles=None):
+        self.smartrowmac = mac_address
+        self.smartrow = SmartRow(mac_address=mac_address, manager=self, handles=handles)
+        self.smartrow.register_callback(self.notify_callbacks)
+        if self._raw_callbacks:
+            self.smartrow.register_raw_callback(self.notify_raw_callbacks)
+        self.smartrow.connect()
+
     def device_discovered(self, device):
-        if device.alias() == "SmartRow":
-            logging.info("found SmartRow")
-            logging.info(device.mac_address)
-            self.smartrowmac = device.mac_address
-            self.stop()
+        if self.smartrow is None and device.alias() == "SmartRow":
+            logger.info("found SmartRow %s", device.mac_address)
+            self.stop_discovery()
             with self.lock: #"Lock Acquired"
-                self.discovered=True
+                self.discovered = True
+            self._connect(device.mac_address)
 
+    def smartrow_connect_failed(self, device, error):
+        if device is self.smartrow and not self.connected.is_set():
+            self.smartrow = None
+            self._discover()
 
-def connecttosmartrow():
-    manager = SmartRowManager(adapter_name='hci0')
-    logger.info("starting discovery")
-    manager.start_discovery()  # from the DeviceManager class call the methode start_discorvery
-    manager.run()
-    while not manager.ready(): # hold the thread locked a checks if SmartRow has been found. Then gives other process 0.2 sec time to work
-        time.sleep(0.2)
-    logger.info("found SmartRow macaddress")
-    macaddresssmartrower = manager.smartrowmac    
-    return macaddresssmartrower
+    def smartrow_ready(self, device):
+        if self.cache_path:
+            save_cache(self.cache_path, device.mac_address, device.handles)
+        self.connected.set()
+        # writes which came before the connection go out now
+        self.writer.flush()
+
+    def smartrow_write_done(self, device):
+        if device is self.smartrow:
+            self.writer.response()
+
+    def characteristic_write_value(self, value):
+        self.writer.write(value)
+
+    def register_callback(self, cb):
+        self._callbacks.add(cb)
+
+    def remove_callback(self, cb):
+        self._callbacks.remove(cb)
+
+    def notify_callbacks(self, event):
+        for cb in self._callbacks:
+            cb(event)
+
+    def attach_capture(self, capture):
+        """
+        Records the notifications and writes of the SmartRow with the CaptureWriter capture
+        """
+        self.register_raw_callback(capture.notification)
+        self.writer.capture = capture
+
+    def register_raw_callback(self, cb):
+        self._raw_callbacks.add(cb)
+        if self.smartrow is not None:
+            self.smartrow.register_raw_callback(self.notify_raw_callbacks)
+
+    def notify_raw_callbacks(self, value, received):
+        for cb in self._raw_callbacks:
+            cb(value, received)
 
 
 if __name__ == '__main__':
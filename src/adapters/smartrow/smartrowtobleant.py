@@ -1,16 +1,26 @@
+import atexit
 import logging
 import struct
 
-import gatt
 import threading
-from time import sleep
-import time
-from copy import deepcopy
-
-from . import smartrowreader
+from time import monotonic_ns, perf_counter_ns
+
+from . import smartrowparser, smartrowreader
+from .forcecurve import ForceCurveStore, ForceCurveAssembler
+from .smartrowcapture import CaptureWriter, FakeSmartRow
+from ..common import record
+from ..common.record import new_record, ZERO_RECORD
+from ..common.rollingstats import RollingStats
+from ..common.sessionclock import SessionClock
+from ..common.fitexport import open_exporter
+from ..common.history import open_history
+from ..common.sessionrecorder import open_recorder
+from ..common.snapshot import SnapshotPublisher, SinkPublisher, MIN_PUBLISH_INTERVAL, MAX_PUBLISH_INTERVAL
 
 logger = logging.getLogger(__name__)
 
+RESET_DELAY = 3  # seconds the first reset waits at most for the SmartRow to report a halt
+
 
 class DataLogger():
 
@@ -26,58 +36,80 @@ class DataLogger():
 
     SmartRowV3 = False
 
-    def __init__(self, rower_interface):
+    def __init__(self, rower_interface, options=None):
         self._rower_interface = rower_interface
         self._rower_interface.register_callback(self.on_row_event)
+        self._stats = RollingStats(options=options)
+        # a replayed SmartRow brings the time of its capture
+        self._now = getattr(rower_interface, 'clock', None) or monotonic_ns
+        self._clock = SessionClock(self._now)
+        self.message_stats = smartrowparser.MessageStats()
+        self.halted = threading.Event()  # set while the SmartRow reports a halt
+        self._lock = threading.Lock()  # a reset requested over BLE comes from another thread than the messages
+        self.force_curves = ForceCurveStore(getattr(options, 'force_curve_file', None))
+        self._force_curve = ForceCurveAssembler(self.force_curves)
+        # message type -> handler, called with the message and its values
+        self._handlers = {
+            self.ENERGIE_KCAL_MESSAGE: self._on_energy,
+            self.WORK_STROKE_LENGTH_MESSAGE: self._on_work_stroke_length,
+            self.POWER_MESSAGE: self._on_power,
+            self.STROKE_RATE_STROKE_COUNT_MESSAGE: self._on_stroke_rate_stroke_count,
+            self.PACE_MESSAGE: self._on_pace,
+            self.FORCE_MESSAGE: self._on_force,
+            self.FIRST_PART_FORCE_CURVE_MESSAGE: self._on_force_curve,
+            self.SECOND_PART_FORCE_CURVE_MESSAGE: self._on_force_curve,
+            self.THIRD_PARD_FORCE_CURVE_MESSAGE: self._on_force_curve,
+        }
 
         self.WRValues_rst = None
         self.WRValues = None
-        self.WRValues_standstill = None
-        self.starttime = None
         self.fullstop = None
         self.SmartRowHalt = None
+        self._publisher = None
 
         self._reset_state()
 
     def _reset_state(self):
-        self.WRValues_rst = {
-            'stroke_rate': 0,
-            'total_strokes': 0,
-            'total_distance_m': 0,
-            'instantaneous pace': 0,
-            'speed': 0,
-            'watts': 0,
-            'total_kcal': 0,
-            'total_kcal_hour': 0,
-            'total_kcal_min': 0,
-            'heart_rate': 0,
-            'elapsedtime': 0.0,
-            'work': 0,
-            'stroke_length': 0,
-            'force': 0,
-            'watts_avg':0,
-            'pace_avg':0
-        }
-        self.WRValues = deepcopy(self.WRValues_rst)
-        self.WRValues_standstill = deepcopy(self.WRValues_rst)
-        self.starttime = None # time.time() # was None
+        self.WRValues_rst = ZERO_RECORD
+        self.WRValues = new_record()
+        if self._publisher is None:
+            self._publisher = SnapshotPublisher(self.WRValues_rst)
+        self._stats.reset()
+        self._clock.reset()
         self.fullstop = True
         self.SmartRowHalt = False
         self.Initial_reset = False
 
+    def reset_requested(self):
+        # the SmartRow does not report a reset, its values and the clock start over here. The zeros end the
+        # workout of the sinks.
+        with self._lock:
+            initial_reset = self.Initial_reset
+            self._reset_state()
+            self.Initial_reset = initial_reset
+            self.get_WRValues()
+        logger.info("value reseted")
+
+    def get_WRValues(self):
+        # read-only snapshot shared by all sinks, only rebuilt when a value changed
+        return self._publisher.publish(self.WRValues)
+
+    def changed_since(self, version):
+        return self._publisher.changed_since(version)
+
+    @property
+    def changed(self):
+        return self._publisher.changed
 
     def elapsedtime(self):
-        print(self.fullstop)
+        # the SmartRow clock keeps running at a halt, like the time on the SmartRow app
         if self.fullstop == False:
-            elaspedtimecalc = int(time.time() - self.starttime)
-            self.WRValues.update({'elapsedtime':elaspedtimecalc})
-        elif self.fullstop == True and self.WRValues.get('total_distance_m') !=0 and self.Initial_reset == True:
-            if not self.starttime:
-                   self.starttime = time.time()
-            elaspedtimecalc = int(time.time() - self.starttime)
-            self.WRValues.update({'elapsedtime':elaspedtimecalc})
+            self.WRValues[record.ELAPSEDTIME] = self._clock.seconds
+        elif self.fullstop == True and self.WRValues[record.TOTAL_DISTANCE_M] !=0 and self.Initial_reset == True:
+            self._clock.start()
+            self.WRValues[record.ELAPSEDTIME] = self._clock.seconds
         else:
-            self.WRValues.update({'elapsedtime': 0})
+            self.WRValues[record.ELAPSEDTIME] = 0
 
     # Response for SmartRow V3
     def calculate_challenge_response(self, keylock):
@@ -87,7 +119,7 @@ class DataLogger():
             cksum=f'{(sum(ord(ch) for ch in key)):0>4X}'
 
             if cksum[-2:] == checksum:
-                print("Checksum GOOD")
+                logger.info("SmartRow V3 challenge checksum good")
                 a=(int(keylock[11:15],16) * 17923) // 256
                 result=f'{a:0>6x}'[2:]
                 
@@ -96,195 +128,206 @@ class DataLogger():
                     response.append(ord(c))
                 response.append(0x0d)
                 
-                print(response)
+                logger.debug("challenge response %s", response)
                 return response
             else:
-                print("Checksum BAD")
+                logger.warning("SmartRow V3 challenge checksum bad")
 
         except Exception as e:
-            print(e)
+            logger.error("cannot calculate the challenge response: %s", e)
 
         # return 0x23 on failure
         return [0x23]
 
     def send_challenge_response(self, key):
-        print("--> Sending challenge response")
-
-        for b in key:
-            self._rower_interface.characteristic_write_value(struct.pack("<b",b))
-            sleep(0.1)
+        logger.info("sending challenge response")
+        # the write queue of the rower interface sends the bytes paced by the responses of the SmartRow
+        self._rower_interface.characteristic_write_value(bytes(key))
 
     # SmartRow V3 obfuscates the first 6 characters
     def parse_v3_decrypt(self, event):
-        try:
-            s = ''
-            for c in event[1:6]:
-                s += chr(int(ord(c) & 15 | 0x30))
-
-            r = event[0] + s + event[6:]
-            return r
+        return smartrowparser.v3_decrypt(event)
+
+    def _on_energy(self, event, distance, kcal):
+        self.WRValues[record.TOTAL_DISTANCE_M] = distance
+        self.WRValues[record.TOTAL_KCAL] = kcal
+        self.elapsedtime()
+
+    def _on_work_stroke_length(self, event, distance, work, stroke_length):
+        self.WRValues[record.TOTAL_DISTANCE_M] = distance
+        self.WRValues[record.WORK] = work  # 0.1 J
+        self.WRValues[record.STROKE_LENGTH] = stroke_length
+        self.elapsedtime()
+
+    def _on_power(self, event, distance, watts, watts_avg):
+        self.WRValues[record.TOTAL_DISTANCE_M] = distance
+        if self.SmartRowHalt == True:
+            self.WRValues[record.WATTS] = 0
+        else:
+            self.WRValues[record.WATTS] = int(round(self._stats.update('watts', watts, self._now())))
+        self.WRValues[record.WATTS_AVG] = watts_avg  # 0.1 W
+        self.elapsedtime()
+
+    def _on_stroke_rate_stroke_count(self, event, distance, stroke_rate, strokes):
+        self.WRValues[record.TOTAL_DISTANCE_M] = distance
+        if self.SmartRowHalt == True:
+            self.WRValues[record.STROKE_RATE] = 0
+        else:
+            stroke_rate = self._stats.update('stroke_rate', stroke_rate * 2, self._now())
+            self.WRValues[record.STROKE_RATE] = int(round(stroke_rate))
+        self.WRValues[record.TOTAL_STROKES] = strokes
+        self.elapsedtime()
+
+    def _on_pace(self, event, distance, pace_min, pace_sec, pace_avg_min, pace_avg_sec):
+        self.WRValues[record.TOTAL_DISTANCE_M] = distance
+        pace_inst = pace_min * 60 + pace_sec
+        if self.SmartRowHalt == True:
+            self.WRValues[record.INSTANTANEOUS_PACE] = 0
+            self.WRValues[record.SPEED] = 0
+        else:
+            self.WRValues[record.INSTANTANEOUS_PACE] = int(round(self._stats.update('pace', pace_inst, self._now())))
+        if pace_inst != 0:
+            speed = int(500 * 100 / pace_inst) # speed in cm/s
+            self.WRValues[record.SPEED] = int(round(self._stats.update('speed', speed, self._now())))
+        else:
+            self.WRValues[record.SPEED] = 0
+        self.WRValues[record.PACE_AVG] = pace_avg_min * 60 + pace_avg_sec
+        self.elapsedtime()
+
+    def _on_force(self, event, distance, force):
+        self.WRValues[record.TOTAL_DISTANCE_M] = distance
+
+        # It doesn't look like V3 has data in this field
+        if not self.SmartRowV3:
+            self.WRValues[record.FORCE] = force
+
+        if event[11] == "!":
+            if not self.SmartRowHalt:
+                # the windows start over when rowing resumes
+                self._stats.reset()
+            self.SmartRowHalt = True
+            self.fullstop = True
+            self.halted.set()
+        elif not self._clock.started:
+            self._clock.start()
+            self.SmartRowHalt = False
+            self.fullstop = False
+            self.halted.clear()
+        else:
+            self.SmartRowHalt = False
+            self.fullstop = False
+            self.halted.clear()
+        self.elapsedtime()
 
-        except Exception as e:
-            print(e)
-            print(event)
-            return event
+    def _on_force_curve(self, event):
+        self._force_curve.fragment(event)
+        # the parts of the force curve are answered like any other message
+        self._rower_interface.characteristic_write_value(struct.pack("<b", 0x23))
 
-    def on_row_event(self, event):
+    def _on_other(self, event):
         if 'V3.00' in event:
             self.SmartRowV3 = True
             self._rower_interface.characteristic_write_value(struct.pack("<b", 0x23))
 
         elif 'KEYLOCK' in event:
-            try:
-                self.SmartRowV3 = True
-                key = self.calculate_challenge_response(event)
-                self.send_challenge_response(key)
-            except Exception as e:
-                print("Exception in KEYLOCK event!")
-                print(str(e))
-
-        # Un-obfuscate SmartRow V3 distance data
-        if self.SmartRowV3 is True:
-            event = self.parse_v3_decrypt(event)
-
-        try:
-            if event[0] == self.ENERGIE_KCAL_MESSAGE:
-                event = event.replace(" ", "0")
-                self.WRValues.update({'total_distance_m': int((event[1:6]))})
-                self.WRValues.update({'total_kcal': int((event[6:10]))})
-                self.elapsedtime()
-
-            elif event[0] == self.WORK_STROKE_LENGTH_MESSAGE:
-                event = event.replace(" ", "0")
-                #print(event)
-                self.WRValues.update({'total_distance_m': int((event[1:6]))})
-                self.WRValues.update({'work': float(event[7:11])/10})
-                self.WRValues.update({'stroke_length': int((event[11:14]))})
-                self.elapsedtime()
-
-            elif event[0] == self.POWER_MESSAGE:
-                event = event.replace(" ", "0")
-                self.WRValues.update({'total_distance_m': int((event[1:6]))})
-                if self.SmartRowHalt == True:
-                    self.WRValues.update({'watts': 0})
-                else:
-                    self.WRValues.update({'watts': int((event[6:9]))})
-                self.WRValues.update({'watts_avg': float((event[9:14]))/10})
-                self.elapsedtime()
-
-            elif event[0] == self.STROKE_RATE_STROKE_COUNT_MESSAGE:
-                event = event.replace(" ", "0")
-                self.WRValues.update({'total_distance_m': int((event[1:6]))})
-                if self.SmartRowHalt == True:
-                    self.WRValues.update({'stroke_rate': 0})
-                else:
-                    self.WRValues.update({'stroke_rate': float((event[6:8]))*2})
-                self.WRValues.update({'total_strokes':int((event[9:13]))})
-                self.elapsedtime()
-
-            elif event[0] == self.PACE_MESSAGE:
-                event = event.replace(" ", "0")
-                self.WRValues.update({'total_distance_m': int((event[1:6]))})
-                pace_inst = int(event[6])*60 + int(event[7:9])
-                if self.SmartRowHalt == True:
-                    self.WRValues.update({'instantaneous pace': 0})
-                    self.WRValues.update({'speed': 0})
-                else:
-                    self.WRValues.update({'instantaneous pace': pace_inst})
-                if pace_inst != 0:
-                    speed = int(500 * 100 / pace_inst) # speed in cm/s
-                    self.WRValues.update({'speed': speed})
-                else:
-                    self.WRValues.update({'speed': 0})
-                pace_avg = int(event[9])*60 + int(event[10:12])
-                self.WRValues.update({'pace_avg': pace_avg})
-                self.elapsedtime()
-
-            elif event[0] == self.FORCE_MESSAGE:
-                event = event.replace(" ", "0")
-                self.WRValues.update({'total_distance_m': int((event[1:6]))})
-                
-                # It doesn't look like V3 has data in this field
-                if not self.SmartRowV3:
-                    self.WRValues.update({'force': int((event[7:11]))})
-
-                if event[11] == "!":
-                    self.SmartRowHalt = True
-                    self.fullstop = True
-                elif self.starttime == None:
-                    self.starttime = time.time()
-                    self.SmartRowHalt = False
-                    self.fullstop = False
-                else:
-                    self.SmartRowHalt = False
-                    self.fullstop = False
-                self.elapsedtime()
-
-            else:
-                self._rower_interface.characteristic_write_value(struct.pack("<b", 0x23))
-
-        except Exception as e:
-            print(e)
-            print(event)
+            self.SmartRowV3 = True
+            key = self.calculate_challenge_response(event)
+            self.send_challenge_response(key)
 
-        print(self.WRValues)
+        self._rower_interface.characteristic_write_value(struct.pack("<b", 0x23))
 
+    def on_row_event(self, event):
+        started = perf_counter_ns()
+        # Un-obfuscate SmartRow V3 distance data, the V3.00 and KEYLOCK handshake messages come as they are
+        if self.SmartRowV3 and event[:1] in smartrowparser.MESSAGE_TYPES:
+            event = smartrowparser.v3_decrypt(event)
+        parsed = smartrowparser.parse(event)
+        if parsed is None:
+            self.message_stats.add_other()
+            self._on_other(event)
+            return
+        message_type, values = parsed
+        if values is None:
+            self.message_stats.add_malformed(message_type)
+            logger.debug("malformed SmartRow message %r", event)
+            return
+        with self._lock:
+            self._handlers[message_type](event, *values)
+            # publishing wakes up the SinkPublisher if one of the values changed with this message
+            self.get_WRValues()
+        self.message_stats.add(message_type, perf_counter_ns() - started)
+
+    def log_message_stats(self):
+        logger.info("SmartRow messages: %s", self.message_stats.summary())
+
+
+RESET_COMMAND = bytes((13, 86, 64, 13))
 
-def connectSR(manager,smartrow):
-    smartrow.connect()
-    manager.run()
 
 def reset(smartrow):
-    smartrow.characteristic_write_value(struct.pack("<b", 13))
-    sleep(0.002)
-    smartrow.characteristic_write_value(struct.pack("<b", 86))
-    sleep(0.002)
-    smartrow.characteristic_write_value(struct.pack("<b", 64))
-    sleep(0.002)
-    smartrow.characteristic_write_value(struct.pack("<b", 13))
-
-def heartbeat(sr):
-    while True:
-        sr.characteristic_write_value(struct.pack("<b", 36))
-        sleep(1)
-
+    smartrow.characteristic_write_value(RESET_COMMAND)
 
-def main(in_q, ble_out_q,ant_out_q):
-    # this starts discovery, calls manager.run() and returns manager.smartrowmac
-    # 
-    macaddresssmartrower = smartrowreader.connecttosmartrow()
-    manager = gatt.DeviceManager(adapter_name='hci0')
-    smartrow = smartrowreader.SmartRow(mac_address=macaddresssmartrower, manager=manager)
-    SRtoBLEANT = DataLogger(smartrow)
 
-    BC = threading.Thread(target=connectSR, args=(manager,smartrow))
+def wait_for_reset(in_q, smartrow, datalogger):
+    while True:
+        ResetRequest_ble = in_q.get()  # blocks until the BLE control point requests a reset
+        logger.info("reset requested over BLE: %s", ResetRequest_ble)
+        reset(smartrow)
+        datalogger.reset_requested()
+
+
+def main(in_q, ble_out_q,ant_out_q, options=None, relay=None):
+    # one manager and main loop for the whole session: it connects the last SmartRow directly and only falls
+    # back to a discovery if that fails
+    if getattr(options, 'smartrow_replay', None):
+        manager = FakeSmartRow(options.smartrow_replay, getattr(options, 'replay_speed', 1.0))
+    else:
+        manager = smartrowreader.SmartRowManager(adapter_name='hci0',
+                                                 cache_path=getattr(options, 'smartrow_cache', None))
+        if getattr(options, 'smartrow_capture', None):
+            capture = CaptureWriter(options.smartrow_capture)
+            manager.attach_capture(capture)
+            atexit.register(capture.close)
+    if relay is not None:
+        # the relay gets the notifications before the data logger parses them
+        relay.attach_rower(manager)
+        atexit.register(relay.log_latency)
+    SRtoBLEANT = DataLogger(manager, options)
+    atexit.register(SRtoBLEANT.log_message_stats)
+    atexit.register(SRtoBLEANT.force_curves.close)
+    manager.connect_smartrow()
+
+    BC = threading.Thread(target=manager.run)
     BC.daemon = True
     BC.start()
 
+    manager.connected.wait()
     logger.info("SmartRow Ready and sending data to BLE and ANT Thread")
-    while not smartrow.ready() :
-      sleep(0.2)
-
-    print("starting heart beat")
-    HB = threading.Thread(target=heartbeat, args=([smartrow]))
-    HB.daemon = True
-    HB.start()
-    sleep(3) # this sleep is needed in order give the user time to putt back the handle after pulling it to activate it.
-    # The SmartRow device is very sensitive to touches which then triggers 1 m very easy after a reset which then already starts after a restart.
-    reset(smartrow)
-    sleep(1)
+
+    logger.info("starting heart beat")
+    manager.writer.start_heartbeat()
+    # The SmartRow device is very sensitive to touches which then triggers 1 m very easy after a reset which then
+    # already starts after a restart. The reset waits until the handle the user pulled to activate it is back at
+    # rest, at most RESET_DELAY seconds.
+    SRtoBLEANT.halted.wait(RESET_DELAY)
+    reset(manager)
+    # the first reset counts once the connected SmartRow answered it
+    if not manager.writer.wait_sent(RESET_DELAY):
+        logger.warning("SmartRow did not answer the reset within %d s", RESET_DELAY)
     SRtoBLEANT.Initial_reset = True # this should help to check if the first reset has been performed
 
-    while True:
-        if not in_q.empty():
-            ResetRequest_ble = in_q.get()
-            print(ResetRequest_ble)
-            reset(smartrow)
-        else:
-            pass
-        ble_out_q.append(SRtoBLEANT.WRValues)
-        ant_out_q.append(SRtoBLEANT.WRValues)
-        sleep(0.1)
+    RT = threading.Thread(target=wait_for_reset, args=(in_q, manager, SRtoBLEANT))
+    RT.daemon = True
+    RT.start()
+    sinks = [ble_out_q, ant_out_q]
+    for sink in (open_recorder(options), open_exporter(options), open_history(options)):
+        if sink:
+            sinks.append(sink)
+            atexit.register(sink.close)
+    publisher = SinkPublisher(SRtoBLEANT.get_WRValues, SRtoBLEANT.changed, sinks,
+                              getattr(options, 'min_publish_interval', MIN_PUBLISH_INTERVAL),
+                              getattr(options, 'max_publish_interval', MAX_PUBLISH_INTERVAL))
+    publisher.run()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,73 @@
+# Cost per notification of the FTMS rower data encoding before and after the encoders of ftmsencoder.py, from the
+# src folder:
+#
+#   python3 -m tests.bench_ftmsencoder --count 100000
+
+import argparse
+import struct
+import time
+
+from adapters.ble.ftmsencoder import rower_data_encoder
+from adapters.common import record
+
+
+def _legacy_rower_data(values, byte):
+    # the encoding of waterrowerble before the encoders: one struct.pack per byte and a dbus.Byte per byte
+    packed = [struct.pack("B", values[record.STROKE_RATE] & 0xff),
+              struct.pack("B", values[record.TOTAL_STROKES] & 0xff),
+              struct.pack("B", (values[record.TOTAL_STROKES] & 0xff00) >> 8),
+              struct.pack("B", values[record.TOTAL_DISTANCE_M] & 0xff),
+              struct.pack("B", (values[record.TOTAL_DISTANCE_M] & 0xff00) >> 8),
+              struct.pack("B", (values[record.TOTAL_DISTANCE_M] & 0xff0000) >> 16),
+              struct.pack("B", values[record.INSTANTANEOUS_PACE] & 0xff),
+              struct.pack("B", (values[record.INSTANTANEOUS_PACE] & 0xff00) >> 8),
+              struct.pack("B", values[record.WATTS] & 0xff),
+              struct.pack("B", (values[record.WATTS] & 0xff00) >> 8),
+              struct.pack("B", values[record.TOTAL_KCAL] & 0xff),
+              struct.pack("B", (values[record.TOTAL_KCAL] & 0xff00) >> 8),
+              struct.pack("B", values[record.TOTAL_KCAL_HOUR] & 0xff),
+              struct.pack("B", (values[record.TOTAL_KCAL_HOUR] & 0xff00) >> 8),
+              struct.pack("B", values[record.TOTAL_KCAL_MIN] & 0xff),
+              struct.pack("B", values[record.HEART_RATE] & 0xff),
+              struct.pack("B", values[record.ELAPSEDTIME] & 0xff),
+              struct.pack("B", (values[record.ELAPSEDTIME] & 0xff00) >> 8)]
+    return [byte(0x2C), byte(0x0B)] + [byte(b[0]) for b in packed]
+
+
+def _bench(encode, values, count):
+    started = time.perf_counter_ns()
+    for _ in range(count):
+        encode(values)
+    return (time.perf_counter_ns() - started) / count / 1000.0
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Cost of the FTMS rower data encoding per notification")
+    parser.add_argument("--count", type=int, default=100000, help="notifications per encoding")
+    args = parser.parse_args(args)
+
+    try:
+        import dbus
+        byte, byte_array, bus_types = dbus.Byte, dbus.ByteArray, "dbus"
+    except ImportError:
+        # without dbus-python the bus types are left out, which is the lower bound of the old encoding
+        byte, byte_array, bus_types = int, bytes, "no dbus"
+
+    values = record.new_record()
+    for index, value in ((record.STROKE_RATE, 56), (record.TOTAL_STROKES, 312), (record.TOTAL_DISTANCE_M, 70123),
+                         (record.INSTANTANEOUS_PACE, 118), (record.WATTS, 212), (record.TOTAL_KCAL, 95),
+                         (record.TOTAL_KCAL_HOUR, 1020), (record.TOTAL_KCAL_MIN, 17), (record.HEART_RATE, 151),
+                         (record.ELAPSEDTIME, 1534)):
+        values[index] = value
+    encoder = rower_data_encoder()
+    if bytes(_legacy_rower_data(values, int)) != encoder.encode(values):
+        raise SystemExit("the encodings differ")
+
+    before = _bench(lambda v: _legacy_rower_data(v, byte), values, args.count)
+    after = _bench(lambda v: byte_array(encoder.encode(v)), values, args.count)
+    print("rower data, %d bytes, %s: %.2f µs before, %.2f µs after per notification (%.1fx)" % (
+        encoder.size, bus_types, before, after, before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import pytest
+
+from adapters.common import record
+from adapters.common.fitexport import FitExporter
+from adapters.common.snapshot import Snapshot
+
+fitparse = pytest.importorskip('fitparse')
+
+SECONDS = 3600          # one hour of rowing, one snapshot per second
+PAUSE = range(1800, 1860)  # the clock of the rower stands still for a minute in the middle
+
+
+def row_one_hour(exporter, started=10 ** 12):
+    values = record.new_record()
+    clock = 0
+    for second in range(SECONDS):
+        if second not in PAUSE:
+            clock += 1
+            values[record.TOTAL_DISTANCE_M] += 4
+            values[record.TOTAL_STROKES] = clock // 3
+            values[record.STROKE_RATE] = 40
+            values[record.WATTS] = 150
+            values[record.SPEED] = 400
+            values[record.HEART_RATE] = 140
+            values[record.TOTAL_KCAL] = clock // 10
+        values[record.ELAPSEDTIME] = clock
+        exporter.append(Snapshot(values, version=second + 1, at=started + second * 10 ** 9))
+    # the reset of the rower ends the workout
+    exporter.append(Snapshot(record.new_record(), version=SECONDS + 1, at=started + SECONDS * 10 ** 9))
+    return values
+
+
+def test_one_hour_workout_decodes(tmp_path):
+    exporter = FitExporter(str(tmp_path))
+    values = row_one_hour(exporter)
+    assert not exporter.in_workout
+    (path,) = tmp_path.iterdir()
+
+    fit = fitparse.FitFile(str(path), check_crc=True)
+    messages = list(fit.get_messages())  # raises on a bad CRC
+    names = [message.name for message in messages]
+    assert names[0] == 'file_id'
+    assert names.count('record') == SECONDS
+    assert names[-3:] == ['lap', 'session', 'activity']
+
+    (session,) = fit.get_messages('session')
+    (lap,) = fit.get_messages('lap')
+    (activity,) = fit.get_messages('activity')
+    elapsed = SECONDS - 1
+    timer = elapsed - len(PAUSE)
+    for totals in (session, lap):
+        assert totals.get_value('total_elapsed_time') == elapsed
+        assert totals.get_value('total_timer_time') == timer
+        assert totals.get_value('total_distance') == values[record.TOTAL_DISTANCE_M]
+        assert totals.get_value('total_calories') == values[record.TOTAL_KCAL]
+        assert totals.get_value('avg_heart_rate') == 140
+    assert session.get_value('num_laps') == 1
+    assert activity.get_value('total_timer_time') == timer
+    assert activity.get_value('num_sessions') == 1
+
+
+def test_timer_time_never_exceeds_elapsed_time(tmp_path):
+    # the rower clock is a second ahead of the first snapshot, which used to give 3599 s timer in 3598 s elapsed
+    exporter = FitExporter(str(tmp_path))
+    values = record.new_record()
+    started = 10 ** 12
+    for second in range(SECONDS - 1):
+        values[record.ELAPSEDTIME] = second + 2
+        values[record.TOTAL_DISTANCE_M] = 4 * (second + 1)
+        exporter.append(Snapshot(values, version=second + 1, at=started + second * 10 ** 9 + 999 * 10 ** 6))
+    exporter.close()
+    (path,) = tmp_path.iterdir()
+
+    (session,) = fitparse.FitFile(str(path), check_crc=True).get_messages('session')
+    assert session.get_value('total_timer_time') <= session.get_value('total_elapsed_time')
@@ -0,0 +1,72 @@
+import struct
+
+import pytest
+
+from adapters.ble.ftmsencoder import FtmsEncoder, ROWER_DATA_FIELDS, indoor_bike_data_encoder, rower_data_encoder
+from adapters.common import record
+
+
+def rowing_values():
+    values = record.new_record()
+    for index, value in ((record.STROKE_RATE, 56), (record.TOTAL_STROKES, 312), (record.TOTAL_DISTANCE_M, 70123),
+                         (record.INSTANTANEOUS_PACE, 118), (record.WATTS, 212), (record.TOTAL_KCAL, 95),
+                         (record.TOTAL_KCAL_HOUR, 1020), (record.TOTAL_KCAL_MIN, 17), (record.HEART_RATE, 151),
+                         (record.ELAPSEDTIME, 1534)):
+        values[index] = value
+    return values
+
+
+def test_rower_data_layout():
+    payload = rower_data_encoder().encode(rowing_values())
+    assert payload == bytes((
+        0x2C, 0x0B,         # flags
+        56,                 # stroke rate
+        0x38, 0x01,         # strokes 312
+        0xEB, 0x11, 0x01,   # distance 70123 m in 24 bits
+        118, 0,             # pace s/500 m
+        212, 0,             # power W
+        95, 0,              # total energy kcal
+        0xFC, 0x03,         # energy per hour 1020 kcal
+        17,                 # energy per minute kcal
+        151,                # heart rate
+        0xFE, 0x05,         # elapsed time 1534 s
+    ))
+    assert len(payload) == rower_data_encoder().size
+
+
+def test_rower_data_encodes_a_read_only_record():
+    values = rowing_values()
+    assert rower_data_encoder().encode(memoryview(values).toreadonly()) == rower_data_encoder().encode(values)
+
+
+def test_signed_values_are_packed_in_twos_complement():
+    values = rowing_values()
+    values[record.WATTS] = -5
+    payload = rower_data_encoder().encode(values)
+    assert payload[10:12] == struct.pack('<h', -5)
+
+
+def test_indoor_bike_data_layout():
+    values = rowing_values()
+    assert indoor_bike_data_encoder().encode(values) == bytes((
+        0xC5, 0x00,   # flags
+        112, 0,       # cadence in 0.5/min, twice the stroke rate
+        212, 0,       # power W
+        212, 0,       # average power W
+    ))
+
+
+def test_more_data_bit_is_inverted():
+    # without bit 0 the stroke rate and strokes are there, with it they are left out
+    encoder = FtmsEncoder(0x0001, ROWER_DATA_FIELDS, inverted=1)
+    assert encoder.encode(rowing_values()) == b'\x01\x00'
+
+
+def test_unsupported_flag_bit_is_rejected():
+    with pytest.raises(ValueError):
+        rower_data_encoder(0x0B2C | 1 << 1)  # average stroke rate
+
+
+def test_encoders_are_shared_per_flags():
+    assert rower_data_encoder() is rower_data_encoder()
+    assert rower_data_encoder(0x0001) is not rower_data_encoder()
@@ -0,0 +1,50 @@
+import pytest
+
+from adapters.common.history import HistoryStore, SAMPLE_WIDTH, best_time, split_times
+
+
+def test_best_time_finds_the_fastest_stretch():
+    # 4 m/s, then 5 m/s from 100 m on
+    times = [0, 10, 20, 30, 40, 50]
+    distances = [0, 40, 80, 130, 180, 230]
+    assert best_time(times, distances, 100) == pytest.approx(20)
+    assert best_time(times, distances, 50) == pytest.approx(10)
+
+
+def test_best_time_scales_down_to_the_distance():
+    assert best_time([0, 10], [0, 40], 20) == pytest.approx(5)
+
+
+def test_best_time_of_a_distance_never_covered():
+    assert best_time([0, 10, 20], [0, 40, 80], 100) is None
+    assert best_time([], [], 100) is None
+
+
+def test_split_times_are_interpolated():
+    times = [0, 60, 120, 180, 240]
+    distances = [0, 300, 600, 900, 1100]
+    splits = split_times(times, distances)
+    assert splits == pytest.approx([100, 110])  # 1000 m at 210 s, halfway through the slower last minute
+
+
+def test_split_times_of_one_sample_crossing_several_splits():
+    assert split_times([0, 200], [0, 1000]) == pytest.approx([100, 100])
+
+
+def test_store_keeps_the_totals_and_bests():
+    store = HistoryStore(':memory:')
+    samples = []
+    for second in range(0, 601):
+        samples.extend((second, second * 4, 200, 56, 400, 140))
+    session_id = store.add_session(1700000000, samples, kcal=80, total_strokes=280)
+    (session,) = store.recent(days=1, now=1700000000)
+    assert session['id'] == session_id
+    assert session['duration_s'] == 600
+    assert session['distance_m'] == 2400
+    assert session['avg_split_ms'] == 125000
+    assert store.splits(session_id) == [125000] * 4
+    assert store.best(2000)['time_ms'] == 500000
+    assert store.best(5000) is None
+    data, _ = store.session_data(session_id)
+    assert len(data) == 601 * SAMPLE_WIDTH
+    store.close()
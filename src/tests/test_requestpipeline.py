@@ -0,0 +1,81 @@
+import threading
+
+from adapters.s4.waterrowerinterface import RequestPipeline
+
+TIMEOUT = 0.02
+
+
+def pipeline(window=2, retries=2):
+    sent = []
+    return RequestPipeline(sent.append, window=window, timeout=TIMEOUT, retries=retries), sent
+
+
+def test_requests_fill_the_window():
+    requests, sent = pipeline()
+    stop = threading.Event()
+    assert requests.submit('055', stop)
+    assert requests.submit('088', stop)
+    assert sent == ['055', '088']
+
+
+def test_an_address_in_flight_is_not_requested_twice():
+    requests, sent = pipeline()
+    stop = threading.Event()
+    assert requests.submit('055', stop)
+    assert not requests.submit('055', stop)
+    assert sent == ['055']
+
+
+def test_a_reply_frees_its_slot():
+    requests, sent = pipeline(retries=100)
+    stop = threading.Event()
+    requests.submit('055', stop)
+    requests.submit('088', stop)
+    reply = threading.Timer(TIMEOUT / 4, requests.complete, ('088',))
+    reply.start()
+    assert requests.submit('140', stop)
+    reply.join()
+    assert sent == ['055', '088', '140']
+    assert requests.latency_stats()['088']['replies'] == 1
+
+
+def test_a_full_window_gives_way_to_stop():
+    requests, sent = pipeline(window=1, retries=100)
+    stop = threading.Event()
+    requests.submit('055', stop)
+    threading.Timer(TIMEOUT / 4, stop.set).start()
+    assert not requests.submit('088', stop)
+    assert '088' not in sent
+
+
+def test_lost_requests_are_sent_again_and_given_up():
+    requests, sent = pipeline(window=1, retries=2)
+    stop = threading.Event()
+    requests.submit('055', stop)
+    # the S4 never answers 055: it is sent again twice, then its slot goes to the next request
+    assert requests.submit('088', stop)
+    assert sent == ['055', '055', '055', '088']
+    stats = requests.latency_stats()['055']
+    assert stats['timeouts'] == 3
+    assert stats['lost'] == 1
+
+
+def test_replies_are_matched_by_address():
+    requests, sent = pipeline()
+    stop = threading.Event()
+    requests.submit('055', stop)
+    assert requests.complete('088') is None
+    latency = requests.complete('055')
+    assert latency is not None and latency >= 0
+    assert requests.complete('055') is None  # a late second reply
+    stats = requests.latency_stats()['055']
+    assert stats['replies'] == 1 and stats['max'] == latency
+
+
+def test_reset_drops_the_requests_in_flight():
+    requests, sent = pipeline(window=1)
+    stop = threading.Event()
+    requests.submit('055', stop)
+    requests.reset()
+    assert requests.submit('088', stop)
+    assert sent == ['055', '088']
@@ -0,0 +1,48 @@
+from adapters.s4.waterrowerinterface import (CODE_ADDRESS, EVENT_CODES, EVENT_MODEL, EVENT_PING, EVENT_PULSE,
+                                             EVENT_STROKE_END, EVENT_STROKE_START, Event, events_from)
+
+AT = 123456789
+
+
+def parse(buffer):
+    return [(event.type, event.value, event.at) for event in events_from(buffer, AT)]
+
+
+def test_memory_replies_by_size():
+    assert parse(b'IDD055012C\r\n') == [('total_distance_m', 0x012C, AT)]   # double, hex
+    assert parse(b'IDS1A91C\r\n') == [('stroke_rate', 0x1C, AT)]            # single, hex
+    assert parse(b'IDT08A01F4A0\r\n') == [('total_kcal', 0x01F4A0, AT)]     # triple, hex
+    assert parse(b'IDS1E159\r\n') == [('display_sec', 59, AT)]              # single, decimal
+
+
+def test_stroke_pulse_and_model_messages():
+    codes = [event.code for event in events_from(b'SS\r\nSE\r\nP1B\r\nPING\r\nIV40210\r\n', AT)]
+    assert codes == [EVENT_STROKE_START, EVENT_STROKE_END, EVENT_PULSE, EVENT_PING, EVENT_MODEL]
+
+
+def test_one_read_gets_one_timestamp():
+    events = events_from(b'SS\r\nIDD14000A0\r\nSE\r\n', AT)
+    assert [event.at for event in events] == [AT] * 3
+
+
+def test_lines_without_event_are_skipped():
+    assert parse(b'OK\r\n_WR_\r\nAK1\r\n\r\n  \r\nSX\r\nERRORX\r\n') == []
+
+
+def test_unknown_address_and_bad_value_are_dropped():
+    # the lines around a broken one still get their events
+    assert parse(b'SS\r\nIDD999012C\r\nIDD055XYZW\r\nSE\r\n') == [('stroke_start', None, AT),
+                                                                   ('stroke_end', None, AT)]
+
+
+def test_reply_codes_lead_back_to_their_address():
+    event = events_from(b'IDD088009C\r\n', AT)[0]
+    assert event.code == EVENT_CODES['watts']
+    assert event.value == 156
+    assert CODE_ADDRESS[event.code] == '088'
+
+
+def test_events_are_slotted():
+    event = Event(EVENT_PULSE, None, AT)
+    assert not hasattr(event, '__dict__')
+    assert event.type == 'pulse'
@@ -0,0 +1,109 @@
+from adapters.common.sessionclock import HOUR_NS, MINUTE_NS, NS, SessionClock
+
+
+class FakeTime(object):
+    def __init__(self):
+        self.now = 1000 * NS
+
+    def __call__(self):
+        return self.now
+
+
+def running_clock(elapsed_ns):
+    now = FakeTime()
+    clock = SessionClock(now)
+    clock.start()
+    now.now += elapsed_ns
+    return clock, now
+
+
+def test_runs_between_start_and_pause():
+    clock, now = running_clock(10 * NS)
+    clock.pause()
+    now.now += 5 * NS
+    assert clock.seconds == 10
+    clock.resume()
+    now.now += 2 * NS
+    assert clock.seconds == 12
+    clock.reset()
+    assert not clock.started and clock.seconds == 0
+
+
+def test_events_carry_their_time():
+    clock, now = running_clock(10 * NS)
+    clock.pause(now.now - 3 * NS)  # the last pulse was 3 s ago
+    assert clock.seconds == 7
+
+
+def test_sync_seconds_keeps_a_clock_within_the_displayed_second():
+    clock, _ = running_clock(10 * NS + NS // 2)
+    assert clock.sync_seconds(10) == 0
+    assert clock.seconds == 10
+
+
+def test_sync_seconds_moves_a_clock_ahead_back():
+    clock, _ = running_clock(12 * NS + NS // 5)
+    assert clock.sync_seconds(10) < 0
+    assert clock.seconds == 10
+    # to the end of the displayed second, the display turns to 11 next
+    assert clock.elapsed_ns() == 11 * NS - 1
+
+
+def test_sync_seconds_moves_a_clock_behind_forward():
+    clock, _ = running_clock(8 * NS + NS // 2)
+    assert clock.sync_seconds(10) == NS + NS // 2
+    assert clock.elapsed_ns() == 10 * NS
+
+
+def test_sync_seconds_over_the_full_minute():
+    clock, _ = running_clock(MINUTE_NS - NS)  # 0:59, the display already shows 1:01
+    clock.sync_seconds(1)
+    assert clock.seconds == 61
+
+
+def test_sync_minutes():
+    clock, _ = running_clock(5 * MINUTE_NS + 30 * NS)
+    assert clock.sync_minutes(7) == 2 * MINUTE_NS
+    assert clock.seconds == 7 * 60 + 30
+    assert clock.sync_minutes(6) == -MINUTE_NS
+    assert clock.seconds == 6 * 60 + 30
+
+
+def test_sync_minutes_skips_the_rollover():
+    # the minutes and the seconds of the display are read at different times close to the full minute
+    for second in (58, 59, 0, 1, 2):
+        clock, _ = running_clock(5 * MINUTE_NS + second * NS)
+        assert clock.sync_minutes(9) == 0
+
+
+def test_sync_minutes_into_the_next_hour():
+    clock, _ = running_clock(59 * MINUTE_NS + 30 * NS)
+    assert clock.sync_minutes(0) == MINUTE_NS
+    assert clock.seconds == 3600 + 30
+
+
+def test_sync_minutes_never_goes_below_zero():
+    clock, _ = running_clock(30 * NS)
+    clock.sync_minutes(59)
+    assert clock.seconds == 59 * 60 + 30
+
+
+def test_sync_hours():
+    clock, _ = running_clock(30 * MINUTE_NS)
+    assert clock.sync_hours(1) == HOUR_NS
+    assert clock.seconds == 90 * 60
+    assert clock.sync_hours(1) == 0
+
+
+def test_sync_hours_skips_the_rollover():
+    for minute in (59, 0):
+        clock, _ = running_clock(HOUR_NS + minute * MINUTE_NS + 30 * NS)
+        assert clock.sync_hours(5) == 0
+
+
+def test_sync_while_paused():
+    clock, now = running_clock(12 * NS + NS // 5)
+    clock.pause()
+    clock.sync_seconds(10)
+    now.now += 30 * NS
+    assert clock.seconds == 10
@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip('gatt')
+pytest.importorskip('gi')
+
+from adapters.common import record
+from adapters.smartrow.smartrowtobleant import DataLogger
+
+REPLY = b'\x23'
+
+
+class FakeRower(object):
+    def __init__(self):
+        self.written = []
+
+    def register_callback(self, cb):
+        pass
+
+    def characteristic_write_value(self, value):
+        self.written.append(bytes(value))
+
+
+def keylock(digits='1234567'):
+    key = 'KEYLOCK' + digits
+    return '#' + key + ('%04X' % sum(ord(c) for c in key))[-2:]
+
+
+def test_v3_handshake_answers_the_challenge():
+    rower = FakeRower()
+    datalogger = DataLogger(rower)
+    datalogger.on_row_event('V3.00')
+    assert datalogger.SmartRowV3
+    rower.written.clear()
+
+    event = keylock()
+    datalogger.on_row_event(event)
+    response = bytes(datalogger.calculate_challenge_response(event))
+    assert response != REPLY  # the checksum of the challenge is good
+    assert rower.written == [response, REPLY]
+
+
+def test_v3_data_messages_are_decrypted():
+    datalogger = DataLogger(FakeRower())
+    datalogger.on_row_event('V3.00')
+    # the SmartRow V3 sends the digits of the distance with a changed high nibble
+    datalogger.on_row_event('a' + '00123'.translate({ord(c): ord(c) + 0x10 for c in '0123456789'}) + '0042')
+    assert datalogger.WRValues[record.TOTAL_DISTANCE_M] == 123
+    assert datalogger.WRValues[record.TOTAL_KCAL] == 42
@@ -31,9 +31,11 @@ from collections import deque
 from adapters.ble import waterrowerble
 from adapters.ble import waterrowerble_cycling
 from adapters.ble import waterrowerble_indoor_bike
+from adapters.ble import smartrowrelay
 from adapters.s4 import wrtobleant
 from adapters.ant import waterrowerant
 from adapters.smartrow import smartrowtobleant
+from adapters.ble.notifications import WakeupDeque
 import pathlib
 import signal
 
@@ -67,17 +69,17 @@ def main(args=None):
 
     def BleService(out_q, ble_in_q):
         logger.info("Start BLE Advertise and BLE GATT Server")
-        bleService = waterrowerble_indoor_bike.main(out_q, ble_in_q)
+        bleService = waterrowerble_indoor_bike.main(out_q, ble_in_q, relay, args)
         bleService()
 
     def Waterrower(in_q, ble_out_q, ant_out_q):
         logger.info("Waterrower Interface started")
-        Waterrowerserial = wrtobleant.main(in_q, ble_out_q, ant_out_q)
+        Waterrowerserial = wrtobleant.main(in_q, ble_out_q, ant_out_q, args)
         Waterrowerserial()
 
     def Smartrow(in_q, ble_out_q, ant_out_q):
         logger.info("Smartrow Interface started")
-        Smartrowconnection = smartrowtobleant.main(in_q, ble_out_q, ant_out_q)
+        Smartrowconnection = smartrowtobleant.main(in_q, ble_out_q, ant_out_q, args, relay)
         Smartrowconnection()
 
     def ANTService(ant_in_q):
@@ -86,9 +88,14 @@ def main(args=None):
         antService()
 
 
+    relay = None
+    if args.smartrow_relay and args.interface == "sr" and args.blue:
+        logger.info("SmartRow will be passed through to the SmartRow app")
+        relay = smartrowrelay.SmartRowRelay()
+
     # TODO: Switch from queue to deque
     q = Queue()
-    ble_q = deque(maxlen=1)
+    ble_q = WakeupDeque(maxlen=1)  # wakes up the BLE main loop with every snapshot
     ant_q = deque(maxlen=1)
     threads = []
     if args.interface == "s4":
@@ -140,6 +147,27 @@ if __name__ == '__main__':
         parser.add_argument("-i", "--interface", choices=["s4","sr"], default="s4", help="choose  Waterrower interface S4 monitor: s4 or Smartrow: sr")
         parser.add_argument("-b", "--blue", action='store_true', default=False,help="Broadcast Waterrower data over bluetooth low energy")
         parser.add_argument("-a", "--antfe", action='store_true', default=False,help="Broadcast Waterrower data over Ant+")
+        parser.add_argument("--s4-port", metavar="PORT", default=None, help="Serial port of the S4 instead of searching for it, e.g. the pty of the S4 simulator")
+        parser.add_argument("--s4-capture", metavar="FILE", default=None, help="Record the raw S4 serial traffic to FILE")
+        parser.add_argument("--s4-replay", metavar="FILE", default=None, help="Replay a S4 capture FILE instead of using the serial port")
+        parser.add_argument("--smartrow-capture", metavar="FILE", default=None, help="Record the raw SmartRow notifications and writes to FILE")
+        parser.add_argument("--smartrow-replay", metavar="FILE", default=None, help="Replay a SmartRow capture FILE instead of connecting the SmartRow")
+        parser.add_argument("--replay-speed", type=float, default=1.0, help="Speed of the S4 or SmartRow replay, 1 is real time, 0 as fast as possible")
+        parser.add_argument("--min-publish-interval", type=float, default=0.05, help="Minimum seconds between two publishes of changed values to BLE and ANT+")
+        parser.add_argument("--max-publish-interval", type=float, default=1.0, help="Seconds after which unchanged values are published again to BLE and ANT+")
+        parser.add_argument("--ble-min-interval", type=float, default=0.05, help="Minimum seconds between two BLE notifications, 0.05 is at most 20 notifications per second")
+        parser.add_argument("--ble-keepalive-interval", type=float, default=1.0, help="Seconds after which an unchanged BLE notification is sent again")
+        parser.add_argument("--power-window", dest="watts_window", metavar="SPEC", default=None, help="Smoothing of the power: N values (S4: strokes), Ns seconds or emaF exponential smoothing with factor F")
+        parser.add_argument("--pace-window", metavar="SPEC", default=None, help="Smoothing of the pace, same SPEC as --power-window")
+        parser.add_argument("--stroke-rate-window", metavar="SPEC", default=None, help="Smoothing of the stroke rate, same SPEC as --power-window")
+        parser.add_argument("--speed-window", metavar="SPEC", default=None, help="Smoothing of the speed, same SPEC as --power-window")
+        parser.add_argument("--stroke-spill", metavar="FILE", default=None, help="Write the per stroke records of the S4 to FILE, only the last strokes are kept in memory")
+        parser.add_argument("--force-curve-file", metavar="FILE", default=None, help="Write the force curve of every SmartRow stroke to FILE")
+        parser.add_argument("--record-dir", metavar="DIR", default=None, help="Record every workout as columnar session files in a new folder in DIR")
+        parser.add_argument("--fit-dir", metavar="DIR", default=None, help="Write every workout as FIT activity file to DIR, e.g. for Strava or Garmin Connect")
+        parser.add_argument("--history-db", metavar="FILE", default=None, help="Add every finished workout with totals, splits and personal bests to the SQLite database FILE")
+        parser.add_argument("--smartrow-cache", metavar="FILE", default=str(pathlib.Path(__file__).parent.absolute()) + '/smartrow.json', help="Remember the MAC address and GATT handles of the SmartRow in FILE to connect it without discovery on the next start, empty to always discover")
+        parser.add_argument("--smartrow-relay", action='store_true', default=False, help="Pass the SmartRow through to the SmartRow app next to the BLE fitness machine, needs -i sr and -b")
         args = parser.parse_args()
         logger.info(args)
         main(args)